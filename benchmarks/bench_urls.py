@@ -0,0 +1,9 @@
+from django.conf.urls.defaults import *
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns = patterns('',
+	(r'^admin/', include(admin.site.urls)),
+	(r'^correx/', include('correx.urls')),
+)
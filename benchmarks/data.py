@@ -0,0 +1,133 @@
+"""
+Generates a synthetic changelog for the benchmarks.
+
+Nothing here should be pointed at a database you care about. The scripts
+that use it build a scratch SQLite database unless told otherwise.
+"""
+import os
+import sys
+import random
+import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup(database=None):
+	"""
+	Configures Django for a scratch database, throwing away any left by an
+	earlier run, and creates the tables.
+
+	If DJANGO_SETTINGS_MODULE is set those settings are used instead, which
+	lets the benchmarks run against another engine. Make sure they point at
+	a scratch database.
+	"""
+	if ROOT not in sys.path:
+		sys.path.insert(0, ROOT)
+	bench_dir = os.path.dirname(os.path.abspath(__file__))
+	if bench_dir not in sys.path:
+		sys.path.insert(0, bench_dir)
+	from django.conf import settings
+	if not os.environ.get('DJANGO_SETTINGS_MODULE'):
+		database = database or os.path.join(ROOT, 'bench.db')
+		if os.path.exists(database):
+			os.remove(database)
+		settings.configure(
+			DATABASE_ENGINE='sqlite3',
+			DATABASE_NAME=database,
+			INSTALLED_APPS=['django.contrib.auth', 'django.contrib.contenttypes', 'django.contrib.sessions',
+				'django.contrib.sites', 'django.contrib.admin', 'correx'],
+			MIDDLEWARE_CLASSES=['django.contrib.sessions.middleware.SessionMiddleware', 'django.contrib.auth.middleware.AuthenticationMiddleware'],
+			ROOT_URLCONF='bench_urls',
+			SITE_ID=1,
+		)
+	from django.core.management import call_command
+	call_command('syncdb', interactive=False, verbosity=0)
+	call_command('loaddata', 'correx_sample_changetypes', verbosity=0)
+
+
+def executemany(table, columns, rows):
+	from django.db import connection, transaction
+	qn = connection.ops.quote_name
+	sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+		qn(table), ', '.join([qn(c) for c in columns]), ', '.join(['%s'] * len(columns)))
+	connection.cursor().executemany(sql, rows)
+	transaction.commit_unless_managed()
+
+
+def seed(rows=2000000, sites=10, users=500, apps=20, models_per_app=5, objects_per_model=50000, change_types=4, batch_size=20000, seed_value=0):
+	"""
+	Fills the changelog with ``rows`` random changes spread across the
+	provided number of sites, users, apps, models, objects and change types,
+	and returns a dictionary of the ids it created.
+
+	Most changes point at made-up models in made-up apps. One in ten points
+	at one of the seeded users or sites instead, so there are real objects
+	for the object and model tags and the admin to find.
+
+	About nine in ten changes are public and their dates are scattered over
+	the last ten years. Runs are repeatable for the same ``seed_value``.
+	"""
+	from django.contrib.auth.models import User
+	from django.contrib.sites.models import Site
+	from django.contrib.contenttypes.models import ContentType
+	from correx.models import Change, ChangeType, ChangeSummary, ChangeRollup
+	from correx import search
+
+	rand = random.Random(seed_value)
+	first_site = 1000
+	executemany('django_site', ('id', 'domain', 'name'),
+		[(first_site + i, 'site%s.example.com' % i, 'Site %s' % i) for i in range(sites)])
+	first_user = 1000
+	executemany('auth_user', ('id', 'username', 'first_name', 'last_name', 'email', 'password', 'is_staff', 'is_active', 'is_superuser', 'last_login', 'date_joined'),
+		[(first_user + i, 'user%s' % i, '', '', '', '!', False, True, False, '2009-01-01 00:00:00', '2009-01-01 00:00:00') for i in range(users)])
+	content_types = []
+	for a in range(apps):
+		for m in range(models_per_app):
+			ct = ContentType.objects.create(name='model %s' % m, app_label='benchapp%s' % a, model='model%s' % m)
+			content_types.append((ct.pk, ct.app_label))
+	# (content_type_id, app_label, first object id, last object id)
+	targets = [(ct_id, app_label, 1, objects_per_model) for ct_id, app_label in content_types]
+	real = [
+		(ContentType.objects.get_for_model(User).pk, 'auth', first_user, first_user + users - 1),
+		(ContentType.objects.get_for_model(Site).pk, 'sites', first_site, first_site + sites - 1),
+	]
+	for i in range(max(change_types - ChangeType.objects.count(), 0)):
+		ChangeType.objects.create(name='Type %s' % i, slug='type-%s' % i)
+	change_type_ids = list(ChangeType.objects.values_list('pk', flat=True))
+
+	now = datetime.datetime(2010, 1, 1)
+	span = 60 * 60 * 24 * 365 * 10
+	columns = ('description', 'change_type_id', 'pub_date', 'is_public', 'user_id', 'site_id', 'content_app', 'content_type_id', 'object_id')
+	batch = []
+	for i in xrange(rows):
+		if rand.random() < 0.1:
+			ct_id, app_label, first, last = rand.choice(real)
+		else:
+			ct_id, app_label, first, last = rand.choice(targets)
+		pub_date = now - datetime.timedelta(seconds=rand.randint(0, span))
+		batch.append((
+			'Synthetic change %s' % i,
+			rand.choice(change_type_ids),
+			pub_date.strftime('%Y-%m-%d %H:%M:%S'),
+			rand.random() < 0.9,
+			first_user + rand.randint(0, users - 1),
+			first_site + rand.randint(0, sites - 1),
+			app_label,
+			ct_id,
+			rand.randint(first, last),
+		))
+		if len(batch) >= batch_size:
+			executemany(Change._meta.db_table, columns, batch)
+			batch = []
+	if batch:
+		executemany(Change._meta.db_table, columns, batch)
+	ChangeType.objects.recount()
+	ChangeSummary.objects.rebuild()
+	ChangeRollup.objects.rebuild()
+	search.rebuild(batch_size)
+	return {
+		'sites': range(first_site, first_site + sites),
+		'users': range(first_user, first_user + users),
+		'content_types': content_types,
+		'change_types': change_type_ids,
+	}
@@ -0,0 +1,135 @@
+"""
+Compares the public changelog queries with and without the composite
+indexes in correx/sql/change.sql.
+
+Seeds a scratch database, times each query shape used by the template tags
+and ChangeManager.live() and prints its plan, then adds the indexes and
+does it all again.
+
+Usage::
+
+	python benchmarks/indexes.py --rows=2000000 --json=indexes.json
+
+"""
+import os
+import re
+import sys
+import time
+from optparse import OptionParser
+
+from data import ROOT, setup, seed
+
+INDEX_SQL = os.path.join(ROOT, 'correx', 'sql', 'change.sql')
+
+
+def get_index_statements():
+	"""
+	Returns a list of (name, statement) pairs read from the custom SQL file.
+	"""
+	sql = re.sub(r'--.*', '', open(INDEX_SQL).read())
+	statements = [s.strip() for s in sql.split(';') if s.strip()]
+	return [(re.search(r'CREATE INDEX (\w+)', s).group(1), s) for s in statements]
+
+
+def execute(sql, params=()):
+	from django.db import connection, transaction
+	cursor = connection.cursor()
+	cursor.execute(sql, params)
+	transaction.commit_unless_managed()
+	return cursor
+
+
+def drop_indexes():
+	for name, statement in get_index_statements():
+		try:
+			execute('DROP INDEX %s' % name)
+		except Exception:
+			from django.db import transaction
+			transaction.rollback_unless_managed()
+
+
+def create_indexes():
+	for name, statement in get_index_statements():
+		execute(statement)
+
+
+def get_querysets(ids):
+	"""
+	The queries behind each template tag, pointed at the busiest scopes.
+	"""
+	from correx.models import Change
+	ct_id, app_label = ids['content_types'][0]
+	return [
+		('latest', Change.objects.live().order_by('-pub_date')[:5]),
+		('object', Change.objects.filter(is_public=True, content_type=ct_id, object_id=1).order_by('-pub_date')[:5]),
+		('model', Change.objects.filter(is_public=True, content_type=ct_id).order_by('-pub_date')[:5]),
+		('app', Change.objects.filter(is_public=True, content_app=app_label).order_by('-pub_date')[:5]),
+		('site', Change.objects.filter(is_public=True, site=ids['sites'][0]).order_by('-pub_date')[:5]),
+		('user', Change.objects.filter(is_public=True, user=ids['users'][0]).order_by('-pub_date')[:5]),
+	]
+
+
+def explain(qs):
+	from django.conf import settings
+	sql, params = qs.query.as_sql()
+	if settings.DATABASE_ENGINE == 'sqlite3':
+		prefix = 'EXPLAIN QUERY PLAN '
+	else:
+		prefix = 'EXPLAIN '
+	return [' '.join([str(col) for col in row]) for row in execute(prefix + sql, params).fetchall()]
+
+
+def measure(qs, repeat):
+	"""
+	Returns the median time in milliseconds of running the query ``repeat`` times.
+	"""
+	timings = []
+	for i in range(repeat):
+		start = time.time()
+		list(qs._clone())
+		timings.append((time.time() - start) * 1000)
+	timings.sort()
+	return timings[len(timings) // 2]
+
+
+def run(ids, repeat):
+	results = {}
+	for name, qs in get_querysets(ids):
+		results[name] = {'median_ms': measure(qs, repeat), 'plan': explain(qs)}
+	return results
+
+
+def main():
+	parser = OptionParser(usage='%prog [options]')
+	parser.add_option('--rows', type='int', default=2000000, help='The number of changes to seed. Defaults to 2,000,000.')
+	parser.add_option('--repeat', type='int', default=20, help='How many times to run each query. Defaults to 20.')
+	parser.add_option('--database', default=None, help='The path of the scratch SQLite database. Defaults to bench.db in the project root.')
+	parser.add_option('--json', dest='json_path', default=None, help='Also write the results as JSON to this path.')
+	options, args = parser.parse_args()
+
+	setup(options.database)
+	drop_indexes()
+	print 'Seeding %s changes...' % options.rows
+	ids = seed(rows=options.rows)
+
+	execute('ANALYZE')
+	before = run(ids, options.repeat)
+	create_indexes()
+	execute('ANALYZE')
+	after = run(ids, options.repeat)
+
+	for name, qs in get_querysets(ids):
+		print
+		print '%s: %.2fms -> %.2fms' % (name, before[name]['median_ms'], after[name]['median_ms'])
+		print '  before: %s' % '\n          '.join(before[name]['plan'])
+		print '  after:  %s' % '\n          '.join(after[name]['plan'])
+
+	if options.json_path:
+		from django.utils import simplejson
+		out = open(options.json_path, 'w')
+		simplejson.dump({'rows': options.rows, 'before': before, 'after': after}, out, indent=2)
+		out.close()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,192 @@
+"""
+Times the hot paths of correx against a seeded changelog.
+
+Covers saving, publishing, retyping and deleting changes, rendering each
+template tag, loading the admin changelist and calling the public views.
+For each one it records the median, 95th percentile and fastest wall
+time, the number of queries run and how far the process's peak memory
+grew, and prints a table. Use --json to keep the results for comparing
+one version against another.
+
+Usage::
+
+	python benchmarks/suite.py --rows=1000000 --json=results.json
+	python benchmarks/suite.py --only=tag --repeat=50
+
+"""
+import sys
+import time
+import platform
+import resource
+from optparse import OptionParser
+
+from data import setup, seed
+
+
+class Benchmark(object):
+	"""
+	A named operation to time. ``func`` is called once per run; ``prepare``,
+	if given, is called before each run, outside the timer, and its return
+	value passed to ``func``.
+	"""
+	def __init__(self, group, name, func, prepare=None):
+		self.group = group
+		self.name = name
+		self.func = func
+		self.prepare = prepare
+
+	def call(self):
+		if self.prepare:
+			return self.func(self.prepare())
+		return self.func()
+
+	def run(self, repeat):
+		from django.conf import settings
+		from django.db import connection
+
+		# One run with the query log on to count the queries...
+		settings.DEBUG = True
+		connection.queries = []
+		self.call()
+		queries = len(connection.queries)
+		settings.DEBUG = False
+		connection.queries = []
+
+		# ...and the rest with it off for the timings
+		rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		timings = []
+		for i in range(repeat):
+			arg = None
+			if self.prepare:
+				arg = self.prepare()
+			start = time.time()
+			if self.prepare:
+				self.func(arg)
+			else:
+				self.func()
+			timings.append((time.time() - start) * 1000)
+		timings.sort()
+		return {
+			'group': self.group,
+			'name': self.name,
+			'runs': repeat,
+			'median_ms': timings[len(timings) // 2],
+			'p95_ms': timings[min(int(len(timings) * 0.95), len(timings) - 1)],
+			'min_ms': timings[0],
+			'queries': queries,
+			'peak_rss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before,
+		}
+
+
+def get_benchmarks(ids):
+	from django.template import Template, Context
+	from django.test.client import Client
+	from django.contrib.auth.models import User
+	from django.contrib.sites.models import Site
+	from correx.models import Change
+
+	benchmarks = []
+	site_id = ids['sites'][0]
+	user = User.objects.get(pk=ids['users'][0])
+	site = Site.objects.get(pk=site_id)
+	change_type = ids['change_types'][0]
+	other_type = ids['change_types'][-1]
+
+	# The write path
+	def new_change(is_public=True):
+		return Change.objects.create(description='Benchmark change', change_type_id=change_type,
+			site_id=site_id, user=user, content_app='auth', is_public=is_public)
+	def publish(change):
+		change.is_public = True
+		change.save()
+	def retype(change):
+		change.change_type_id = other_type
+		change.save()
+	benchmarks += [
+		Benchmark('write', 'create', new_change),
+		Benchmark('write', 'publish', publish, lambda: new_change(is_public=False)),
+		Benchmark('write', 'retype', retype, new_change),
+		Benchmark('write', 'delete', lambda change: change.delete(), new_change),
+	]
+
+	# The template tags
+	users = list(User.objects.filter(pk__in=ids['users'][:50]))
+	tags = [
+		('get_latest_changes', '{% get_latest_changes 5 as change_list %}'),
+		('get_changes_for_site', '{% get_changes_for_site ' + str(site_id) + ' 5 as change_list %}'),
+		('get_changes_for_app', '{% get_changes_for_app auth 5 as change_list %}'),
+		('get_changes_for_model', '{% get_changes_for_model auth.User 5 as change_list %}'),
+		('get_changes_for_object', '{% get_changes_for_object obj 5 as change_list %}'),
+		('get_changes_for_user', '{% get_changes_for_user ' + user.username + ' 5 as change_list %}'),
+		('get_changes_for_objects', '{% get_changes_for_objects objects 5 as change_list %}'),
+		('get_latest_changes_by', '{% get_latest_changes_by type 5 as change_list %}'),
+	]
+	for name, source in tags:
+		t = Template('{% load correx_tags %}' + source + '{% for c in change_list %}{{ c.description }}{% endfor %}')
+		benchmarks.append(Benchmark('tag', name, lambda t=t: t.render(Context({'obj': user, 'objects': users}))))
+
+	# The admin and the public views
+	User.objects.create_superuser('benchadmin', 'bench@example.com', 'bench')
+	client = Client()
+	client.login(username='benchadmin', password='bench')
+	pages = [
+		('admin', 'changelist', '/admin/correx/change/'),
+		('admin', 'changelist_filtered', '/admin/correx/change/?site__id__exact=%s' % site_id),
+		('admin', 'changelist_search', '/admin/correx/change/?q=synthetic+777'),
+		('view', 'filter_contenttypes_by_app', '/correx/admin/filter/contenttype/?app_label=auth'),
+		('view', 'contenttypes_by_app', '/correx/admin/filter/contenttype/all/'),
+		('view', 'change_api', '/correx/api/changes/?site=%s' % site_id),
+		('view', 'change_feed', '/correx/feeds/rss/site/%s/' % site_id),
+	]
+	for group, name, url in pages:
+		benchmarks.append(Benchmark(group, name, lambda url=url: client.get(url)))
+	return benchmarks
+
+
+def main():
+	parser = OptionParser(usage='%prog [options]')
+	parser.add_option('--rows', type='int', default=1000000, help='The number of changes to seed. Defaults to 1,000,000.')
+	parser.add_option('--sites', type='int', default=10)
+	parser.add_option('--users', type='int', default=500)
+	parser.add_option('--apps', type='int', default=20)
+	parser.add_option('--models-per-app', dest='models_per_app', type='int', default=5)
+	parser.add_option('--change-types', dest='change_types', type='int', default=4)
+	parser.add_option('--repeat', type='int', default=20, help='How many times to time each operation. Defaults to 20.')
+	parser.add_option('--only', default=None, help='Only run the benchmarks in this group: write, tag, admin or view.')
+	parser.add_option('--database', default=None, help='The path of the scratch SQLite database. Defaults to bench.db in the project root.')
+	parser.add_option('--json', dest='json_path', default=None, help='Also write the results as JSON to this path.')
+	options, args = parser.parse_args()
+
+	setup(options.database)
+	start = time.time()
+	ids = seed(rows=options.rows, sites=options.sites, users=options.users, apps=options.apps,
+		models_per_app=options.models_per_app, change_types=options.change_types)
+	print 'Seeded %s changes in %.1f seconds' % (options.rows, time.time() - start)
+
+	results = []
+	for benchmark in get_benchmarks(ids):
+		if options.only and benchmark.group != options.only:
+			continue
+		result = benchmark.run(options.repeat)
+		results.append(result)
+		print '%-6s %-28s %9.2fms median %9.2fms p95 %5s queries %8skb peak growth' % (
+			result['group'], result['name'], result['median_ms'], result['p95_ms'], result['queries'], result['peak_rss_growth_kb'])
+
+	if options.json_path:
+		import django
+		from django.conf import settings
+		from django.utils import simplejson
+		out = open(options.json_path, 'w')
+		simplejson.dump({
+			'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'python': platform.python_version(),
+			'django': django.get_version(),
+			'engine': settings.DATABASE_ENGINE,
+			'options': options.__dict__,
+			'results': results,
+		}, out, indent=2)
+		out.close()
+
+
+if __name__ == '__main__':
+	main()
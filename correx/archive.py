@@ -0,0 +1,183 @@
+"""
+Moves old changes out of the changelog into an archive table.
+
+The pages built from the changelog only ever show its newest changes, yet
+its indexes and queries cover every change ever made. ``archive()`` moves
+the changes published before a cutoff, CORREX_ARCHIVE_DAYS ago by default
+(730), into the ``ArchivedChange`` table, a range of ids at a time. Each
+batch is copied and removed in its own transaction, and changes that were
+copied but not removed are only removed, so a run that is stopped part
+way can simply be started again. The ``archive_changes`` management command runs
+it from cron.
+
+``Change.objects`` and everything built on it read only the changelog.
+``Change.objects.history()`` reads both::
+
+	Change.objects.history().filter(site=site, is_public=True)[:100]
+
+The archived changes still count towards the change types' totals, the
+summaries and the rollups, and their recounts and rebuilds read both
+tables. The move leaves the totals and summaries alone and marks the
+rollups it moves as archived, so the admin's filters and date drill-down,
+which list the changelog alone, can leave them out. Archived changes are
+no longer matched by searches.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from correx import caching, rollups, search
+from correx.routing import on_primary
+
+
+def get_cutoff(days=None):
+	"""
+	Returns the date before which changes are archived, ``days`` ago or
+	CORREX_ARCHIVE_DAYS ago.
+	"""
+	if days is None:
+		days = getattr(settings, 'CORREX_ARCHIVE_DAYS', 730)
+	return datetime.datetime.now() - datetime.timedelta(days=days)
+
+
+@transaction.commit_on_success
+def archive_batch(low, high, cutoff):
+	"""
+	Moves the changes published before ``cutoff`` with ids from ``low`` up
+	to and including ``high`` into the archive, retiring the cached lists
+	they were in. Returns the number moved.
+
+	A change that a run stopped part way already copied is only removed
+	from the changelog. One whose id the archive holds with another
+	publication date is a different change and is left where it is.
+	"""
+	from correx.models import Change, ArchivedChange
+	from correx.bulk import get_groups
+	qn = connection.ops.quote_name
+	changelog, archive = qn(Change._meta.db_table), qn(ArchivedChange._meta.db_table)
+	pk, pub_date = qn(Change._meta.pk.column), qn(Change._meta.get_field('pub_date').column)
+	columns = ', '.join([qn(f.column) for f in Change._meta.local_fields])
+	where = '%s.%s >= %%s AND %s.%s <= %%s AND %s.%s < %%s' % (changelog, pk, changelog, pk, changelog, pub_date)
+	params = [low, high, connection.ops.value_to_db_datetime(cutoff)]
+	batch = on_primary(Change.objects.filter(pk__gte=low, pk__lte=high, pub_date__lt=cutoff))
+	scopes = set()
+	groups = get_groups(batch)
+	for state, count in groups:
+		scopes.update(caching.get_changed_scopes(state, None))
+	ids = set(batch.values_list('pk', flat=True))
+	cursor = connection.cursor()
+	cursor.execute('INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s AND NOT EXISTS (SELECT 1 FROM %s WHERE %s.%s = %s.%s)' % (
+		archive, columns, columns, changelog, where, archive, archive, pk, changelog, pk), params)
+	cursor.execute('DELETE FROM %s WHERE %s AND EXISTS (SELECT 1 FROM %s WHERE %s.%s = %s.%s AND %s.%s = %s.%s)' % (
+		changelog, where, archive, archive, pk, changelog, pk, archive, pub_date, changelog, pub_date), params)
+	moved = ids - set(batch.values_list('pk', flat=True))
+	if len(moved) < len(ids):
+		# Some were left behind, so the groups have to be read from what moved
+		groups = get_groups(ArchivedChange.objects.filter(pk__in=list(moved)))
+	archived = []
+	for state, count in groups:
+		after = state.copy()
+		after['archived'] = True
+		archived.append((state, after, count))
+	rollups.update_rollups(archived)
+	search.remove_changes(list(moved))
+	caching.bump_generations(scopes)
+	return len(moved)
+
+
+def archive(cutoff=None, batch_size=1000, pause=0, progress=None):
+	"""
+	Moves every change published before ``cutoff``, or before
+	``get_cutoff()``, into the archive, in ranges of up to ``batch_size``
+	ids, oldest first, waiting ``pause`` seconds between batches.
+
+	The change with the highest id always stays in the changelog, whatever
+	its date. SQLite, and MySQL after a restart, hand out new ids from the
+	highest one in the table, so keeping it there means an id that was
+	archived is never given to a new change.
+
+	If provided, ``progress`` is called with the running total after each
+	batch. Returns the number of changes moved.
+	"""
+	from correx.models import Change
+	if cutoff is None:
+		cutoff = get_cutoff()
+	newest = list(on_primary(Change.objects.order_by('-pk')).values_list('pk', flat=True)[:1])
+	if not newest:
+		return 0
+	total, last = 0, 0
+	while True:
+		ids = list(on_primary(Change.objects.filter(pub_date__lt=cutoff, pk__gt=last, pk__lt=newest[0])).order_by(
+			'pk').values_list('pk', flat=True)[:batch_size])
+		if not ids:
+			break
+		total += archive_batch(ids[0], ids[-1], cutoff)
+		last = ids[-1]
+		if progress:
+			progress(total)
+		if pause:
+			time.sleep(pause)
+	return total
+
+
+def get_querysets(chunk_size=None):
+	"""
+	Returns querysets that between them cover every change, in the
+	changelog and then its archive. With a ``chunk_size`` each covers a
+	range of that many ids, so the grouped counts run over them take a
+	bounded time however large the tables grow.
+	"""
+	from django.db.models import Min, Max
+	from correx.models import Change, ArchivedChange
+	querysets = []
+	for model in (Change, ArchivedChange):
+		if not chunk_size:
+			querysets.append(model.objects.all())
+			continue
+		bounds = model.objects.aggregate(low=Min('id'), high=Max('id'))
+		if bounds['low'] is None:
+			continue
+		for low in range(bounds['low'], bounds['high'] + 1, chunk_size):
+			querysets.append(model.objects.filter(pk__gte=low, pk__lt=low + chunk_size))
+	return querysets
+
+
+class History(object):
+	"""
+	The changes in both the changelog and its archive, newest first.
+
+	Supports the parts of a queryset a paginator or template needs:
+	``filter()``, ``exclude()``, ``count()``, iteration and slicing. A
+	slice reads up to its end from each table and merges them, so it costs
+	two queries.
+	"""
+	def __init__(self, querysets):
+		self.querysets = [qs.order_by('-pub_date', '-id') for qs in querysets]
+
+	def filter(self, *args, **kwargs):
+		return History([qs.filter(*args, **kwargs) for qs in self.querysets])
+
+	def exclude(self, *args, **kwargs):
+		return History([qs.exclude(*args, **kwargs) for qs in self.querysets])
+
+	def count(self):
+		return sum([qs.count() for qs in self.querysets])
+
+	def merge(self, lists):
+		changes = []
+		for changes_list in lists:
+			changes.extend(changes_list)
+		changes.sort(key=lambda c: (c.pub_date, c.pk), reverse=True)
+		return changes
+
+	def __iter__(self):
+		return iter(self.merge([list(qs) for qs in self.querysets]))
+
+	def __getitem__(self, k):
+		if isinstance(k, slice):
+			if k.stop is None or k.step is not None:
+				return self.merge([list(qs) for qs in self.querysets])[k]
+			return self.merge([list(qs[:k.stop]) for qs in self.querysets])[k]
+		return self[k:k + 1][0]
@@ -0,0 +1,175 @@
+"""
+Checks the totals correx keeps alongside the changelog, and repairs them.
+
+The change types' ``change_count``, the summaries, the daily rollups and
+the search index are kept up to date as changes are written, but raw SQL,
+``QuerySet.update()``, transactions that failed part way and races between
+workers can leave them off. ``audit()`` recounts all of them with grouped
+queries over ``chunk_size`` ids of the changelog and its archive at a
+time, so each query takes a bounded time however large the tables grow,
+and reports every row that is off. With ``fix`` it then repairs only
+those rows, in one transaction.
+
+The ``audit_changes`` management command runs it and prints the report as
+JSON::
+
+	python manage.py audit_changes --dry-run
+
+Changes written while the audit runs can show up as drift that isn't
+there. The repairs recount each row they touch afresh rather than trusting
+the audit's figures, so that costs a little work but never a wrong total.
+"""
+from django.db import connection, transaction
+
+from correx import counters, rollups, search, summaries
+
+
+def get_drift(stored, actual, missing=None):
+	"""
+	Compares two dictionaries of totals and returns a sorted list of
+	(key, stored, actual) triples for every key where they differ, with
+	``missing`` standing in for a key one side lacks.
+	"""
+	drift = []
+	for key in set(stored) | set(actual):
+		if stored.get(key, missing) != actual.get(key, missing):
+			drift.append((key, stored.get(key, missing), actual.get(key, missing)))
+	drift.sort()
+	return drift
+
+
+def check_types(chunk_size=None):
+	from correx.models import ChangeType
+	stored = dict(ChangeType.objects.values_list('pk', 'change_count'))
+	actual = counters.count(chunk_size=chunk_size)
+	return get_drift(stored, dict([(pk, actual.get(pk, 0)) for pk in stored]))
+
+
+def check_summaries(chunk_size=None):
+	"""
+	Compares the summaries a kind of scope at a time, so only one kind's
+	rows are held at once.
+	"""
+	from correx.models import ChangeSummary
+	drift = []
+	for kind in summaries.SCOPE_FIELDS:
+		stored = {}
+		for scope, change_type, change_count, last_pub_date in ChangeSummary.objects.filter(
+				scope__startswith='%s:' % kind).values_list('scope', 'change_type', 'change_count', 'last_pub_date'):
+			stored[(scope, change_type)] = (change_count, last_pub_date)
+		drift.extend(get_drift(stored, summaries.count(chunk_size=chunk_size, kinds=[kind]), (0, None)))
+	drift.sort()
+	return drift
+
+
+def check_rollups(chunk_size=None):
+	from correx.models import ChangeRollup
+	stored = {}
+	for values in ChangeRollup.objects.values_list('day', 'change_type', 'site', 'content_app', 'is_public', 'archived', 'change_count'):
+		stored[tuple(values[:4]) + (bool(values[4]), bool(values[5]))] = values[6]
+	actual = dict([(key[:4] + (bool(key[4]), key[5]), total) for key, total in rollups.count(chunk_size).items()])
+	return get_drift(stored, actual, 0)
+
+
+def check_search(chunk_size=None):
+	"""
+	Returns a (missing, stale) pair of lists of the ids of changes the
+	search index lacks and of the ids it holds for changes that are gone,
+	or None if there is no index to check.
+	"""
+	from django.db.models import Min, Max
+	from correx.models import Change
+	backend = search.get_backend()
+	cursor = connection.cursor()
+	bounds = backend.get_bounds(cursor)
+	if bounds is None:
+		return None
+	changes = Change.objects.aggregate(low=Min('id'), high=Max('id'))
+	lows = [b for b in (bounds[0], changes['low']) if b is not None]
+	if not lows:
+		return [], []
+	low = min(lows)
+	high = max([b for b in (bounds[1], changes['high']) if b is not None]) + 1
+	step = chunk_size or high - low
+	missing, stale = [], []
+	for start in range(low, high, step):
+		end = min(start + step, high)
+		indexed = backend.get_ids(cursor, start, end)
+		ids = set(Change.objects.filter(pk__gte=start, pk__lt=end).values_list('pk', flat=True))
+		missing.extend(sorted(ids - indexed))
+		stale.extend(sorted(indexed - ids))
+	return missing, stale
+
+
+def check(chunk_size=None):
+	"""
+	Recounts everything and returns a dictionary of the drift found by
+	each of the ``check_*`` functions, keyed by what they check.
+	"""
+	return {
+		'change_types': check_types(chunk_size),
+		'summaries': check_summaries(chunk_size),
+		'rollups': check_rollups(chunk_size),
+		'search': check_search(chunk_size),
+	}
+
+
+@transaction.commit_on_success
+def repair(drift, chunk_size=1000):
+	"""
+	Recounts the rows listed in the drift returned by ``check`` and puts
+	the search index right, all in one transaction.
+	"""
+	from correx.models import ChangeType, Change
+	if drift['change_types']:
+		ChangeType.objects.recount([pk for pk, stored, actual in drift['change_types']])
+	for (scope, change_type), stored, actual in drift['summaries']:
+		summaries.refresh(scope, change_type)
+	for key, stored, actual in drift['rollups']:
+		rollups.refresh(key)
+	if drift['search']:
+		missing, stale = drift['search']
+		for i in range(0, len(missing), chunk_size):
+			search.index_changes(list(Change.objects.filter(pk__in=missing[i:i + chunk_size]).values_list('pk', 'description')))
+		if stale:
+			search.remove_changes(stale)
+
+
+def get_report(drift, fixed=False):
+	"""
+	Returns the drift returned by ``check`` as a dictionary of lists and
+	numbers that can be written out as JSON.
+	"""
+	from correx.models import QueuedCount
+	report = {
+		'change_types': [],
+		'summaries': [],
+		'rollups': [],
+		'search': None,
+		'queued': QueuedCount.objects.count(),
+		'fixed': fixed,
+	}
+	for pk, stored, actual in drift['change_types']:
+		report['change_types'].append({'change_type': pk, 'stored': stored, 'actual': actual})
+	for (scope, change_type), stored, actual in drift['summaries']:
+		report['summaries'].append({'scope': scope, 'change_type': change_type,
+			'stored': stored[0], 'actual': actual[0],
+			'stored_last_pub_date': stored[1], 'actual_last_pub_date': actual[1]})
+	for key, stored, actual in drift['rollups']:
+		row = dict(zip(('day', 'change_type', 'site', 'content_app', 'is_public', 'archived'), key))
+		row.update({'stored': stored, 'actual': actual})
+		report['rollups'].append(row)
+	if drift['search'] is not None:
+		report['search'] = {'missing': drift['search'][0], 'stale': drift['search'][1]}
+	return report
+
+
+def audit(fix=False, chunk_size=10000):
+	"""
+	Recounts everything, repairs what is off if ``fix`` is True, and
+	returns the report from ``get_report``.
+	"""
+	drift = check(chunk_size)
+	if fix:
+		repair(drift)
+	return get_report(drift, fix)
@@ -0,0 +1,106 @@
+"""
+Publishing, unpublishing and retyping changes in bulk.
+
+``QuerySet.update()`` skips the model signals that keep the change type
+totals, the summaries and the cached lists and feeds in step, and saving
+a selection one change at a time fires them once per row. The functions
+here write the whole selection with one UPDATE instead, and then send the
+``changes_updated`` signal once for the batch, which the handlers in
+``correx.signals`` answer with one round of fixes each.
+
+They are also available on the changes' querysets::
+
+	Change.objects.filter(pub_date__gte=today).publish()
+	Change.objects.filter(pk__in=ids).retype('Correction')
+
+"""
+from django.db import transaction
+from django.db.models import Count, Max
+from django.dispatch import Signal
+
+from correx.signals import TRACKED_FIELDS
+from correx.routing import on_primary
+from correx.rollups import get_day_sql
+from correx.summaries import to_datetime
+
+# Sent with a list of (before, after, count) triples, where before and
+# after are states like those in ``correx.signals`` and count is the number
+# of changes that went from one to the other. The changes in a group share
+# a day of publication, and the states carry the newest of their dates. Before is None for changes created in bulk, as by
+# ``correx.capture``.
+changes_updated = Signal(providing_args=['groups'])
+
+# The fields a bulk update can change, by the names the states use
+UPDATABLE_FIELDS = {
+	'is_public': 'is_public',
+	'change_type_id': 'change_type',
+}
+
+
+def get_groups(queryset):
+	"""
+	Returns a list of (state, count) pairs that sorts the changes in a
+	queryset by every field their totals, summaries, rollups and cached
+	lists depend on, using one grouped query.
+	"""
+	from correx.models import Change
+	attnames = [a for a in TRACKED_FIELDS if a != 'pub_date']
+	names = dict([(f.attname, f.name) for f in Change._meta.local_fields])
+	rows = queryset.extra(select={'day': get_day_sql(queryset.model)}).values_list(
+		*[names[a] for a in attnames] + ['day']).annotate(last=Max('pub_date')).annotate(total=Count('id')).order_by()
+	groups = []
+	for row in rows:
+		state = dict(zip(attnames, row[:-3]))
+		state['is_public'] = bool(state['is_public'])
+		state['pub_date'] = to_datetime(row[-2])
+		groups.append((state, row[-1]))
+	return groups
+
+
+@transaction.commit_on_success
+def update_changes(queryset, **values):
+	"""
+	Sets the provided values, given by the attribute names in
+	``UPDATABLE_FIELDS``, on every change in a queryset with one UPDATE and
+	sends ``changes_updated`` for the changes that moved.
+
+	Returns the number of changes updated.
+	"""
+	from correx.models import Change
+	for attname in values:
+		if attname not in UPDATABLE_FIELDS:
+			raise ValueError('%s cannot be updated in bulk' % attname)
+	queryset = on_primary(queryset)
+	groups = get_groups(queryset)
+	rows = queryset.update(**dict([(UPDATABLE_FIELDS[k], v) for k, v in values.items()]))
+	moved = []
+	for before, count in groups:
+		after = before.copy()
+		after.update(values)
+		if after != before:
+			moved.append((before, after, count))
+	if moved:
+		changes_updated.send(sender=Change, groups=moved)
+	return rows
+
+
+def publish(queryset):
+	"""
+	Publishes every change in a queryset. Returns the number updated.
+	"""
+	return update_changes(queryset, is_public=True)
+
+
+def unpublish(queryset):
+	"""
+	Takes every change in a queryset off the live site. Returns the number updated.
+	"""
+	return update_changes(queryset, is_public=False)
+
+
+def retype(queryset, change_type):
+	"""
+	Gives every change in a queryset the provided change type, or the type
+	with the provided primary key. Returns the number updated.
+	"""
+	return update_changes(queryset, change_type_id=getattr(change_type, 'pk', change_type))
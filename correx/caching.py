@@ -0,0 +1,160 @@
+"""
+Optional caching of the change lists pulled by the template tags.
+
+Switched on by giving the CORREX_CACHE_TIMEOUT setting a number of seconds.
+
+Every scope a list can be drawn from -- all changes, a site, an app, a
+model, an object or a user -- has a generation number kept in the cache,
+and each cached list is keyed by the generation of its scope. When a
+public change is saved or deleted the generations of the scopes it belongs
+to, before and after the write, are bumped, which retires the lists that
+might include it and leaves the rest alone.
+
+The generations are kept whether or not caching is on, as the feeds' ETags
+are built from them too when the cache is shared between processes.
+
+Scopes are tuples like these::
+
+	('all',)
+	('site', 1)
+	('app', 'newspaper')
+	('model', content_type_id)
+	('object', content_type_id, object_id)
+	('user', user_id)
+
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import smart_str
+
+# How long a generation number is kept. It only needs to outlive the lists
+# keyed by it; if one is evicted it restarts from the clock, which puts it
+# ahead of any number it held before.
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+# The cache backends that keep a separate store in each process
+PROCESS_BACKENDS = ('locmem', 'simple', 'dummy')
+
+
+def is_enabled():
+	"""
+	Whether the CORREX_CACHE_TIMEOUT setting has switched caching on.
+	"""
+	return getattr(settings, 'CORREX_CACHE_TIMEOUT', None) is not None
+
+
+def is_shared():
+	"""
+	Whether the CACHE_BACKEND setting names a cache every process reads, so
+	they all see the same generations.
+	"""
+	return settings.CACHE_BACKEND.split(':', 1)[0] not in PROCESS_BACKENDS
+
+
+def make_key(*bits):
+	"""
+	Joins the provided bits into a cache key under the CORREX_CACHE_PREFIX setting.
+	"""
+	prefix = getattr(settings, 'CORREX_CACHE_PREFIX', 'correx')
+	return smart_str(':'.join([prefix] + [unicode(b) for b in bits])).replace(' ', '_')
+
+
+def get_generation(scope):
+	"""
+	Returns the current generation number for a scope, starting one if needed.
+	"""
+	key = make_key('generation', *scope)
+	generation = cache.get(key)
+	if generation is None:
+		cache.add(key, int(time.time() * 1000), GENERATION_TIMEOUT)
+		generation = cache.get(key)
+	return generation
+
+
+def bump_generations(scopes):
+	"""
+	Moves each of the provided scopes on to a new generation.
+	"""
+	for scope in scopes:
+		key = make_key('generation', *scope)
+		try:
+			cache.incr(key)
+		except ValueError:
+			cache.set(key, int(time.time() * 1000), GENERATION_TIMEOUT)
+
+
+def get_scopes(state):
+	"""
+	Returns the list of scopes that a change in the provided state, like the
+	ones recorded by the handlers in ``correx.signals``, would be listed under.
+	"""
+	scopes = [('all',)]
+	if state.get('site_id'):
+		scopes.append(('site', state['site_id']))
+	if state.get('content_app'):
+		scopes.append(('app', state['content_app']))
+	if state.get('content_type_id'):
+		scopes.append(('model', state['content_type_id']))
+		if state.get('object_id') is not None:
+			scopes.append(('object', state['content_type_id'], state['object_id']))
+	if state.get('user_id'):
+		scopes.append(('user', state['user_id']))
+	return scopes
+
+
+def get_changed_scopes(before, after):
+	"""
+	Returns the set of scopes of a change before and after a write, or an
+	empty set if it was private on both sides. Either state may be None.
+	"""
+	if not ((before and before['is_public']) or (after and after['is_public'])):
+		return set()
+	scopes = set()
+	for state in (before, after):
+		if state:
+			scopes.update(get_scopes(state))
+	return scopes
+
+
+def invalidate(before, after):
+	"""
+	Bumps the scopes of a change before and after a write, provided it was
+	public on at least one side, and returns them. Either state may be None.
+	"""
+	scopes = get_changed_scopes(before, after)
+	bump_generations(scopes)
+	return scopes
+
+
+def cached(scope, name, fetch):
+	"""
+	Returns a value for a scope from the cache, calling ``fetch`` to work it
+	out and store it when there isn't a current copy. ``name`` tells apart
+	the different values kept for the same scope.
+
+	When caching is off, or the scope is None, ``fetch()`` is returned
+	untouched.
+	"""
+	if not is_enabled() or scope is None:
+		return fetch()
+	key = make_key(name, get_generation(scope), *scope)
+	result = cache.get(key)
+	if result is None:
+		# Wrapped so that a value of None can be cached too
+		result = (fetch(),)
+		cache.set(key, result, settings.CORREX_CACHE_TIMEOUT)
+	return result[0]
+
+
+def cached_list(scope, name, num, fetch):
+	"""
+	Returns the list for a scope from the cache, calling ``fetch`` to pull and
+	store it when there isn't a current copy.
+
+	When caching is off ``fetch()`` is returned untouched.
+	"""
+	if not is_enabled():
+		return fetch()
+	return cached(scope, 'list:%s:%s' % (name, num), lambda: list(fetch()))
@@ -0,0 +1,311 @@
+"""
+Records a change automatically whenever a registered model is saved.
+
+Register the models to track, and optionally the fields whose edits are
+worth logging, from a models.py or urls.py that is loaded at start up::
+
+	from correx import capture
+	capture.register(Article, fields=['headline', 'body'], is_public=True)
+
+Each save then logs an "Update" change, or one of the type named by
+``change_type``, connected to the object, its model and app, and to the
+site in the SITE_ID setting. When ``fields`` is given, saves that leave
+all of them alone are skipped.
+
+Saved one at a time, each change costs as much as one added by hand. A
+script or request that edits thousands of objects can batch them instead:
+between ``begin()`` and ``flush()`` the changes are held in memory, one
+per object however often it is saved, and then written with one INSERT
+and one round of upkeep for the totals, summaries, rollups and cached
+lists::
+
+	capture.begin()
+	try:
+		for article in Article.objects.all():
+			article.save()
+		capture.flush()
+	except:
+		capture.discard()
+		raise
+
+The ``batched`` decorator does the same for a function, and
+``CaptureMiddleware`` for every request. Batches nest, so a batched
+function called during a batched request adds to the request's batch. List the middleware after
+TransactionMiddleware so the changes are written before the request's
+transaction is committed; it also credits the changes to the logged in user.
+"""
+import datetime
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import signals
+from django.utils.text import get_text_list
+from django.utils.translation import ugettext as _
+
+from correx.signals import TRACKED_FIELDS
+
+_registry = {}
+_local = threading.local()
+
+
+class AlreadyRegistered(Exception):
+	pass
+
+
+class NotRegistered(Exception):
+	pass
+
+
+def get_description(instance, fields):
+	"""
+	The default description of a captured change, naming the fields that
+	were edited when they are known.
+	"""
+	if not fields:
+		return _('Changed %s.') % instance
+	names = [unicode(instance._meta.get_field(name).verbose_name) for name in fields]
+	return _('Changed %(fields)s of %(object)s.') % {'fields': get_text_list(names, _('and')), 'object': instance}
+
+
+def register(model, fields=None, change_type='Update', description=get_description, is_public=False):
+	"""
+	Starts logging a change each time an instance of ``model`` is saved.
+
+	``fields``
+		The names of the fields whose edits are logged. Every save is logged
+		if it is left out.
+	``change_type``
+		The primary key of the ChangeType the changes are given.
+	``description``
+		A function that is passed the instance and a list of the edited
+		fields, or None for a new instance or where no fields were named,
+		and returns the change's description.
+	``is_public``
+		Whether the changes are published as they are logged.
+	"""
+	if model in _registry:
+		raise AlreadyRegistered('%s is already tracked' % model.__name__)
+	_registry[model] = {
+		'fields': fields and tuple(fields) or None,
+		'change_type': change_type,
+		'description': description,
+		'is_public': is_public,
+	}
+	uid = 'correx.capture.%s.%s' % (model._meta.app_label, model.__name__)
+	signals.pre_save.connect(remember_fields, sender=model, dispatch_uid=uid)
+	signals.post_save.connect(capture_change, sender=model, dispatch_uid=uid)
+
+
+def unregister(model):
+	"""
+	Stops logging changes for ``model``.
+	"""
+	if model not in _registry:
+		raise NotRegistered('%s is not tracked' % model.__name__)
+	del _registry[model]
+	uid = 'correx.capture.%s.%s' % (model._meta.app_label, model.__name__)
+	signals.pre_save.disconnect(sender=model, dispatch_uid=uid)
+	signals.post_save.disconnect(sender=model, dispatch_uid=uid)
+
+
+def is_registered(model):
+	return model in _registry
+
+
+def remember_fields(sender, instance, **kwargs):
+	"""
+	Records the stored values of the tracked fields before a save, when
+	only some fields are tracked.
+	"""
+	fields = _registry[sender]['fields']
+	instance._correx_prior_fields = None
+	if fields and instance.pk is not None:
+		rows = list(sender._default_manager.filter(pk=instance.pk).values_list(*fields)[:1])
+		if rows:
+			instance._correx_prior_fields = dict(zip(fields, rows[0]))
+
+
+def get_edited_fields(instance, fields):
+	"""
+	Returns the tracked fields a save changed, or None for a new instance.
+	"""
+	prior = getattr(instance, '_correx_prior_fields', None)
+	if prior is None:
+		return None
+	edited = []
+	for name in fields:
+		field = instance._meta.get_field(name)
+		if field.get_db_prep_save(getattr(instance, field.attname)) != field.get_db_prep_save(prior[name]):
+			edited.append(name)
+	return edited
+
+
+def capture_change(sender, instance, created, **kwargs):
+	"""
+	Logs a change for a save of a registered model, or holds it until the
+	batch is flushed.
+	"""
+	from django.contrib.contenttypes.models import ContentType
+	options = _registry[sender]
+	edited = None
+	if options['fields'] and not created:
+		edited = get_edited_fields(instance, options['fields'])
+		if edited == []:
+			return
+	content_type_id = ContentType.objects.get_for_model(sender).pk
+	key = (content_type_id, instance.pk)
+	pending = getattr(_local, 'pending', None)
+	if pending is not None and key in pending:
+		# The same object again within a batch, so add to the fields already edited
+		earlier = pending[key]['edited']
+		if earlier is not None and edited is not None:
+			edited = earlier + [name for name in edited if name not in earlier]
+		else:
+			edited = None
+	change = {
+		'description': options['description'](instance, edited),
+		'change_type_id': options['change_type'],
+		'is_public': options['is_public'],
+		'user_id': getattr(_local, 'user_id', None),
+		'site_id': getattr(settings, 'SITE_ID', None),
+		'content_app': sender._meta.app_label,
+		'content_type_id': content_type_id,
+		'object_id': instance.pk,
+		'edited': edited,
+	}
+	if pending is None:
+		from correx.models import Change
+		del change['edited']
+		Change.objects.create(**change)
+	else:
+		pending[key] = change
+
+
+def begin(user=None):
+	"""
+	Starts holding the changes captured on this thread until ``flush()`` or
+	``discard()``, crediting them to ``user`` if given.
+
+	Batches nest: inside one that is already open, ``begin()`` only counts
+	another level, and the matching ``flush()`` or ``discard()`` leaves the
+	changes to the outermost one.
+	"""
+	depth = getattr(_local, 'depth', 0)
+	if not depth:
+		_local.pending = {}
+		_local.user_id = getattr(user, 'pk', None)
+	_local.depth = depth + 1
+
+
+def end():
+	"""
+	Closes a level of batching. Returns True if it was the outermost.
+	"""
+	depth = getattr(_local, 'depth', 0)
+	if depth > 1:
+		_local.depth = depth - 1
+		return False
+	_local.depth = 0
+	return True
+
+
+def discard():
+	"""
+	Throws away the changes held since the outermost ``begin()`` and stops
+	holding them. Within a nested batch it only closes that level.
+	"""
+	if end():
+		_local.pending = None
+		_local.user_id = None
+
+
+def flush(chunk_size=1000):
+	"""
+	Writes the changes held since ``begin()`` with one INSERT, brings the
+	totals, summaries, rollups, cached lists and search index up to date
+	once for the lot, and stops holding them. Returns the number written,
+	which is 0 for a nested batch, as its changes wait for the outermost.
+	"""
+	from correx.models import Change
+	from correx.bulk import changes_updated
+	from correx import search
+	if not end():
+		return 0
+	pending = getattr(_local, 'pending', None)
+	_local.pending = None
+	_local.user_id = None
+	if not pending:
+		return 0
+	pub_date = datetime.datetime.now()
+	fields = [Change._meta.get_field(name) for name in
+		('description', 'change_type', 'pub_date', 'is_public', 'user', 'site', 'content_app', 'content_type', 'object_id')]
+	rows = []
+	groups = {}
+	for change in pending.values():
+		change['pub_date'] = pub_date
+		rows.append(tuple([f.get_db_prep_save(change[f.attname]) for f in fields]))
+		state = tuple([(attname, change[attname]) for attname in TRACKED_FIELDS])
+		groups[state] = groups.get(state, 0) + 1
+	# New rows get ids above the highest one there now
+	last = list(Change.objects.order_by('-pk').values_list('pk', flat=True)[:1])
+	last = last and last[0] or 0
+	qn = connection.ops.quote_name
+	cursor = connection.cursor()
+	cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (qn(Change._meta.db_table),
+		', '.join([qn(f.column) for f in fields]), ', '.join(['%s'] * len(fields))), rows)
+	# The new ids are needed for the search index. They are read back a
+	# chunk at a time, picking ours out from any other process's by object
+	indexed = []
+	while len(indexed) < len(rows):
+		written = list(Change.objects.filter(pk__gt=last).order_by('pk').values_list(
+			'pk', 'content_type', 'object_id', 'description')[:chunk_size])
+		if not written:
+			break
+		for pk, ct, obj, description in written:
+			change = pending.get((ct, obj))
+			if change is not None and change['description'] == description:
+				indexed.append((pk, description))
+		last = written[-1][0]
+	search.index_changes(indexed)
+	changes_updated.send(sender=Change, groups=[(None, dict(state), count) for state, count in groups.items()])
+	transaction.commit_unless_managed()
+	return len(rows)
+
+
+def batched(func):
+	"""
+	Holds the changes captured while a function runs and writes them in one
+	go when it returns.
+	"""
+	def wrapper(*args, **kwargs):
+		begin()
+		try:
+			result = func(*args, **kwargs)
+		except:
+			discard()
+			raise
+		flush()
+		return result
+	wrapper.__name__ = func.__name__
+	wrapper.__doc__ = func.__doc__
+	return wrapper
+
+
+class CaptureMiddleware(object):
+	"""
+	Holds the changes captured during each request and writes them in one
+	go at the end, credited to the logged in user.
+	"""
+	def process_request(self, request):
+		user = getattr(request, 'user', None)
+		if user is not None and not user.is_authenticated():
+			user = None
+		begin(user)
+
+	def process_response(self, request, response):
+		flush()
+		return response
+
+	def process_exception(self, request, exception):
+		discard()
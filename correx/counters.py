@@ -0,0 +1,108 @@
+"""
+Incremental maintenance of the ``ChangeType.change_count`` totals.
+
+Instead of recounting every type each time a ``Change`` is written, the
+handlers in ``correx.signals`` compare the row as it was stored before the
+write with the row as it is afterwards and move only the totals that are
+affected, each with a single atomic UPDATE.
+
+Busy sites can set CORREX_DEFERRED_COUNTS to True to take even that out
+of the request. Each write then only adds a row to a queue table for the
+types it touches, and the ``refresh_counts`` management command recounts
+the queued types, once each however many rows a burst of saves left
+behind. The queue rows are written in the same transaction as the change,
+so a rolled back save leaves nothing queued and the worker never sees a
+row before the change it stands for.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+
+
+def is_deferred():
+	"""
+	Whether the CORREX_DEFERRED_COUNTS setting has moved counting to the queue.
+	"""
+	return getattr(settings, 'CORREX_DEFERRED_COUNTS', False)
+
+
+def get_deltas(before, after):
+	"""
+	Compares two states, like those recorded by the handlers in
+	``correx.signals``, and returns a dictionary that maps each affected
+	change type's primary key to the amount its total should move.
+
+	Either state may be None, which stands for a row that does not exist.
+
+	Example::
+
+		>>> get_deltas({'change_type_id': 'Update', 'is_public': True}, {'change_type_id': 'Correction', 'is_public': True})
+		{'Update': -1, 'Correction': 1}
+
+	"""
+	deltas = {}
+	if before and before['is_public']:
+		pk = before['change_type_id']
+		deltas[pk] = deltas.get(pk, 0) - 1
+	if after and after['is_public']:
+		pk = after['change_type_id']
+		deltas[pk] = deltas.get(pk, 0) + 1
+	return dict([(k, v) for k, v in deltas.items() if v])
+
+
+def count(pks=None, chunk_size=None):
+	"""
+	Returns a dictionary that maps the primary key of every change type, or
+	only of those provided, that has live changes to how many it has in
+	the changelog and its archive, from grouped counts over ``chunk_size``
+	ids at a time or over each whole table.
+	"""
+	from correx.archive import get_querysets
+	totals = {}
+	for changes in get_querysets(chunk_size):
+		changes = changes.filter(is_public=True)
+		if pks is not None:
+			changes = changes.filter(change_type__in=list(pks))
+		for pk, total in changes.values_list('change_type').annotate(total=Count('id')).order_by():
+			totals[pk] = totals.get(pk, 0) + total
+	return totals
+
+
+def adjust_counts(deltas):
+	"""
+	Applies a dictionary of deltas, like the one returned by ``get_deltas``,
+	with one UPDATE per change type.
+	"""
+	from correx.models import ChangeType
+	for pk, delta in deltas.items():
+		ChangeType.objects.filter(pk=pk).update(change_count=F('change_count') + delta)
+
+
+def queue_counts(deltas):
+	"""
+	Queues a refresh of each change type in a dictionary of deltas.
+	"""
+	from correx.models import QueuedCount
+	for pk in deltas:
+		QueuedCount.objects.create(change_type_id=pk)
+
+
+@transaction.commit_on_success
+def refresh_queued(limit=1000):
+	"""
+	Recounts the change types behind up to ``limit`` queued rows and clears
+	those rows, in one transaction.
+
+	Returns a (rows, types) pair of the number of rows cleared and the
+	number of distinct types recounted.
+	"""
+	from correx.models import ChangeType, QueuedCount
+	rows = list(QueuedCount.objects.values_list('id', 'change_type')[:limit])
+	if not rows:
+		return 0, 0
+	pks = set([change_type for id, change_type in rows])
+	# Rows are cleared by id rather than by type, so ones queued by saves
+	# committed after they were read stay for the next pass
+	ChangeType.objects.recount(pks)
+	QueuedCount.objects.filter(id__in=[id for id, change_type in rows]).delete()
+	return len(rows), len(pks)
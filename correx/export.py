@@ -0,0 +1,110 @@
+"""
+Streaming exports of the changelog as JSON lines or CSV.
+
+The table is read in chunks by seeking past the last id seen, so memory
+stays flat however long it grows. Users, sites, change types and content
+types are written out by name, using maps held in memory rather than a
+join for every row.
+
+Example::
+
+	from correx.export import iter_changes, iter_csv, iter_gzip
+	out = open('changes.csv.gz', 'wb')
+	for chunk in iter_gzip(iter_csv(iter_changes())):
+		out.write(chunk)
+
+"""
+import csv
+import zlib
+from StringIO import StringIO
+
+from django.utils import simplejson
+from django.utils.encoding import smart_str
+
+FIELDS = ('id', 'pub_date', 'change_type', 'description', 'is_public', 'user', 'site', 'app', 'model', 'object_id')
+
+
+def iter_changes(queryset=None, chunk_size=1000):
+	"""
+	Yields a dictionary for every change in the queryset, all changes by
+	default, in order of id and ``chunk_size`` rows at a time.
+	"""
+	from django.contrib.auth.models import User
+	from django.contrib.sites.models import Site
+	from correx.models import Change
+	from correx.lookups import get_label
+	if queryset is None:
+		queryset = Change.objects.all()
+	queryset = queryset.order_by('id').values_list('id', 'pub_date', 'change_type', 'description',
+		'is_public', 'user', 'site', 'content_app', 'content_type', 'object_id')
+
+	sites = dict(Site.objects.values_list('id', 'domain'))
+	models = {}
+	users = {}
+
+	last_id = 0
+	while True:
+		rows = list(queryset.filter(id__gt=last_id)[:chunk_size])
+		if not rows:
+			break
+		missing = set([row[5] for row in rows if row[5] and row[5] not in users])
+		if missing:
+			users.update(dict(User.objects.filter(pk__in=list(missing)).values_list('id', 'username')))
+		for content_type in set([row[8] for row in rows if row[8] and row[8] not in models]):
+			label = get_label(content_type)
+			models[content_type] = label and '%s.%s' % label or None
+		for pk, pub_date, change_type, description, is_public, user, site, app, content_type, object_id in rows:
+			yield {
+				'id': pk,
+				'pub_date': pub_date.isoformat(),
+				'change_type': change_type,
+				'description': description,
+				'is_public': bool(is_public),
+				'user': users.get(user),
+				'site': sites.get(site),
+				'app': app,
+				'model': models.get(content_type),
+				'object_id': object_id,
+			}
+		last_id = rows[-1][0]
+
+
+def iter_ndjson(changes):
+	"""
+	Yields each change from ``iter_changes`` as a line of JSON.
+	"""
+	for change in changes:
+		yield simplejson.dumps(change) + '\n'
+
+
+def iter_csv(changes):
+	"""
+	Yields a header row and then each change from ``iter_changes`` as a line of CSV.
+	"""
+	buffer = StringIO()
+	writer = csv.writer(buffer)
+	writer.writerow(FIELDS)
+	yield buffer.getvalue()
+	for change in changes:
+		buffer.seek(0)
+		buffer.truncate()
+		row = []
+		for field in FIELDS:
+			value = change[field]
+			if value is None:
+				value = ''
+			row.append(smart_str(value))
+		writer.writerow(row)
+		yield buffer.getvalue()
+
+
+def iter_gzip(chunks, level=6):
+	"""
+	Compresses a stream of strings into gzip format as it goes.
+	"""
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	for chunk in chunks:
+		data = compressor.compress(chunk)
+		if data:
+			yield data
+	yield compressor.flush()
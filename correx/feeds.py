@@ -0,0 +1,189 @@
+"""
+RSS and Atom feeds of the public changelog, for each scope the template tags cover.
+
+Hooked up in ``correx.urls`` through the ``change_feed`` view, which
+answers conditional requests before any feed is rendered.
+
+	``feeds/rss/latest/``
+		Every change.
+	``feeds/rss/site/[site_id]/``
+		Changes to a site.
+	``feeds/rss/app/[app_label]/``
+		Changes to an app.
+	``feeds/rss/model/[app_label].[model_name]/``
+		Changes to a model.
+	``feeds/rss/object/[app_label].[model_name]/[object_id]/``
+		Changes to a single object.
+	``feeds/rss/user/[username]/``
+		Changes made by a user.
+
+Swap ``rss`` for ``atom`` to get an Atom feed instead.
+"""
+from django.contrib.syndication.feeds import Feed
+from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import get_model
+
+from correx.models import Change
+from correx.lookups import get_app_models
+
+
+class ChangeFeed(Feed):
+	"""
+	The base for the changelog feeds. Subclasses say which object the URL
+	points to, the scope it covers and how to filter the changes for it.
+	"""
+	title_template = 'correx/feeds/change_title.html'
+	description_template = 'correx/feeds/change_description.html'
+	num_items = 15
+	# The number of bits expected in the URL after the slug
+	num_bits = 0
+
+	def get_object(self, bits):
+		# Remembered, since the view needs the object before the feed is built
+		if not hasattr(self, '_object'):
+			if len(bits) != self.num_bits:
+				raise ObjectDoesNotExist
+			self._object = self.lookup_object(bits)
+		return self._object
+
+	def lookup_object(self, bits):
+		return None
+
+	def get_scope(self, obj):
+		return ('all',)
+
+	def get_query_set(self, obj):
+		return Change.objects.live()
+
+	def title(self, obj):
+		return u'Latest changes'
+
+	def link(self, obj):
+		return u'/change-log/'
+
+	def description(self, obj):
+		return self.title(obj)
+
+	def items(self, obj):
+		return self.get_query_set(obj).order_by('-pub_date')[:self.num_items]
+
+	def item_pubdate(self, item):
+		return item.pub_date
+
+
+class LatestChangesFeed(ChangeFeed):
+	pass
+
+
+class SiteChangesFeed(ChangeFeed):
+	num_bits = 1
+
+	def lookup_object(self, bits):
+		try:
+			return Site.objects.get(pk=int(bits[0]))
+		except ValueError:
+			raise ObjectDoesNotExist
+
+	def get_scope(self, obj):
+		return ('site', obj.pk)
+
+	def get_query_set(self, obj):
+		return Change.objects.live().filter(site=obj)
+
+	def title(self, obj):
+		return u'Latest changes to %s' % obj.name
+
+
+class AppChangesFeed(ChangeFeed):
+	num_bits = 1
+
+	def lookup_object(self, bits):
+		if bits[0] not in get_app_models()['apps']:
+			raise ObjectDoesNotExist
+		return bits[0]
+
+	def get_scope(self, obj):
+		return ('app', obj)
+
+	def get_query_set(self, obj):
+		return Change.objects.live().filter(content_app=obj)
+
+	def title(self, obj):
+		return u'Latest changes to %s' % obj
+
+
+class ModelChangesFeed(ChangeFeed):
+	num_bits = 1
+
+	def lookup_object(self, bits):
+		try:
+			model = get_model(*bits[0].split('.'))
+		except TypeError:
+			model = None
+		if model is None:
+			raise ObjectDoesNotExist
+		return ContentType.objects.get_for_model(model)
+
+	def get_scope(self, obj):
+		return ('model', obj.pk)
+
+	def get_query_set(self, obj):
+		return Change.objects.live().filter(content_type=obj)
+
+	def title(self, obj):
+		return u'Latest changes to %s' % obj.model_class()._meta.verbose_name_plural
+
+
+class ObjectChangesFeed(ModelChangesFeed):
+	num_bits = 2
+
+	def lookup_object(self, bits):
+		ct = super(ObjectChangesFeed, self).lookup_object(bits[:1])
+		try:
+			return ct.get_object_for_this_type(pk=bits[1])
+		except ValueError:
+			raise ObjectDoesNotExist
+
+	def get_scope(self, obj):
+		return ('object', ContentType.objects.get_for_model(obj).pk, obj.pk)
+
+	def get_query_set(self, obj):
+		ct = ContentType.objects.get_for_model(obj)
+		return Change.objects.live().filter(content_type=ct, object_id=obj.pk)
+
+	def title(self, obj):
+		return u'Latest changes to %s' % obj
+
+	def link(self, obj):
+		if hasattr(obj, 'get_absolute_url'):
+			return obj.get_absolute_url()
+		return super(ObjectChangesFeed, self).link(obj)
+
+
+class UserChangesFeed(ChangeFeed):
+	num_bits = 1
+
+	def lookup_object(self, bits):
+		return User.objects.get(username__iexact=bits[0])
+
+	def get_scope(self, obj):
+		return ('user', obj.pk)
+
+	def get_query_set(self, obj):
+		return Change.objects.live().filter(user=obj)
+
+	def title(self, obj):
+		return u'Latest changes by %s' % obj.username
+
+
+FEEDS = {
+	'latest': LatestChangesFeed,
+	'site': SiteChangesFeed,
+	'app': AppChangesFeed,
+	'model': ModelChangesFeed,
+	'object': ObjectChangesFeed,
+	'user': UserChangesFeed,
+}
@@ -0,0 +1,373 @@
+"""
+Bulk loading of changes from JSON lines or CSV files.
+
+Records are read as a stream, their related objects resolved through
+lookup maps held in memory and the rows written with one executemany INSERT
+per batch. The rows never pass through ``Change.save()``, so instead each
+batch is indexed for search and sent out with the ``changes_updated``
+signal from ``correx.bulk``, whose handlers move the totals, summaries,
+rollups and cached lists it touches, in the same transaction as the
+INSERT.
+
+Each record may carry the following keys. Only ``description`` and
+``change_type`` are required.
+
+	``description``
+		The text of the change.
+	``change_type``
+		The name or slug of a ``ChangeType``.
+	``pub_date``
+		A date or datetime string. Defaults to now.
+	``is_public``
+		true/false, yes/no or 1/0. Defaults to false.
+	``user``
+		A username.
+	``site``
+		A site id or domain.
+	``content_type``
+		An "app_label.model" string or a ContentType id.
+	``content_app``
+		An app label. Filled in from ``content_type`` when left out.
+	``object_id``
+		The primary key of the record being changed.
+
+Example::
+
+	from correx.importer import ChangeImporter, read_jsonl
+	importer = ChangeImporter(batch_size=5000)
+	importer.run(read_jsonl(open('corrections.jsonl')))
+	print importer.inserted, importer.errors
+
+The readers yield (line_number, record) pairs so errors can be reported
+against the line of the file a record started on. A line that can't be
+decoded or parsed comes through as a ``RecordError`` in place of its
+record, and is reported like any other bad record. ``run()`` also accepts
+plain record dictionaries, numbering them from 1.
+
+"""
+import csv
+import time
+import datetime
+
+from django import forms
+from django.db import connection, transaction
+from django.db.models import AutoField
+from django.utils import simplejson
+from django.utils.encoding import force_unicode
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.contrib.contenttypes.models import ContentType
+
+from correx.signals import TRACKED_FIELDS
+from correx.summaries import latest
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 't')
+FALSE_VALUES = ('', '0', 'false', 'no', 'n', 'f')
+
+
+class RecordError(Exception):
+	"""
+	Raised when a record cannot be turned into a row.
+	"""
+	pass
+
+
+def read_jsonl(fileobj):
+	"""
+	Yields a (line_number, dictionary) pair for each non-blank line of a
+	JSON lines file, or a ``RecordError`` for a line that isn't valid JSON.
+	"""
+	for lineno, line in enumerate(fileobj):
+		line = line.strip()
+		if line:
+			try:
+				yield lineno + 1, simplejson.loads(line)
+			except ValueError, e:
+				yield lineno + 1, RecordError('invalid JSON: %s' % e)
+
+
+def read_csv(fileobj):
+	"""
+	Yields a (line_number, dictionary) pair for each row of a CSV file with
+	a header row, numbered by the line the row starts on, which can be
+	further along than the row count when quoted values span lines. A row
+	that can't be read or isn't valid UTF-8 comes through as a
+	``RecordError``.
+	"""
+	reader = csv.reader(fileobj)
+	fields, last = None, 0
+	while True:
+		try:
+			row = reader.next()
+		except StopIteration:
+			break
+		except csv.Error, e:
+			lineno, last = last + 1, reader.line_num
+			yield lineno, RecordError('invalid CSV: %s' % e)
+			continue
+		lineno, last = last + 1, reader.line_num
+		if not row:
+			continue
+		try:
+			row = [value.decode('utf-8') for value in row]
+		except UnicodeDecodeError, e:
+			if fields is None:
+				# The header names every column, so without it nothing can be read
+				fields = [value.decode('utf-8', 'replace') for value in row]
+			yield lineno, RecordError('invalid UTF-8: %s' % e)
+			continue
+		if fields is None:
+			fields = row
+			continue
+		yield lineno, dict(zip(fields, row))
+
+
+class ChangeImporter(object):
+	"""
+	Inserts change records in batches, reporting problems without stopping.
+
+	After ``run()`` the instance holds the totals for the load in ``read``,
+	``inserted``, ``batches`` and ``elapsed``, and a list of
+	``(line_number, message)`` pairs in ``errors``. A batch that fails in the
+	database is rolled back and reported against the first line it held.
+	"""
+	def __init__(self, batch_size=1000):
+		self.batch_size = int(batch_size)
+		self.read = 0
+		self.inserted = 0
+		self.batches = 0
+		self.elapsed = 0.0
+		self.errors = []
+		self.load_maps()
+
+	def load_maps(self):
+		"""
+		Loads the change types, sites and content types into memory.
+
+		Users are looked up a batch at a time since there may be many.
+		"""
+		from correx.models import ChangeType
+		self.change_types = {}
+		for name, slug in ChangeType.objects.values_list('name', 'slug'):
+			self.change_types[name.lower()] = name
+			self.change_types[slug.lower()] = name
+		self.sites = {}
+		for pk, domain in Site.objects.values_list('id', 'domain'):
+			self.sites[str(pk)] = pk
+			self.sites[domain.lower()] = pk
+		self.content_types = {}
+		for pk, app_label, model in ContentType.objects.values_list('id', 'app_label', 'model'):
+			self.content_types['%s.%s' % (app_label, model)] = (pk, app_label)
+			self.content_types[str(pk)] = (pk, app_label)
+		self.users = {}
+
+	def load_users(self, records):
+		"""
+		Fetches any users named in the records that aren't mapped yet,
+		matching their usernames whatever their case, 500 at a time.
+		"""
+		wanted = set()
+		for lineno, record in records:
+			if not isinstance(record, dict):
+				continue
+			username = record.get('user')
+			if username and unicode(username).lower() not in self.users:
+				wanted.add(unicode(username).lower())
+		wanted = list(wanted)
+		column = connection.ops.quote_name('username')
+		for i in range(0, len(wanted), 500):
+			chunk = wanted[i:i + 500]
+			users = User.objects.extra(where=['LOWER(%s) IN (%s)' % (column, ', '.join(['%s'] * len(chunk)))],
+				params=chunk).values_list('id', 'username')
+			for pk, username in users:
+				self.users[username.lower()] = pk
+
+	def lookup(self, mapping, value, label):
+		if value in (None, ''):
+			return None
+		try:
+			return mapping[unicode(value).lower()]
+		except KeyError:
+			raise RecordError('unknown %s "%s"' % (label, value))
+
+	def get_values(self, record):
+		"""
+		Converts a record into a dictionary of field values keyed by attribute
+		name, raising ``RecordError`` if it can't be.
+		"""
+		if isinstance(record, RecordError):
+			raise record
+		if not isinstance(record, dict):
+			raise RecordError('record is not an object')
+		description = record.get('description')
+		if not description:
+			raise RecordError('description is required')
+		if not isinstance(description, basestring):
+			raise RecordError('description must be text')
+		change_type_id = self.lookup(self.change_types, record.get('change_type'), 'change_type')
+		if change_type_id is None:
+			raise RecordError('change_type is required')
+
+		pub_date = record.get('pub_date')
+		if pub_date:
+			try:
+				pub_date = forms.DateTimeField().clean(unicode(pub_date).replace('T', ' '))
+			except forms.ValidationError:
+				raise RecordError('invalid pub_date "%s"' % pub_date)
+		else:
+			pub_date = datetime.datetime.now()
+
+		is_public = record.get('is_public', False)
+		if not isinstance(is_public, bool):
+			flag = unicode(is_public).strip().lower()
+			if flag in TRUE_VALUES:
+				is_public = True
+			elif flag in FALSE_VALUES:
+				is_public = False
+			else:
+				raise RecordError('invalid is_public "%s"' % is_public)
+
+		content_type_id = content_app = None
+		content_type = self.lookup(self.content_types, record.get('content_type'), 'content_type')
+		if content_type:
+			content_type_id, content_app = content_type
+		content_app = record.get('content_app') or content_app
+
+		object_id = record.get('object_id')
+		if object_id in (None, ''):
+			object_id = None
+		else:
+			try:
+				object_id = int(object_id)
+			except (TypeError, ValueError):
+				raise RecordError('invalid object_id "%s"' % object_id)
+
+		return {
+			'description': description,
+			'change_type_id': change_type_id,
+			'pub_date': pub_date,
+			'is_public': is_public,
+			'user_id': self.lookup(self.users, record.get('user'), 'user'),
+			'site_id': self.lookup(self.sites, record.get('site'), 'site'),
+			'content_app': content_app,
+			'content_type_id': content_type_id,
+			'object_id': object_id,
+		}
+
+	def to_row(self, record):
+		"""
+		Converts a record into a tuple of database values ordered like ``get_fields()``.
+		"""
+		values = self.get_values(record)
+		return tuple([f.get_db_prep_save(values[f.attname]) for f in self.get_fields()])
+
+	def get_groups(self, batch):
+		"""
+		Sorts a list of field value dictionaries into the (None, state, count)
+		triples ``changes_updated`` is sent with, a group for each state and
+		day, carrying the newest date of its changes.
+		"""
+		attnames = [a for a in TRACKED_FIELDS if a != 'pub_date']
+		groups = {}
+		for values in batch:
+			key = (tuple([values[a] for a in attnames]), values['pub_date'].date())
+			count, last = groups.get(key, (0, None))
+			groups[key] = (count + 1, latest(last, values['pub_date']))
+		triples = []
+		for (state, day), (count, last) in groups.items():
+			state = dict(zip(attnames, state))
+			state['pub_date'] = last
+			triples.append((None, state, count))
+		return triples
+
+	def get_fields(self):
+		"""
+		The ``Change`` fields written by the importer, which is all but the primary key.
+		"""
+		from correx.models import Change
+		return [f for f in Change._meta.local_fields if not isinstance(f, AutoField)]
+
+	@transaction.commit_on_success
+	def insert_rows(self, batch):
+		"""
+		Writes a list of field value dictionaries with a single executemany
+		INSERT, indexes them for search and sends ``changes_updated`` for
+		them, all in one transaction.
+		"""
+		from correx.models import Change
+		from correx.bulk import changes_updated
+		from correx import search
+		fields = self.get_fields()
+		rows = [tuple([f.get_db_prep_save(values[f.attname]) for f in fields]) for values in batch]
+		# New rows get ids above the highest one there now
+		last = list(Change.objects.order_by('-pk').values_list('pk', flat=True)[:1])
+		last = last and last[0] or 0
+		qn = connection.ops.quote_name
+		columns = [qn(f.column) for f in fields]
+		sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+			qn(Change._meta.db_table), ', '.join(columns), ', '.join(['%s'] * len(columns)))
+		connection.cursor().executemany(sql, rows)
+		# Rows another process wrote in the meantime are indexed again
+		# along with ours, which does them no harm
+		while True:
+			written = list(Change.objects.filter(pk__gt=last).order_by('pk').values_list('pk', 'description')[:self.batch_size])
+			if not written:
+				break
+			search.index_changes(written)
+			last = written[-1][0]
+		changes_updated.send(sender=Change, groups=self.get_groups(batch))
+
+	def load_batch(self, records):
+		"""
+		Resolves and inserts one batch of (line_number, record) pairs.
+		"""
+		self.load_users(records)
+		batch = []
+		for lineno, record in records:
+			try:
+				batch.append(self.get_values(record))
+			except RecordError, e:
+				self.errors.append((lineno, force_unicode(e)))
+		if batch:
+			try:
+				self.insert_rows(batch)
+				self.inserted += len(batch)
+			except Exception, e:
+				self.errors.append((records[0][0], u'batch failed: %s' % force_unicode(e)))
+		self.batches += 1
+
+	def run(self, records, progress=None):
+		"""
+		Loads an iterable of (line_number, record) pairs, like the readers
+		yield, or of record dictionaries, which are numbered from 1.
+
+		If provided, ``progress`` is called with the importer after each batch.
+		"""
+		start = time.time()
+		batch = []
+		for record in records:
+			self.read += 1
+			if not isinstance(record, tuple):
+				record = (self.read, record)
+			batch.append(record)
+			if len(batch) >= self.batch_size:
+				self.load_batch(batch)
+				batch = []
+				self.elapsed = time.time() - start
+				if progress:
+					progress(self)
+		if batch:
+			self.load_batch(batch)
+			self.elapsed = time.time() - start
+			if progress:
+				progress(self)
+		self.elapsed = time.time() - start
+		return self
+
+	def get_rate(self):
+		"""
+		The number of rows inserted per second.
+		"""
+		if not self.elapsed:
+			return 0.0
+		return self.inserted / self.elapsed
@@ -0,0 +1,179 @@
+"""
+Optional measurements of the work correx does inside a request.
+
+Switched on by setting CORREX_INSTRUMENTATION to True. Each render of a
+template tag and each run of the signal handlers on a change is then timed
+and its queries counted, and the result is sent with the ``measured``
+signal as a ``Measurement``. Connect a receiver to pass them on to a
+metrics pipeline::
+
+	from correx.instrumentation import measured
+
+	def record(sender, measurement, **kwargs):
+		statsd.timing('correx.%s' % measurement.name, measurement.duration)
+
+	measured.connect(record)
+
+The sender is the kind of work measured, either 'tag' or 'signal'.
+
+Anything slower than the CORREX_SLOW_THRESHOLD setting, in milliseconds
+and 100 by default, is also logged as a warning to the 'correx' logger.
+"""
+import time
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+
+measured = Signal(providing_args=['measurement'])
+
+logger = logging.getLogger('correx')
+
+_local = threading.local()
+
+
+def is_enabled():
+	"""
+	Whether the CORREX_INSTRUMENTATION setting has switched measuring on.
+	"""
+	return getattr(settings, 'CORREX_INSTRUMENTATION', False)
+
+
+class CountingCursor(object):
+	"""
+	Wraps a database cursor and counts the statements run through it.
+	"""
+	def __init__(self, cursor):
+		self.cursor = cursor
+
+	def execute(self, *args, **kwargs):
+		_local.queries = get_query_count() + 1
+		return self.cursor.execute(*args, **kwargs)
+
+	def executemany(self, *args, **kwargs):
+		_local.queries = get_query_count() + 1
+		return self.cursor.executemany(*args, **kwargs)
+
+	def __getattr__(self, attr):
+		return getattr(self.cursor, attr)
+
+	def __iter__(self):
+		return iter(self.cursor)
+
+
+def install():
+	"""
+	Routes the connection's cursors through ``CountingCursor``, so queries
+	are counted whether or not DEBUG is on, until the matching call to
+	``uninstall``. Calls nest, and only the outermost pair swaps the cursor
+	in and out.
+
+	The connection keeps its attributes per thread, so each thread that
+	measures something counts its own queries.
+	"""
+	depth = getattr(connection, '_correx_counting', 0)
+	connection._correx_counting = depth + 1
+	if depth:
+		return
+	get_cursor = connection.cursor
+	connection._correx_cursor = connection.__dict__.get('cursor')
+	connection.cursor = lambda: CountingCursor(get_cursor())
+
+
+def uninstall():
+	"""
+	Undoes a call to ``install``, handing the connection back the cursor it
+	had before once the outermost call is undone.
+	"""
+	depth = getattr(connection, '_correx_counting', 0)
+	if not depth:
+		return
+	connection._correx_counting = depth - 1
+	if depth > 1:
+		return
+	if connection._correx_cursor is None:
+		del connection.cursor
+	else:
+		connection.cursor = connection._correx_cursor
+	del connection._correx_cursor
+
+
+def get_query_count():
+	"""
+	Returns the number of queries counted so far in this thread.
+	"""
+	return getattr(_local, 'queries', 0)
+
+
+class Measurement(object):
+	"""
+	Times a piece of work from its creation to the call to ``finish``.
+
+	Once finished it has these attributes.
+
+		``kind``
+			'tag' or 'signal'.
+		``name``
+			The name of the template tag or signal handler.
+		``scope``
+			The scope of the list, as in ``correx.caching``. The signal
+			handlers use ('change', id).
+		``queries``
+			The number of queries run.
+		``rows``
+			The number of changes returned by a tag, or the number of
+			change types or cache scopes touched by a handler.
+		``duration``
+			The wall time taken, in milliseconds.
+
+	The connection's queries are counted from its creation until it is
+	finished, or closed if the work raises first, and not at all when
+	instrumentation is off, when it does nothing. Callers finish it inside
+	a ``try`` and close it in the ``finally``::
+
+		measurement = Measurement('tag', 'get_latest_changes')
+		try:
+			...
+			measurement.finish(scope, rows)
+		finally:
+			measurement.close()
+
+	"""
+	def __init__(self, kind, name):
+		self.kind = kind
+		self.name = name
+		self.scope = None
+		self.rows = None
+		self.closed = False
+		self.enabled = is_enabled()
+		if self.enabled:
+			install()
+			self.start_queries = get_query_count()
+			self.start = time.time()
+
+	def finish(self, scope=None, rows=None):
+		"""
+		Stops the clock, sends the measurement and logs it if it was slow.
+		"""
+		if not self.enabled or self.closed:
+			return
+		self.duration = (time.time() - self.start) * 1000
+		self.queries = get_query_count() - self.start_queries
+		self.close()
+		self.scope = scope
+		self.rows = rows
+		measured.send(sender=self.kind, measurement=self)
+		if self.duration >= getattr(settings, 'CORREX_SLOW_THRESHOLD', 100):
+			logger.warning('Slow correx %s %s for %s: %.1fms, %s queries, %s rows' % (
+				self.kind, self.name, self.scope, self.duration, self.queries, self.rows))
+
+	def close(self):
+		"""
+		Stops counting queries without sending anything, unless ``finish``
+		already has.
+		"""
+		if self.enabled and not self.closed:
+			self.closed = True
+			uninstall()
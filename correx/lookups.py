@@ -0,0 +1,145 @@
+"""
+A map of the content types, used to fill the dropdowns in the admin form
+and to name content types elsewhere without a query.
+
+The content types only change when syncdb runs, so the map is built once
+per process, with each app's JSON already serialized, and thrown away when
+syncdb runs or a content type is saved or deleted. Those signals only
+reach this process, so ``get_label`` also throws it away when asked for a
+content type it lacks.
+
+A second map, of usernames to ids, is filled a user at a time, leaving out
+names that match no user, and emptied
+whenever a user is saved or deleted. A third, of the change types as
+``correx.records.ChangeTypeRecord``, is built whole and thrown away when a
+change type is saved or deleted.
+
+The maps are read from the primary database rather than a replica. They
+outlive the request that builds them, and one built from a replica that
+hasn't caught up with the save that threw the last one away would keep its
+stale rows until the next reset.
+"""
+import datetime
+
+from django.utils import simplejson
+from django.utils.hashcompat import md5_constructor
+
+from correx.routing import on_primary
+
+EMPTY_CHOICE = {'Text': '---------', 'Value': ''}
+EMPTY_PAYLOAD = simplejson.dumps([EMPTY_CHOICE])
+
+_app_models = None
+_user_ids = {}
+_change_types = None
+
+
+def get_app_models():
+	"""
+	Returns a dictionary with the following keys, building it if needed.
+
+		``apps``
+			Maps each app label to the JSON list of its models.
+		``all``
+			The JSON for every app's list of models at once.
+		``etag``
+			A hash of ``all``, for the ETag header.
+		``last_modified``
+			When the map was built, in UTC.
+		``labels``
+			Maps each content type's id to its (app_label, model) pair.
+
+	"""
+	global _app_models
+	if _app_models is None:
+		from django.contrib.contenttypes.models import ContentType
+		choices = {}
+		labels = {}
+		for pk, app_label, model in on_primary(ContentType.objects.values_list('pk', 'app_label', 'model')):
+			choices.setdefault(app_label, [EMPTY_CHOICE]).append({'Text': model, 'Value': str(pk)})
+			labels[pk] = (app_label, model)
+		payload = simplejson.dumps(choices)
+		_app_models = {
+			'apps': dict([(app_label, simplejson.dumps(c)) for app_label, c in choices.items()]),
+			'all': payload,
+			'etag': md5_constructor(payload).hexdigest(),
+			'last_modified': datetime.datetime.utcnow().replace(microsecond=0),
+			'labels': labels,
+		}
+	return _app_models
+
+
+def reset_app_models(*args, **kwargs):
+	"""
+	Throws away the map so the next request rebuilds it. Connected to
+	``post_syncdb`` and to saves and deletes of ``ContentType``.
+	"""
+	global _app_models
+	_app_models = None
+
+
+def get_label(content_type_id):
+	"""
+	Returns the (app_label, model) pair of a content type, or None if there
+	isn't one. A content type missing from the map, as one created by
+	another process since it was built, is fetched with
+	``ContentType.objects.get_for_id`` and the map thrown away so the next
+	call builds it afresh.
+	"""
+	labels = get_app_models()['labels']
+	if content_type_id in labels:
+		return labels[content_type_id]
+	from django.contrib.contenttypes.models import ContentType
+	try:
+		content_type = ContentType.objects.get_for_id(content_type_id)
+	except ContentType.DoesNotExist:
+		return None
+	reset_app_models()
+	return (content_type.app_label, content_type.model)
+
+
+def get_user_id(username):
+	"""
+	Returns the id of the user with the provided username, ignoring case,
+	or None if there isn't one.
+	"""
+	key = username.lower()
+	if key not in _user_ids:
+		from django.contrib.auth.models import User
+		ids = list(on_primary(User.objects.filter(username__iexact=username)).values_list('pk', flat=True)[:1])
+		if not ids:
+			# Not kept, so the map holds no more names than there are users
+			return None
+		_user_ids[key] = ids[0]
+	return _user_ids[key]
+
+
+def reset_user_ids(*args, **kwargs):
+	"""
+	Empties the map of usernames. Connected to saves and deletes of ``User``.
+	"""
+	_user_ids.clear()
+
+
+def get_change_types():
+	"""
+	Returns a dictionary that maps the primary key of each change type to its
+	``ChangeTypeRecord``, building it if needed.
+	"""
+	global _change_types
+	if _change_types is None:
+		from correx.models import ChangeType
+		from correx.records import ChangeTypeRecord
+		types = {}
+		for change_type in on_primary(ChangeType.objects.all()):
+			types[change_type.pk] = ChangeTypeRecord(change_type.name, change_type.slug, change_type.get_icon_url())
+		_change_types = types
+	return _change_types
+
+
+def reset_change_types(*args, **kwargs):
+	"""
+	Throws away the map of change types. Connected to saves and deletes of ``ChangeType``.
+	"""
+	global _change_types
+	_change_types = None
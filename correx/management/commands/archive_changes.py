@@ -0,0 +1,35 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+	help = 'Moves changes older than CORREX_ARCHIVE_DAYS, or --days, into the archive table.'
+	option_list = BaseCommand.option_list + (
+		make_option('--days', dest='days', default=None, type='int',
+			help='Archive the changes published more than this many days ago.'),
+		make_option('--before', dest='before', default=None,
+			help='Archive the changes published before this date, as YYYY-MM-DD.'),
+		make_option('--batch-size', dest='batch_size', default=1000, type='int',
+			help='The number of changes moved per transaction. Defaults to 1000.'),
+		make_option('--pause', dest='pause', default=0, type='float',
+			help='The seconds to wait between batches. Defaults to 0.'),
+	)
+
+	def handle(self, *args, **options):
+		from correx.archive import archive, get_cutoff
+		verbosity = int(options.get('verbosity', 1))
+		if options.get('before'):
+			try:
+				cutoff = datetime.datetime.strptime(options['before'], '%Y-%m-%d')
+			except ValueError:
+				raise CommandError('--before must be a date like 2009-02-14')
+		else:
+			cutoff = get_cutoff(options.get('days'))
+		def progress(total):
+			if verbosity > 1:
+				print 'Archived %s changes' % total
+		total = archive(cutoff, options.get('batch_size'), options.get('pause'), progress)
+		if verbosity > 0:
+			print 'Archived %s changes published before %s' % (total, cutoff)
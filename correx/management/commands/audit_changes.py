@@ -0,0 +1,22 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+	help = 'Recounts the change type totals, summaries, rollups and search index, repairs any drift and prints a JSON report.'
+	option_list = BaseCommand.option_list + (
+		make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+			help='Report the drift without repairing it.'),
+		make_option('--chunk-size', dest='chunk_size', default=10000, type='int',
+			help='The range of ids each grouped count covers. Defaults to 10000.'),
+		make_option('--indent', dest='indent', default=None, type='int',
+			help='Indent the report by this many spaces.'),
+	)
+
+	def handle(self, *args, **options):
+		from django.core.serializers.json import DjangoJSONEncoder
+		from django.utils import simplejson
+		from correx.audit import audit
+		report = audit(not options.get('dry_run'), options.get('chunk_size'))
+		print simplejson.dumps(report, cls=DjangoJSONEncoder, sort_keys=True, indent=options.get('indent'))
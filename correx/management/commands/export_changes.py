@@ -0,0 +1,48 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+	help = 'Writes the changelog out as JSON lines or CSV without loading it all into memory.'
+	args = '[file]'
+	option_list = BaseCommand.option_list + (
+		make_option('--format', dest='format', default='ndjson',
+			help='Either "ndjson" or "csv". Defaults to ndjson.'),
+		make_option('--gzip', action='store_true', dest='gzip', default=False,
+			help='Compress the output with gzip.'),
+		make_option('--public', action='store_true', dest='public', default=False,
+			help='Only export changes that are published.'),
+		make_option('--chunk-size', dest='chunk_size', default=1000, type='int',
+			help='The number of rows read from the database at a time. Defaults to 1000.'),
+	)
+
+	def handle(self, *args, **options):
+		from correx.models import Change
+		from correx.export import iter_changes, iter_ndjson, iter_csv, iter_gzip
+
+		if len(args) > 1:
+			raise CommandError('Provide the path of a single file, or leave it out to write to stdout.')
+		writers = {'ndjson': iter_ndjson, 'csv': iter_csv}
+		format = options.get('format')
+		if format not in writers:
+			raise CommandError('Unknown format "%s". Use ndjson or csv.' % format)
+
+		queryset = Change.objects.all()
+		if options.get('public'):
+			queryset = Change.objects.live()
+		chunks = writers[format](iter_changes(queryset, options.get('chunk_size')))
+		if options.get('gzip'):
+			chunks = iter_gzip(chunks)
+
+		if args:
+			out = open(args[0], 'wb')
+		else:
+			out = sys.stdout
+		try:
+			for chunk in chunks:
+				out.write(chunk)
+		finally:
+			if out is not sys.stdout:
+				out.close()
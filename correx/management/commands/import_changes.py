@@ -0,0 +1,58 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+	help = 'Loads changes in bulk from a JSON lines or CSV file.'
+	args = '[file]'
+	option_list = BaseCommand.option_list + (
+		make_option('--format', dest='format', default=None,
+			help='Either "jsonl" or "csv". Guessed from the file extension if left out.'),
+		make_option('--batch-size', dest='batch_size', default=1000, type='int',
+			help='The number of records inserted per transaction. Defaults to 1000.'),
+	)
+
+	def handle(self, *args, **options):
+		from correx.importer import ChangeImporter, read_jsonl, read_csv
+
+		if len(args) != 1:
+			raise CommandError('Provide the path of a single file, or - to read from stdin.')
+		path = args[0]
+		verbosity = int(options.get('verbosity', 1))
+
+		format = options.get('format')
+		if not format:
+			if path.lower().endswith('.csv'):
+				format = 'csv'
+			else:
+				format = 'jsonl'
+		readers = {'jsonl': read_jsonl, 'csv': read_csv}
+		if format not in readers:
+			raise CommandError('Unknown format "%s". Use jsonl or csv.' % format)
+
+		if path == '-':
+			fileobj = sys.stdin
+		else:
+			try:
+				fileobj = open(path, 'rb')
+			except IOError, e:
+				raise CommandError(str(e))
+
+		def progress(importer):
+			if verbosity > 1:
+				print 'Batch %s: %s read, %s inserted, %s errors (%.0f rows/sec)' % (
+					importer.batches, importer.read, importer.inserted, len(importer.errors), importer.get_rate())
+
+		try:
+			importer = ChangeImporter(batch_size=options.get('batch_size')).run(readers[format](fileobj), progress)
+		finally:
+			if fileobj is not sys.stdin:
+				fileobj.close()
+
+		for lineno, message in importer.errors:
+			sys.stderr.write((u'Line %s: %s\n' % (lineno, message)).encode('utf-8'))
+		if verbosity > 0:
+			print 'Inserted %s of %s records in %s batches in %.2f seconds (%.0f rows/sec), %s errors' % (
+				importer.inserted, importer.read, importer.batches, importer.elapsed, importer.get_rate(), len(importer.errors))
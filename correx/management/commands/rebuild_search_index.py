@@ -0,0 +1,17 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+	help = 'Creates the full-text index of change descriptions if needed and refills it.'
+	option_list = BaseCommand.option_list + (
+		make_option('--batch-size', dest='batch_size', default=1000, type='int',
+			help='The number of changes read at a time. Defaults to 1000.'),
+	)
+
+	def handle(self, *args, **options):
+		from correx.search import rebuild
+		total = rebuild(options.get('batch_size'))
+		if int(options.get('verbosity', 1)) > 0:
+			print 'Indexed %s changes' % total
@@ -0,0 +1,31 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+	help = 'Recounts the change types queued by saves when CORREX_DEFERRED_COUNTS is on.'
+	option_list = BaseCommand.option_list + (
+		make_option('--loop', dest='loop', action='store_true', default=False,
+			help='Keep running, checking the queue every --interval seconds.'),
+		make_option('--interval', dest='interval', default=5, type='float',
+			help='The seconds to wait between checks with --loop. Defaults to 5.'),
+		make_option('--batch-size', dest='batch_size', default=1000, type='int',
+			help='The number of queued rows handled per transaction. Defaults to 1000.'),
+	)
+
+	def handle(self, *args, **options):
+		from correx.counters import refresh_queued
+		verbosity = int(options.get('verbosity', 1))
+		while True:
+			# Drain the queue, then wait for more or stop
+			while True:
+				rows, types = refresh_queued(options.get('batch_size'))
+				if not rows:
+					break
+				if verbosity > 0:
+					print 'Recounted %s types for %s queued saves' % (types, rows)
+			if not options.get('loop'):
+				break
+			time.sleep(options.get('interval'))
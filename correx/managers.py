@@ -1,10 +1,475 @@
-from django.db import models
+from django.db import models, connection
+from django.db.models.query import QuerySet, ValuesListQuerySet
+from django.conf import settings
+
+from correx.routing import reading, on_primary, using, get_read_connection
+
+
+def supports_window_functions():
+	"""
+	Whether the database can run ROW_NUMBER() OVER (...).
+
+	Guessed from DATABASE_ENGINE unless the CORREX_WINDOW_FUNCTIONS setting
+	says otherwise.
+	"""
+	override = getattr(settings, 'CORREX_WINDOW_FUNCTIONS', None)
+	if override is not None:
+		return bool(override)
+	engine = settings.DATABASE_ENGINE
+	if engine.startswith('postgresql') or engine == 'oracle':
+		return True
+	if engine == 'sqlite3':
+		import sqlite3
+		return sqlite3.sqlite_version_info >= (3, 25, 0)
+	return False
+
+
+def attach_content_objects(changes):
+	"""
+	Loads the objects connected to a list of changes with one query per
+	content type and caches each one on its change, so ``content_object``
+	can be read without another trip to the database.
+
+	Changes that aren't connected to an object, or whose object can't be
+	found, get None.
+	"""
+	from correx.lookups import get_label
+	ids_by_ct = {}
+	for change in changes:
+		if change.content_type_id and change.object_id is not None:
+			ids_by_ct.setdefault(change.content_type_id, set()).add(change.object_id)
+	objects = {}
+	for ct_id, ids in ids_by_ct.items():
+		model = None
+		label = get_label(ct_id)
+		if label is not None:
+			model = models.get_model(*label)
+		if model is not None:
+			for pk, obj in model._default_manager.in_bulk(list(ids)).items():
+				objects[(ct_id, pk)] = obj
+	for change in changes:
+		change._content_object_cache = objects.get((change.content_type_id, change.object_id))
+
+
+class ChangeQuerySet(QuerySet):
+	"""
+	A QuerySet that can load the objects connected to its changes, and
+	publish, unpublish or retype its changes, in bulk.
+	"""
+	prefetch_content_objects = False
+	as_records = False
+
+	def with_content_objects(self):
+		"""
+		Returns a copy that fills in ``content_object`` on every change it
+		yields, using one query per content type instead of one per row.
+		"""
+		return self._clone(prefetch_content_objects=True)
+
+	def search(self, query):
+		"""
+		Returns the changes whose descriptions match every word of the
+		query, using the full-text index. See ``correx.search``.
+		"""
+		from correx.search import search
+		return search(self, query)
+
+	def records(self):
+		"""
+		Returns a copy that yields a read-only ``ChangeRecord`` for each
+		change, pulled with only the columns a list displays. See
+		``correx.records``.
+		"""
+		return self._clone(as_records=True)
+
+	def publish(self):
+		"""
+		Publishes every change with one UPDATE. See ``correx.bulk``.
+		"""
+		from correx.bulk import publish
+		return publish(self)
+
+	def unpublish(self):
+		"""
+		Unpublishes every change with one UPDATE. See ``correx.bulk``.
+		"""
+		from correx.bulk import unpublish
+		return unpublish(self)
+
+	def retype(self, change_type):
+		"""
+		Gives every change a new type with one UPDATE. See ``correx.bulk``.
+		"""
+		from correx.bulk import retype
+		return retype(self, change_type)
+
+	def update(self, **kwargs):
+		# Writes go to the primary, even from a queryset reading from a replica
+		return super(ChangeQuerySet, on_primary(self)).update(**kwargs)
+
+	def delete(self):
+		return super(ChangeQuerySet, on_primary(self)).delete()
+
+	def _clone(self, klass=None, setup=False, **kwargs):
+		kwargs.setdefault('prefetch_content_objects', self.prefetch_content_objects)
+		kwargs.setdefault('as_records', self.as_records)
+		return super(ChangeQuerySet, self)._clone(klass, setup, **kwargs)
+
+	def iterator(self):
+		if self.as_records:
+			from correx.records import ChangeRecord, RECORD_FIELDS, get_short_description_sql
+			query = self._clone(as_records=False)
+			query.query.add_extra({'short_description': get_short_description_sql()}, None, None, None, None, None)
+			rows = query._clone(klass=ValuesListQuerySet, setup=True, flat=False, _fields=RECORD_FIELDS)
+			for row in rows.iterator():
+				yield ChangeRecord(*row)
+			return
+		if not self.prefetch_content_objects:
+			for change in super(ChangeQuerySet, self).iterator():
+				yield change
+			return
+		changes = list(super(ChangeQuerySet, self).iterator())
+		attach_content_objects(changes)
+		for change in changes:
+			yield change
 
 
 class ChangeManager(models.Manager):
 
+	def get_query_set(self):
+		return ChangeQuerySet(self.model)
+
 	def live(self):
 		"""
-		All changes set for publication.
+		All changes set for publication, read from a replica if there are
+		any. See ``correx.routing``.
+		"""
+		return reading(self.get_query_set().filter(is_public=True))
+
+	def search(self, query):
+		"""
+		Every change whose description matches the query. See ``correx.search``.
+		"""
+		return self.get_query_set().search(query)
+
+	def history(self):
+		"""
+		Every change in the changelog and its archive. See ``correx.archive``.
+		"""
+		from correx.archive import History
+		from correx.models import ArchivedChange
+		return History([self.get_query_set(), ArchivedChange.objects.all()])
+
+	def records(self):
+		"""
+		Every change as a read-only ``ChangeRecord``. See ``correx.records``.
+		"""
+		return self.get_query_set().records()
+
+	def for_objects(self, objects, num=None):
+		"""
+		Fetches the latest live changes for a list of objects all at once.
+
+		Returns a dictionary that maps the (content_type_id, object_id) of each
+		object to a list of no more than ``num`` of its changes, newest first.
+		Objects may come from any mix of models.
+
+		Where the database supports window functions the changes are ranked
+		per object in SQL and fetched with two queries. Elsewhere a single query
+		pulls every live change for the objects and the lists are cut short in
+		Python.
+		"""
+		from django.contrib.contenttypes.models import ContentType
+		results = {}
+		ids_by_ct = {}
+		for obj in objects:
+			ct = ContentType.objects.get_for_model(obj)
+			results[(ct.pk, obj.pk)] = []
+			ids_by_ct.setdefault(ct.pk, []).append(obj.pk)
+		if not ids_by_ct:
+			return results
+
+		if num is not None and supports_window_functions():
+			qn = connection.ops.quote_name
+			opts = self.model._meta
+			col = dict([(f.name, qn(f.column)) for f in opts.local_fields])
+			clauses, params = [], []
+			for ct_id, object_ids in ids_by_ct.items():
+				clauses.append('(%s = %%s AND %s IN (%s))' % (
+					col['content_type'], col['object_id'], ', '.join(['%s'] * len(object_ids))))
+				params.append(ct_id)
+				params.extend(object_ids)
+			sql = """
+				SELECT ranked.id FROM (
+					SELECT %(id)s AS id, ROW_NUMBER() OVER (
+						PARTITION BY %(ct)s, %(obj)s ORDER BY %(pub_date)s DESC, %(id)s DESC
+					) AS correx_rank
+					FROM %(table)s
+					WHERE %(is_public)s = %%s AND (%(clauses)s)
+				) ranked
+				WHERE ranked.correx_rank <= %%s
+			""" % {
+				'id': col['id'],
+				'ct': col['content_type'],
+				'obj': col['object_id'],
+				'pub_date': col['pub_date'],
+				'is_public': col['is_public'],
+				'table': qn(opts.db_table),
+				'clauses': ' OR '.join(clauses),
+			}
+			# The ids and then the rows are read from the same database
+			conn = get_read_connection()
+			cursor = conn.cursor()
+			cursor.execute(sql, [True] + params + [num])
+			ids = [row[0] for row in cursor.fetchall()]
+			if not ids:
+				return results
+			qs = using(self.get_query_set().filter(pk__in=ids), conn)
+		else:
+			q = None
+			for ct_id, object_ids in ids_by_ct.items():
+				clause = models.Q(content_type=ct_id, object_id__in=object_ids)
+				if q is None:
+					q = clause
+				else:
+					q = q | clause
+			qs = self.live().filter(q)
+
+		for change in qs.order_by('-pub_date', '-id'):
+			change_list = results[(change.content_type_id, change.object_id)]
+			if num is None or len(change_list) < num:
+				change_list.append(change)
+		return results
+
+	def latest_by(self, field, num):
+		"""
+		Fetches the latest live changes for each change type, site or app.
+
+		``field`` is one of 'change_type', 'site' or 'content_app'. Returns a
+		dictionary that maps each value of the field found among the live
+		changes to a list of no more than ``num`` of its changes, newest first.
+		Changes without a site or app are left out of those groupings.
+
+		Where the database supports window functions the changes are ranked
+		per group in SQL and fetched with one query. Elsewhere the groups are
+		listed first and each is fetched with its own query, which the index
+		on (is_public, pub_date) keeps short.
+		"""
+		if field not in ('change_type', 'site', 'content_app'):
+			raise ValueError('Changes can only be grouped by change_type, site or content_app')
+		opts = self.model._meta
+		column = opts.get_field(field).column
+		qs = self.live().exclude(**{'%s__isnull' % field: True})
+		if field == 'content_app':
+			qs = qs.exclude(content_app='')
+		else:
+			qs = qs.select_related(field)
+
+		results = {}
+		if supports_window_functions():
+			qn = connection.ops.quote_name
+			qs = qs.extra(where=["""
+				%(table)s.%(id)s IN (
+					SELECT ranked.id FROM (
+						SELECT %(id)s AS id, ROW_NUMBER() OVER (
+							PARTITION BY %(group)s ORDER BY %(pub_date)s DESC, %(id)s DESC
+						) AS correx_rank
+						FROM %(table)s
+						WHERE %(is_public)s = %%s
+					) ranked
+					WHERE ranked.correx_rank <= %%s
+				)
+			""" % {
+				'id': qn(opts.pk.column),
+				'group': qn(column),
+				'pub_date': qn(opts.get_field('pub_date').column),
+				'is_public': qn(opts.get_field('is_public').column),
+				'table': qn(opts.db_table),
+			}], params=[True, num])
+			for change in qs.order_by('-pub_date', '-id'):
+				results.setdefault(getattr(change, opts.get_field(field).attname), []).append(change)
+		else:
+			values = qs.values_list(field, flat=True).order_by().distinct()
+			for value in values:
+				results[value] = list(qs.filter(**{field: value}).order_by('-pub_date', '-id')[:num])
+		return results
+
+
+class ChangeTypeManager(models.Manager):
+
+	def recount(self, pks=None):
+		"""
+		Resets the `change_count` of every type, or only of the types whose
+		primary keys are provided, from counts of the live changes in the
+		changelog and its archive, saving only the types whose total is off.
+
+		The counts are taken inside the UPDATE itself, so an adjustment
+		committed by another request while it runs can't be overwritten.
+
+		Returns the number of types that were corrected.
+		"""
+		from django.db import transaction
+		from correx.models import Change, ArchivedChange
+		qn = connection.ops.quote_name
+		table = qn(self.model._meta.db_table)
+		pk = '%s.%s' % (table, qn(self.model._meta.pk.column))
+		counts = ' + '.join(['(SELECT COUNT(*) FROM %s WHERE %s = %s AND %s = %%s)' % (
+			qn(model._meta.db_table), qn(model._meta.get_field('change_type').column), pk,
+			qn(model._meta.get_field('is_public').column)) for model in (Change, ArchivedChange)])
+		sql = 'UPDATE %s SET %s = %s WHERE %s <> %s' % (table, qn('change_count'), counts, qn('change_count'), counts)
+		params = [True] * 4
+		if pks is not None:
+			pks = list(pks)
+			if not pks:
+				return 0
+			sql += ' AND %s IN (%s)' % (pk, ', '.join(['%s'] * len(pks)))
+			params += pks
+		cursor = connection.cursor()
+		cursor.execute(sql, params)
+		transaction.commit_unless_managed()
+		return cursor.rowcount
+
+
+class ChangeSummaryManager(models.Manager):
+	"""
+	Reads the per-scope totals kept by ``correx.summaries``. Each of the
+	``for_*`` methods costs one query, however many changes are counted.
+	"""
+
+	def for_scope(self, scope):
+		"""
+		Returns the ``Summary`` for a scope string like 'app:newspaper'.
+		"""
+		from correx.summaries import Summary
+		return Summary(reading(self.get_query_set()).filter(scope=scope).values_list('change_type', 'change_count', 'last_pub_date'))
+
+	def for_object(self, obj):
+		from django.contrib.contenttypes.models import ContentType
+		from correx.summaries import make_scope
+		return self.for_scope(make_scope('object', ContentType.objects.get_for_model(obj).pk, obj.pk))
+
+	def for_model(self, model):
+		from django.contrib.contenttypes.models import ContentType
+		from correx.summaries import make_scope
+		return self.for_scope(make_scope('model', ContentType.objects.get_for_model(model).pk))
+
+	def for_app(self, app_label):
+		from correx.summaries import make_scope
+		return self.for_scope(make_scope('app', app_label))
+
+	def for_site(self, site):
+		from correx.summaries import make_scope
+		return self.for_scope(make_scope('site', site.pk))
+
+	def for_user(self, user):
+		from correx.summaries import make_scope
+		return self.for_scope(make_scope('user', user.pk))
+
+	def for_objects(self, objects):
+		"""
+		Returns a dictionary that maps the (content_type_id, pk) pair of each
+		of the provided objects to its ``Summary``, all from one query.
+		"""
+		from django.contrib.contenttypes.models import ContentType
+		from correx.summaries import Summary, make_scope
+		summaries = {}
+		keys = {}
+		for obj in objects:
+			key = (ContentType.objects.get_for_model(obj).pk, obj.pk)
+			summaries[key] = Summary()
+			keys[make_scope('object', *key)] = key
+		if keys:
+			rows = reading(self.get_query_set()).filter(scope__in=keys.keys()).values_list(
+				'scope', 'change_type', 'change_count', 'last_pub_date')
+			for scope, change_type, change_count, last_pub_date in rows:
+				summaries[keys[scope]].add(change_type, change_count, last_pub_date)
+		return summaries
+
+	def rebuild(self, scopes=None):
+		"""
+		Throws away every summary and recounts them all from the changelog
+		and its archive, with one grouped query of each for each kind of
+		scope.
+
+		If a list of scope tuples, like those in ``correx.caching``, is
+		provided only their rows are recounted.
+
+		Returns the number of rows written.
 		"""
-		return self.get_query_set().filter(is_public=True)
+		from django.db import transaction
+		from correx.summaries import SCOPE_FIELDS, make_scope, count
+		last_pub_date = self.model._meta.get_field('last_pub_date')
+		totals = count(scopes)
+		rows = [(scope, change_type, total, last_pub_date.get_db_prep_save(last))
+			for (scope, change_type), (total, last) in totals.items()]
+
+		qn = connection.ops.quote_name
+		table = qn(self.model._meta.db_table)
+		columns = ', '.join([qn(c) for c in ('scope', 'change_type_id', 'change_count', 'last_pub_date')])
+		if scopes is None:
+			connection.cursor().execute('DELETE FROM %s' % table)
+		else:
+			self.get_query_set().filter(scope__in=[make_scope(*s) for s in scopes if s[0] in SCOPE_FIELDS]).delete()
+		cursor = connection.cursor()
+		if rows:
+			cursor.executemany('INSERT INTO %s (%s) VALUES (%%s, %%s, %%s, %%s)' % (table, columns), rows)
+		transaction.commit_unless_managed()
+		return len(rows)
+
+
+class ChangeRollupManager(models.Manager):
+	"""
+	Reads the daily counts kept by ``correx.rollups``.
+	"""
+	PERIODS = ('day', 'month', 'year')
+
+	def series(self, period='day', **filters):
+		"""
+		Returns a list of (date, count) pairs, oldest first, that totals the
+		changes in each day, month or year that has any. The filters are
+		applied to the rollups, so they can select by ``change_type``,
+		``site``, ``content_app``, ``is_public`` or ``day``.
+
+		Example::
+
+			ChangeRollup.objects.series('month', change_type='Correction', is_public=True)
+
+		"""
+		from django.db.models import Sum
+		from correx.rollups import to_day
+		if period not in self.PERIODS:
+			raise ValueError('period must be one of %s' % ', '.join(self.PERIODS))
+		qs = reading(self.get_query_set()).filter(**filters)
+		if period == 'day':
+			rows = qs.values_list('day')
+		else:
+			qn = connection.ops.quote_name
+			column = '%s.%s' % (qn(self.model._meta.db_table), qn('day'))
+			rows = qs.extra(select={'period': connection.ops.date_trunc_sql(period, column)}).values_list('period')
+		rows = rows.annotate(total=Sum('change_count')).order_by(rows._fields[0])
+		return [(to_day(day), total) for day, total in rows]
+
+	def rebuild(self):
+		"""
+		Throws away every rollup and recounts them all from the changelog
+		and its archive, with one grouped query of each. Returns the number of
+		rows written.
+		"""
+		from django.db import transaction
+		from correx.rollups import count
+		columns = ('day', 'change_type_id', 'site_id', 'content_app', 'is_public', 'archived', 'change_count')
+		fields = dict([(f.column, f) for f in self.model._meta.local_fields])
+		totals = count()
+		rows = []
+		for key, total in totals.items():
+			rows.append(tuple([fields[c].get_db_prep_save(v) for c, v in zip(columns, key + (total,))]))
+
+		qn = connection.ops.quote_name
+		table = qn(self.model._meta.db_table)
+		cursor = connection.cursor()
+		cursor.execute('DELETE FROM %s' % table)
+		if rows:
+			cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (table, ', '.join([qn(c) for c in columns]),
+				', '.join(['%s'] * len(columns))), rows)
+		transaction.commit_unless_managed()
+		return len(rows)
@@ -10,10 +10,18 @@ from django.contrib.contenttypes.models import ContentType
 
 # Signals
 from django.db.models import signals
-from correx.signals import count_changes
+from correx.signals import count_changes, remember_change_state, invalidate_cache, summarize_changes, index_change
+from correx.signals import count_bulk_changes, invalidate_bulk_cache, summarize_bulk_changes
+from correx.signals import rollup_changes, rollup_bulk_changes
+from correx.bulk import changes_updated
+
+# Lookups
+from correx.lookups import reset_app_models, reset_user_ids, reset_change_types
+from correx.routing import mark_written
+from correx.search import install as install_search_index
 
 # Managers
-from correx.managers import ChangeManager
+from correx.managers import ChangeManager, ChangeTypeManager, ChangeSummaryManager, ChangeRollupManager
 
 # Text and date manipulation
 import datetime
@@ -31,6 +39,9 @@ class ChangeType(models.Model):
 	description = models.TextField(null=True, blank=True, help_text=_('A description of the change type'))
 	change_count = models.IntegerField(default=0, editable=False, help_text=_('The number of changes of this type. Automated.'))
 
+	# Managers
+	objects = ChangeTypeManager()
+
 	class Meta:
 		db_table = 'django_content_changetype'
 		ordering = ['name']
@@ -55,26 +66,36 @@ class ChangeType(models.Model):
 		
 	def count_changes(self):
 		"""
-		Counts the total number of live changes of this type and saves the result to the `change_count` field.
+		Counts the total number of live changes of this type, archived ones
+		included, and saves the result to the `change_count` field.
 		"""
-		count = self.change_set.filter(is_public=True).count()
+		count = self.change_set.filter(is_public=True).count() + self.archivedchange_set.filter(is_public=True).count()
 		self.change_count = count
 		self.save()
 
 
-class Change(models.Model):
+class QueuedCount(models.Model):
 	"""
-	A change that is optionally related to a site, app, model or object.
-	
-	``Managers``
-		
-		``live()``
-			The custom manager live() returns only changes where `is_public` is True. 
-			
-			Example::
-	
-				Change.objects.live()
-	
+	A change type whose `change_count` is due to be refreshed.
+
+	Written in place of adjusting the count when CORREX_DEFERRED_COUNTS is
+	on, and cleared by the `refresh_counts` management command.
+	"""
+	change_type = models.ForeignKey(ChangeType)
+	queued = models.DateTimeField(default=datetime.datetime.now)
+
+	class Meta:
+		db_table = 'django_content_changetype_queue'
+		ordering = ['id']
+
+	def __unicode__(self):
+		return u'%s (queued %s)' % (self.change_type_id, self.queued)
+
+
+class BaseChange(models.Model):
+	"""
+	The fields and methods shared by the changes in the changelog and the
+	ones moved to its archive by ``correx.archive``.
 	"""
 	# A list of all the installed apps in a set of paired tuples.
 	# I've excluded the django contrib apps and included them as
@@ -101,21 +122,14 @@ class Change(models.Model):
 	object_id      = models.PositiveIntegerField(null=True, blank=True, help_text=_('The particular database record being changed. Optional.'))
 	content_object = generic.GenericForeignKey(ct_field='content_type', fk_field='object_id')
 	
-	# Managers
-	objects = ChangeManager()
-	
 	class Meta:
-		db_table = 'django_content_changelog'
+		abstract = True
 		ordering = ['-pub_date']
 		get_latest_by = "pub_date"
-		verbose_name = _('change')
 
 	def __unicode__(self):
 		return self.description
 
-	def get_absolute_url(self):
-		return u'/change-log/change/%s/' % self.pk
-
 	def get_short_description(self):
 		"""
 		A shorter version of the description field for use in tight spaces.
@@ -136,6 +150,189 @@ class Change(models.Model):
 	get_content_object.short_description = _('Record')
 
 
-# Rerun the totals for each ChangeType whenever a Change is saved or deleted.
+class Change(BaseChange):
+	"""
+	A change that is optionally related to a site, app, model or object.
+	
+	``Managers``
+		
+		``live()``
+			The custom manager live() returns only changes where `is_public` is True. 
+			
+			Example::
+	
+				Change.objects.live()
+
+		``search(query)``
+			Any queryset of changes can be narrowed to those whose
+			descriptions match every word of a search. See ``correx.search``.
+
+			Example::
+
+				Change.objects.live().search('obituary correction')
+
+		``records()``
+			Any queryset of changes can yield compact, read-only records in
+			place of full changes for display. See ``correx.records``.
+
+			Example::
+
+				Change.objects.live().records()[:10]
+
+		``history()``
+			The changes in both the changelog and its archive, newest first.
+			See ``correx.archive``.
+
+			Example::
+
+				Change.objects.history().filter(is_public=True)[:50]
+	
+	"""
+	# Managers
+	objects = ChangeManager()
+	
+	class Meta(BaseChange.Meta):
+		db_table = 'django_content_changelog'
+		verbose_name = _('change')
+
+	def get_absolute_url(self):
+		return u'/change-log/change/%s/' % self.pk
+
+
+class ArchivedChange(BaseChange):
+	"""
+	A change moved out of the changelog, once it was old enough, by
+	``correx.archive``. It keeps its id, and still counts towards the
+	totals, summaries and rollups.
+	"""
+	class Meta(BaseChange.Meta):
+		db_table = 'django_content_changelog_archive'
+		verbose_name = _('archived change')
+
+
+class ChangeSummary(models.Model):
+	"""
+	The number of public changes of one type within an object, model, app,
+	site or user, and the date of the newest. Automated.
+
+	See ``correx.summaries`` for how the rows are kept and named.
+
+	``Managers``
+
+		``for_object(obj)``
+			Returns the counts for an object, keyed by change type.
+
+			Example::
+
+				ChangeSummary.objects.for_object(story).Correction
+
+		``for_objects(objects)``
+			Returns the counts for a list of objects at once.
+
+		``for_model(model)``, ``for_app(app_label)``, ``for_site(site)`` and ``for_user(user)``
+			The same for each of the other scopes.
+
+	"""
+	scope = models.CharField(max_length=255)
+	change_type = models.ForeignKey(ChangeType)
+	change_count = models.IntegerField(default=0)
+	last_pub_date = models.DateTimeField(null=True)
+
+	# Managers
+	objects = ChangeSummaryManager()
+
+	class Meta:
+		db_table = 'django_content_changesummary'
+		unique_together = (('scope', 'change_type'),)
+		verbose_name_plural = _('change summaries')
+
+	def __unicode__(self):
+		return u'%s %s (%s)' % (self.scope, self.change_type_id, self.change_count)
+
+
+class ChangeRollup(models.Model):
+	"""
+	The number of changes published on one day with one type, site, app and
+	publication status, in the changelog or in its archive. Automated.
+
+	See ``correx.rollups`` for how the rows are kept.
+
+	``Managers``
+
+		``series(period, **filters)``
+			Returns the number of changes in each day, month or year.
+
+			Example::
+
+				ChangeRollup.objects.series('month', change_type='Correction')
+
+		``rebuild()``
+			Recounts every row from the changelog.
+
+	"""
+	day = models.DateField(db_index=True)
+	change_type = models.ForeignKey(ChangeType)
+	site = models.ForeignKey(Site, null=True)
+	content_app = models.CharField(max_length=200, null=True)
+	is_public = models.BooleanField()
+	archived = models.BooleanField(default=False)
+	change_count = models.IntegerField(default=0)
+
+	# Managers
+	objects = ChangeRollupManager()
+
+	class Meta:
+		db_table = 'django_content_changerollup'
+		unique_together = (('day', 'change_type', 'site', 'content_app', 'is_public', 'archived'),)
+		verbose_name_plural = _('change rollups')
+
+	def __unicode__(self):
+		return u'%s %s (%s)' % (self.day, self.change_type_id, self.change_count)
+
+
+# Adjust the totals for each affected ChangeType whenever a Change is saved or deleted.
+signals.pre_save.connect(remember_change_state, sender=Change)
+signals.pre_delete.connect(remember_change_state, sender=Change)
 signals.post_save.connect(count_changes, sender=Change)
 signals.post_delete.connect(count_changes, sender=Change)
+
+# Retire any cached lists the Change might appear in.
+signals.post_save.connect(invalidate_cache, sender=Change)
+signals.post_delete.connect(invalidate_cache, sender=Change)
+
+# Move the per-scope summaries the Change is counted in.
+signals.post_save.connect(summarize_changes, sender=Change)
+signals.post_delete.connect(summarize_changes, sender=Change)
+
+# Move the daily rollups the Change is counted in.
+signals.post_save.connect(rollup_changes, sender=Change)
+signals.post_delete.connect(rollup_changes, sender=Change)
+
+# Keep the full-text index of descriptions in step.
+signals.post_save.connect(index_change, sender=Change)
+signals.post_delete.connect(index_change, sender=Change)
+signals.post_syncdb.connect(install_search_index)
+
+# Do the same once for each batch of changes published, unpublished or retyped in bulk.
+changes_updated.connect(count_bulk_changes, sender=Change)
+changes_updated.connect(invalidate_bulk_cache, sender=Change)
+changes_updated.connect(summarize_bulk_changes, sender=Change)
+changes_updated.connect(rollup_bulk_changes, sender=Change)
+
+# Read the rest of the request from the primary once it has written a Change.
+signals.post_save.connect(mark_written, sender=Change)
+signals.post_delete.connect(mark_written, sender=Change)
+changes_updated.connect(mark_written, sender=Change)
+
+# Rebuild the admin form's map of models by app when the content types change.
+signals.post_syncdb.connect(reset_app_models)
+signals.post_save.connect(reset_app_models, sender=ContentType)
+signals.post_delete.connect(reset_app_models, sender=ContentType)
+
+# Forget the ids of usernames looked up for the template tags when the users change.
+signals.post_save.connect(reset_user_ids, sender=User)
+signals.post_delete.connect(reset_user_ids, sender=User)
+
+# Forget the change types kept for the lightweight records when they change.
+signals.post_save.connect(reset_change_types, sender=ChangeType)
+signals.post_delete.connect(reset_change_types, sender=ChangeType)
@@ -0,0 +1,125 @@
+"""
+Compact, read-only stand-ins for changes, for pages that only display them.
+
+A full ``Change`` carries its whole description and loads its type, user
+and site with a query apiece the first time a template touches them. A
+``ChangeRecord`` holds only the columns a changelog list shows: the first
+50 characters of the description, cut short in SQL, the username and site
+name, joined in the same query, and its type, filled from a map of the
+change types kept for the life of the process. Ask a queryset for them
+with ``records()``::
+
+	Change.objects.live().records()[:10]
+
+The template tags return them instead of changes when the
+CORREX_TAG_RECORDS setting is on. A record prints as its short
+description, and keeps the ids of everything it is connected to, but has
+no ``description``, ``content_object`` or ``save()``.
+"""
+from django.conf import settings
+
+SHORT_DESCRIPTION_LENGTH = 50
+
+# The names a record's values are pulled by, in the order the record takes them
+RECORD_FIELDS = ('id', 'short_description', 'pub_date', 'change_type', 'user', 'user__username',
+	'site', 'site__name', 'content_app', 'content_type', 'object_id')
+
+
+def is_enabled():
+	"""
+	Whether the CORREX_TAG_RECORDS setting has the template tags return records.
+	"""
+	return getattr(settings, 'CORREX_TAG_RECORDS', False)
+
+
+def get_short_description_sql():
+	"""
+	Returns the SQL that cuts a change's description down to size.
+	"""
+	from django.db import connection
+	from correx.models import Change
+	qn = connection.ops.quote_name
+	return 'SUBSTR(%s.%s, 1, %s)' % (qn(Change._meta.db_table), qn('description'), SHORT_DESCRIPTION_LENGTH)
+
+
+class ReadOnlyRecord(object):
+	"""
+	Sets its slots from the provided values, in order, and refuses changes after.
+	"""
+	__slots__ = ()
+
+	def __init__(self, *values):
+		for name, value in zip(self.__slots__, values):
+			object.__setattr__(self, name, value)
+
+	def __setattr__(self, name, value):
+		raise AttributeError('%s is read-only' % self.__class__.__name__)
+
+	def __getstate__(self):
+		return [getattr(self, name) for name in self.__slots__]
+
+	def __setstate__(self, state):
+		ReadOnlyRecord.__init__(self, *state)
+
+	def __eq__(self, other):
+		return self.__class__ is other.__class__ and self.__getstate__() == other.__getstate__()
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __str__(self):
+		return unicode(self).encode('utf-8')
+
+
+class ChangeTypeRecord(ReadOnlyRecord):
+	"""
+	The parts of a ``ChangeType`` a changelog list shows.
+	"""
+	__slots__ = ('name', 'slug', 'icon_url')
+
+	def __unicode__(self):
+		return self.name
+
+	@property
+	def pk(self):
+		return self.name
+
+	def get_absolute_url(self):
+		return u'/change-log/type/%s/' % self.slug
+
+	def get_icon_url(self):
+		return self.icon_url
+
+
+class ChangeRecord(ReadOnlyRecord):
+	"""
+	The parts of a ``Change`` a changelog list shows.
+	"""
+	__slots__ = ('id', 'short_description', 'pub_date', 'change_type_id', 'user_id', 'username',
+		'site_id', 'site_name', 'content_app', 'content_type_id', 'object_id')
+
+	def __init__(self, *values):
+		super(ChangeRecord, self).__init__(*values)
+		# Finished like ``Change.short_description``
+		object.__setattr__(self, 'short_description', u'%s...' % self.short_description)
+
+	def __unicode__(self):
+		return self.short_description
+
+	def __repr__(self):
+		return '<ChangeRecord: %s>' % self
+
+	@property
+	def pk(self):
+		return self.id
+
+	@property
+	def change_type(self):
+		from correx.lookups import get_change_types
+		return get_change_types().get(self.change_type_id)
+
+	def get_short_description(self):
+		return self.short_description
+
+	def get_absolute_url(self):
+		return u'/change-log/change/%s/' % self.id
@@ -0,0 +1,141 @@
+"""
+Incremental maintenance of the ``ChangeRollup`` table.
+
+The table counts the changes published on each day with each type, site,
+app and publication status, and whether they have been archived, so statistics over time, like corrections per
+month, and the admin's date drill-down read a few hundred rows rather than
+grouping the whole changelog.
+
+The handlers in ``correx.signals`` pass the before and after states of
+each write, or of each batch of bulk updates, to the functions here, which
+move one count down and another up. Writes that skip the signals, like
+``QuerySet.update()``, are squared up by ``ChangeRollup.objects.rebuild()``.
+"""
+import datetime
+
+from django.db import connection, transaction, IntegrityError
+from django.db.backends.util import typecast_date
+from django.db.models import F
+
+
+def get_day_sql(model=None):
+	"""
+	Returns the SQL that cuts a change's publication date to the day, for
+	the changelog or the provided model, such as its archive.
+	"""
+	if model is None:
+		from correx.models import Change as model
+	qn = connection.ops.quote_name
+	column = '%s.%s' % (qn(model._meta.db_table), qn(model._meta.get_field('pub_date').column))
+	return connection.ops.date_trunc_sql('day', column)
+
+
+def to_day(value):
+	"""
+	Returns the date of a datetime, or of a date truncated by the database,
+	which some backends hand back as a string.
+	"""
+	if isinstance(value, basestring):
+		return typecast_date(value[:10])
+	if isinstance(value, datetime.datetime):
+		return value.date()
+	return value
+
+
+def get_key(state):
+	"""
+	Returns the (day, change type, site, app, is_public, archived) row a
+	change in the provided state is counted in, or None for a state of None.
+	States are of changes in the changelog unless they say otherwise with
+	an ``archived`` key.
+	"""
+	if not state:
+		return None
+	return (to_day(state['pub_date']), state['change_type_id'], state['site_id'],
+		state['content_app'], state['is_public'], state.get('archived', False))
+
+
+def count(chunk_size=None):
+	"""
+	Returns a dictionary that maps every row the changes in the changelog
+	and its archive are counted in, by the keys ``get_key`` returns, to its
+	count, from grouped queries over ``chunk_size`` ids at a time or over
+	each whole table.
+	"""
+	from django.db.models import Count
+	from correx.archive import get_querysets
+	totals = {}
+	from correx.models import ArchivedChange
+	for qs in get_querysets(chunk_size):
+		grouped = qs.extra(select={'day': get_day_sql(qs.model)}).values_list(
+			'day', 'change_type', 'site', 'content_app', 'is_public').annotate(total=Count('id')).order_by()
+		for values in grouped:
+			key = (to_day(values[0]),) + tuple(values[1:-1]) + (qs.model is ArchivedChange,)
+			totals[key] = totals.get(key, 0) + values[-1]
+	return totals
+
+
+def refresh(key):
+	"""
+	Sets a row from a fresh count of the changelog, or of its archive for
+	an archived row, removing it if there is nothing left to count.
+	"""
+	from correx.models import Change, ArchivedChange, ChangeRollup
+	day, change_type_id, site_id, content_app, is_public, archived = key
+	start = datetime.datetime.combine(day, datetime.time())
+	model = archived and ArchivedChange or Change
+	total = model.objects.filter(pub_date__gte=start, pub_date__lt=start + datetime.timedelta(days=1),
+		change_type=change_type_id, site=site_id, content_app=content_app, is_public=is_public).count()
+	rows = ChangeRollup.objects.filter(day=day, change_type=change_type_id, site=site_id,
+		content_app=content_app, is_public=is_public, archived=archived)
+	if not total:
+		rows.delete()
+	elif not rows.update(change_count=total):
+		add(key, total)
+
+
+def add(key, delta):
+	"""
+	Moves a row's count by ``delta``, creating the row if need be and
+	removing it once it counts nothing.
+	"""
+	from correx.models import ChangeRollup
+	day, change_type_id, site_id, content_app, is_public, archived = key
+	rows = ChangeRollup.objects.filter(day=day, change_type=change_type_id, site=site_id,
+		content_app=content_app, is_public=is_public, archived=archived)
+	if not rows.update(change_count=F('change_count') + delta):
+		# Another request may create the row first, in which case it is
+		# updated after all
+		sid = transaction.savepoint()
+		try:
+			ChangeRollup.objects.create(day=day, change_type_id=change_type_id, site_id=site_id,
+				content_app=content_app, is_public=is_public, archived=archived, change_count=delta)
+			transaction.savepoint_commit(sid)
+		except IntegrityError:
+			transaction.savepoint_rollback(sid)
+			rows.update(change_count=F('change_count') + delta)
+	if delta < 0:
+		rows.filter(change_count__lte=0).delete()
+
+
+def update_rollups(groups):
+	"""
+	Moves the rows touched by a list of (before, after, count) triples, where
+	``count`` changes went from the state before to the state after. Either
+	state may be None. Returns the number of rows moved.
+	"""
+	deltas = {}
+	for before, after, count in groups:
+		old_key, new_key = get_key(before), get_key(after)
+		if old_key == new_key:
+			continue
+		if old_key is not None:
+			deltas[old_key] = deltas.get(old_key, 0) - count
+		if new_key is not None:
+			deltas[new_key] = deltas.get(new_key, 0) + count
+	moved = 0
+	for key, delta in deltas.items():
+		if delta:
+			add(key, delta)
+			moved += 1
+	return moved
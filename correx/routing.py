@@ -0,0 +1,150 @@
+"""
+Sends the public changelog's reads to read replicas.
+
+Django 1.1 only knows one database, so rather than a router this module
+keeps its own connections to the replicas listed in the
+CORREX_READ_DATABASES setting and hands them to the querysets that read
+the public changelog: ``Change.objects.live()`` and everything built on it,
+which covers the template tags, feeds and API, along with the summaries
+and the lookups behind the admin's content type filter. Each entry is a
+dictionary of the DATABASE_* settings where the replica differs from the
+primary::
+
+	CORREX_READ_DATABASES = [
+		{'DATABASE_HOST': 'replica1.example.com'},
+		{'DATABASE_HOST': 'replica2.example.com'},
+	]
+
+A replica is picked at random for each queryset. Writes, the upkeep of
+the counts and summaries, and the admin stay on the primary, and updates
+or deletes made through a queryset that was reading from a replica are
+moved back to it.
+
+Once a change is saved or deleted, the rest of that request reads from
+the primary. With ``ReadYourWritesMiddleware`` installed, so does the
+browser that made the change, for CORREX_READ_STICKY_SECONDS (10 by
+default), giving the replicas time to catch up before the editor looks
+for their work.
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.core import signals
+from django.db import connection, load_backend
+
+STICKY_COOKIE = 'correx_primary'
+
+_local = threading.local()
+_replicas = None
+
+
+def get_replicas():
+	"""
+	Returns the connections to the replicas, opening them lazily.
+	"""
+	global _replicas
+	if _replicas is None:
+		replicas = []
+		for overrides in getattr(settings, 'CORREX_READ_DATABASES', []):
+			overrides = dict(overrides)
+			backend = load_backend(overrides.pop('DATABASE_ENGINE', settings.DATABASE_ENGINE))
+			settings_dict = connection.settings_dict.copy()
+			settings_dict.update(overrides)
+			replicas.append(backend.DatabaseWrapper(settings_dict))
+		_replicas = replicas
+	return _replicas
+
+
+def pin_to_primary():
+	"""
+	Sends the rest of this thread's reads to the primary until the next request.
+	"""
+	_local.pinned = True
+
+
+def is_pinned():
+	return getattr(_local, 'pinned', False)
+
+
+def get_read_connection():
+	"""
+	Returns the connection to read the public changelog through.
+	"""
+	replicas = get_replicas()
+	if not replicas or is_pinned():
+		return connection
+	return random.choice(replicas)
+
+
+def using(queryset, conn):
+	"""
+	Returns a copy of a queryset that runs on the provided connection.
+	"""
+	if queryset.query.connection is conn:
+		return queryset
+	queryset = queryset._clone()
+	queryset.query.connection = conn
+	return queryset
+
+
+def reading(queryset):
+	"""
+	Returns a copy of a queryset that reads from a replica, if there is one
+	to read from.
+	"""
+	return using(queryset, get_read_connection())
+
+
+def on_primary(queryset):
+	"""
+	Returns a copy of a queryset that runs on the primary.
+	"""
+	return using(queryset, connection)
+
+
+def mark_written(*args, **kwargs):
+	"""
+	Records that this request wrote to the changelog. Connected to the
+	signals sent when changes are saved, deleted or updated in bulk.
+	"""
+	_local.wrote = True
+	pin_to_primary()
+
+
+def reset(*args, **kwargs):
+	"""
+	Starts each request reading from the replicas again. Connected to
+	``request_started``.
+	"""
+	_local.pinned = False
+	_local.wrote = False
+
+
+def close_replicas(*args, **kwargs):
+	"""
+	Closes the connections to the replicas at the end of each request, as
+	Django does for the primary.
+	"""
+	for replica in _replicas or []:
+		replica.close()
+
+
+signals.request_started.connect(reset)
+signals.request_finished.connect(close_replicas)
+
+
+class ReadYourWritesMiddleware(object):
+	"""
+	Keeps a browser reading from the primary for a while after it saves or
+	deletes a change, so an editor sees their own work even when the
+	replicas are behind.
+	"""
+	def process_request(self, request):
+		if request.COOKIES.get(STICKY_COOKIE):
+			pin_to_primary()
+
+	def process_response(self, request, response):
+		if getattr(_local, 'wrote', False):
+			response.set_cookie(STICKY_COOKIE, '1', max_age=getattr(settings, 'CORREX_READ_STICKY_SECONDS', 10))
+		return response
@@ -0,0 +1,245 @@
+"""
+Full-text search over the descriptions of changes.
+
+The descriptions are copied into an index kept by the database -- an FTS5
+table on SQLite, a tsvector column with a GIN index on PostgreSQL -- so a
+search reads the index rather than scanning every description with LIKE.
+The index is created by syncdb, kept up to date as changes are saved and
+deleted, and filled from scratch by the ``rebuild_search_index`` management
+command, which also creates it for an existing install. Descriptions edited
+with ``QuerySet.update()`` need a rebuild to be found.
+
+Search through a queryset::
+
+	Change.objects.live().search('obituary correction')
+
+Every word must match, and each matches the words that start with it, so
+unlike ``icontains`` a search for the middle of a word, like "rection",
+finds nothing. The admin falls back to its own ``icontains`` when the
+index finds nothing. Other databases use ``icontains`` on each word. The backend is
+picked by DATABASE_ENGINE, or by name with the CORREX_SEARCH_BACKEND
+setting: 'fts5', 'tsvector' or 'like'. The PostgreSQL text search
+configuration is set by CORREX_SEARCH_CONFIG, which defaults to 'english'.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+
+TABLE = 'correx_change_search'
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def get_words(query):
+	"""
+	Splits a search into words, dropping the punctuation that the indexes
+	would read as syntax.
+	"""
+	return WORD.findall(query)
+
+
+class LikeBackend(object):
+	"""
+	Matches every word against the description with ``icontains``. Keeps no index.
+	"""
+	def install(self, cursor):
+		pass
+
+	def clear(self, cursor):
+		pass
+
+	def index(self, cursor, rows):
+		pass
+
+	def remove(self, cursor, ids):
+		pass
+
+	def get_bounds(self, cursor):
+		"""
+		Returns the lowest and highest ids in the index, or None if there is
+		no index to read.
+		"""
+		return None
+
+	def filter(self, queryset, words):
+		for word in words:
+			queryset = queryset.filter(description__icontains=word)
+		return queryset
+
+
+class IndexBackend(LikeBackend):
+	"""
+	A backend whose index is a table keyed by the change's id, matched
+	through a subquery.
+	"""
+	create_sql = ()
+	match_sql = None
+	id_column = None
+
+	def install(self, cursor):
+		# Checked first, as SQLite commits before running any DDL
+		if TABLE in connection.introspection.table_names():
+			return
+		for sql in self.create_sql:
+			cursor.execute(sql)
+
+	def clear(self, cursor):
+		cursor.execute('DELETE FROM %s' % TABLE)
+
+	def get_bounds(self, cursor):
+		if TABLE not in connection.introspection.table_names():
+			return None
+		cursor.execute('SELECT MIN(%s), MAX(%s) FROM %s' % (self.id_column, self.id_column, TABLE))
+		return cursor.fetchone()
+
+	def get_ids(self, cursor, low, high):
+		"""
+		Returns the set of ids from ``low`` up to, but not including,
+		``high`` that are in the index.
+		"""
+		cursor.execute('SELECT %s FROM %s WHERE %s >= %%s AND %s < %%s' % (
+			self.id_column, TABLE, self.id_column, self.id_column), [low, high])
+		return set([row[0] for row in cursor.fetchall()])
+
+	def get_match_params(self, words):
+		raise NotImplementedError
+
+	def filter(self, queryset, words):
+		from correx.models import Change
+		qn = connection.ops.quote_name
+		column = '%s.%s' % (qn(Change._meta.db_table), qn(Change._meta.pk.column))
+		return queryset.extra(where=['%s IN (%s)' % (column, self.match_sql)], params=self.get_match_params(words))
+
+
+class FTS5Backend(IndexBackend):
+	"""
+	Keeps a copy of each description in an SQLite FTS5 table, under the
+	change's id as its rowid.
+	"""
+	create_sql = (
+		'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(description)' % TABLE,
+	)
+	match_sql = 'SELECT rowid FROM %s WHERE %s MATCH %%s' % (TABLE, TABLE)
+	id_column = 'rowid'
+
+	def index(self, cursor, rows):
+		cursor.executemany('INSERT OR REPLACE INTO %s (rowid, description) VALUES (%%s, %%s)' % TABLE, rows)
+
+	def remove(self, cursor, ids):
+		cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % TABLE, [(pk,) for pk in ids])
+
+	def get_match_params(self, words):
+		# Each word quoted, so it can't be read as an operator, and matched as a prefix
+		return [' '.join(['"%s"*' % word for word in words])]
+
+
+class TsvectorBackend(IndexBackend):
+	"""
+	Keeps the tsvector of each description in a PostgreSQL table with a GIN index.
+	"""
+	create_sql = (
+		'CREATE TABLE IF NOT EXISTS %s (change_id integer PRIMARY KEY, document tsvector NOT NULL)' % TABLE,
+		'CREATE INDEX IF NOT EXISTS %s_document ON %s USING gin(document)' % (TABLE, TABLE),
+	)
+	match_sql = 'SELECT change_id FROM %s WHERE document @@ to_tsquery(%%s, %%s)' % TABLE
+	id_column = 'change_id'
+
+	def get_config(self):
+		return getattr(settings, 'CORREX_SEARCH_CONFIG', 'english')
+
+	def index(self, cursor, rows):
+		self.remove(cursor, [pk for pk, description in rows])
+		cursor.executemany('INSERT INTO %s (change_id, document) VALUES (%%s, to_tsvector(%%s, %%s))' % TABLE,
+			[(pk, self.get_config(), description) for pk, description in rows])
+
+	def remove(self, cursor, ids):
+		cursor.executemany('DELETE FROM %s WHERE change_id = %%s' % TABLE, [(pk,) for pk in ids])
+
+	def get_match_params(self, words):
+		return [self.get_config(), ' & '.join(['%s:*' % word for word in words])]
+
+
+BACKENDS = {
+	'fts5': FTS5Backend,
+	'tsvector': TsvectorBackend,
+	'like': LikeBackend,
+}
+
+ENGINES = {
+	'sqlite3': 'fts5',
+	'postgresql': 'tsvector',
+	'postgresql_psycopg2': 'tsvector',
+}
+
+
+def get_backend():
+	"""
+	Returns the search backend named by the CORREX_SEARCH_BACKEND setting,
+	or the one that suits the database.
+	"""
+	name = getattr(settings, 'CORREX_SEARCH_BACKEND', None)
+	if name is None:
+		name = ENGINES.get(settings.DATABASE_ENGINE, 'like')
+	return BACKENDS[name]()
+
+
+def search(queryset, query):
+	"""
+	Narrows a queryset of changes to those whose descriptions match every
+	word of the query. A query without any words matches nothing.
+	"""
+	words = get_words(query)
+	if not words:
+		# Rather than none(), whose EmptyQuerySet drops the queryset's class
+		# and with it methods like with_content_objects()
+		return queryset.filter(pk__in=[])
+	return get_backend().filter(queryset, words)
+
+
+def index_changes(rows):
+	"""
+	Adds or replaces the provided (id, description) pairs in the index.
+	"""
+	get_backend().index(connection.cursor(), rows)
+
+
+def remove_changes(ids):
+	"""
+	Takes the changes with the provided ids out of the index.
+	"""
+	get_backend().remove(connection.cursor(), ids)
+
+
+def install(created_models=None, **kwargs):
+	"""
+	Creates the index if it doesn't exist yet. Connected to ``post_syncdb``,
+	where it waits for the table of changes to be created.
+	"""
+	from correx.models import Change
+	if created_models is not None and Change not in created_models:
+		return
+	get_backend().install(connection.cursor())
+	transaction.commit_unless_managed()
+
+
+@transaction.commit_on_success
+def rebuild(batch_size=1000):
+	"""
+	Creates the index if needed and refills it from every change, reading
+	``batch_size`` changes at a time. Returns the number indexed.
+	"""
+	from correx.models import Change
+	backend = get_backend()
+	cursor = connection.cursor()
+	backend.install(cursor)
+	backend.clear(cursor)
+	last, total = 0, 0
+	while True:
+		rows = list(Change.objects.filter(pk__gt=last).order_by('pk').values_list('pk', 'description')[:batch_size])
+		if not rows:
+			break
+		backend.index(cursor, rows)
+		last = rows[-1][0]
+		total += len(rows)
+	return total
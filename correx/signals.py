@@ -1,9 +1,198 @@
+from django.db.models import signals
+from correx import counters, caching, summaries, search, rollups
+from correx.instrumentation import Measurement
+
+# The columns whose values before and after a write are compared by the
+# handlers below, given as attribute names on a Change instance.
+TRACKED_FIELDS = ('change_type_id', 'is_public', 'pub_date', 'site_id', 'user_id', 'content_app', 'content_type_id', 'object_id')
+
+
+def stored_state(instance):
+	"""
+	Returns a dictionary of the tracked fields as currently stored in the
+	database for the provided change, or None if it has not been saved yet.
+	"""
+	if instance.pk is None:
+		return None
+	from correx.models import Change
+	names = dict([(f.attname, f.name) for f in Change._meta.local_fields])
+	rows = list(Change.objects.filter(pk=instance.pk).values_list(*[names[a] for a in TRACKED_FIELDS])[:1])
+	if not rows:
+		return None
+	state = dict(zip(TRACKED_FIELDS, rows[0]))
+	state['is_public'] = bool(state['is_public'])
+	return state
+
+
+def current_state(instance):
+	"""
+	Returns a dictionary of the tracked fields as held by the instance in memory.
+	"""
+	state = dict([(attname, getattr(instance, attname)) for attname in TRACKED_FIELDS])
+	state['is_public'] = bool(state['is_public'])
+	# Dates may still be held as the strings they were assigned as
+	state['pub_date'] = instance._meta.get_field('pub_date').to_python(state['pub_date'])
+	return state
+
+
+def remember_change_state(sender, instance, *args, **kwargs):
+	"""
+	Records how a change is stored before it is saved or deleted, so the
+	handlers below can act on the difference afterwards.
+	"""
+	measurement = Measurement('signal', 'remember_change_state')
+	try:
+		instance._correx_prior_state = stored_state(instance)
+		measurement.finish(('change', instance.pk), int(instance._correx_prior_state is not None))
+	finally:
+		measurement.close()
+
+
+def get_states(instance, signal):
+	"""
+	Returns the (before, after) pair of states for a change that has just
+	been saved or deleted.
+	"""
+	before = getattr(instance, '_correx_prior_state', None)
+	if signal is signals.post_delete:
+		return before, None
+	return before, current_state(instance)
 
 
 def count_changes(sender, instance, signal, *args, **kwargs):
 	"""
-	Runs through all the change types and adds up their current numbers
+	Moves the totals of the change types touched by a save or delete.
+
+	Publishing, unpublishing, retyping and deleting each adjust only the
+	affected types rather than recounting all of them. With
+	CORREX_DEFERRED_COUNTS on the types are queued for a refresh instead.
+	"""
+	measurement = Measurement('signal', 'count_changes')
+	try:
+		before, after = get_states(instance, signal)
+		deltas = counters.get_deltas(before, after)
+		if counters.is_deferred():
+			counters.queue_counts(deltas)
+		else:
+			counters.adjust_counts(deltas)
+		measurement.finish(('change', instance.pk), len(deltas))
+	finally:
+		measurement.close()
+
+
+def invalidate_cache(sender, instance, signal, *args, **kwargs):
+	"""
+	Retires the cached lists that could include the change before or after
+	a save or delete.
+	"""
+	measurement = Measurement('signal', 'invalidate_cache')
+	try:
+		before, after = get_states(instance, signal)
+		scopes = caching.invalidate(before, after)
+		measurement.finish(('change', instance.pk), len(scopes))
+	finally:
+		measurement.close()
+
+
+def summarize_changes(sender, instance, signal, *args, **kwargs):
+	"""
+	Moves the per-scope summaries a change is counted in before or after a
+	save or delete.
+	"""
+	measurement = Measurement('signal', 'summarize_changes')
+	try:
+		before, after = get_states(instance, signal)
+		rows = summaries.update_summaries(before, after)
+		measurement.finish(('change', instance.pk), rows)
+	finally:
+		measurement.close()
+
+
+def rollup_changes(sender, instance, signal, *args, **kwargs):
+	"""
+	Moves a change from one daily rollup to another after a save or delete.
+	"""
+	measurement = Measurement('signal', 'rollup_changes')
+	try:
+		before, after = get_states(instance, signal)
+		rows = rollups.update_rollups([(before, after, 1)])
+		measurement.finish(('change', instance.pk), rows)
+	finally:
+		measurement.close()
+
+
+def index_change(sender, instance, signal, *args, **kwargs):
+	"""
+	Copies a change's description into the full-text index when it is
+	saved, and takes it out when it is deleted.
+	"""
+	measurement = Measurement('signal', 'index_change')
+	try:
+		if signal is signals.post_delete:
+			search.remove_changes([instance.pk])
+		else:
+			search.index_changes([(instance.pk, instance.description)])
+		measurement.finish(('change', instance.pk), 1)
+	finally:
+		measurement.close()
+
+
+def count_bulk_changes(sender, groups, *args, **kwargs):
+	"""
+	Moves the totals of the change types touched by a bulk update from
+	``correx.bulk``, with one UPDATE per type for the whole batch.
+	"""
+	measurement = Measurement('signal', 'count_bulk_changes')
+	try:
+		deltas = {}
+		for before, after, count in groups:
+			for pk, delta in counters.get_deltas(before, after).items():
+				deltas[pk] = deltas.get(pk, 0) + delta * count
+		deltas = dict([(k, v) for k, v in deltas.items() if v])
+		if counters.is_deferred():
+			counters.queue_counts(deltas)
+		else:
+			counters.adjust_counts(deltas)
+		measurement.finish(None, len(deltas))
+	finally:
+		measurement.close()
+
+
+def invalidate_bulk_cache(sender, groups, *args, **kwargs):
+	"""
+	Retires the cached lists and feeds that could include any change in a
+	bulk update, bumping each scope once.
+	"""
+	measurement = Measurement('signal', 'invalidate_bulk_cache')
+	try:
+		scopes = set()
+		for before, after, count in groups:
+			scopes.update(caching.get_changed_scopes(before, after))
+		caching.bump_generations(scopes)
+		measurement.finish(None, len(scopes))
+	finally:
+		measurement.close()
+
+
+def summarize_bulk_changes(sender, groups, *args, **kwargs):
+	"""
+	Moves the summaries touched by a bulk update, once for each row.
+	"""
+	measurement = Measurement('signal', 'summarize_bulk_changes')
+	try:
+		rows = summaries.update_bulk_summaries(groups)
+		measurement.finish(None, rows)
+	finally:
+		measurement.close()
+
+
+def rollup_bulk_changes(sender, groups, *args, **kwargs):
+	"""
+	Moves the daily rollups touched by a bulk update, once for each row.
 	"""
-	from correx.models import ChangeType
-	for change_type in ChangeType.objects.all():
-		change_type.count_changes()
\ No newline at end of file
+	measurement = Measurement('signal', 'rollup_bulk_changes')
+	try:
+		rows = rollups.update_rollups(groups)
+		measurement.finish(None, rows)
+	finally:
+		measurement.close()
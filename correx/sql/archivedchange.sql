@@ -0,0 +1,14 @@
+-- The same indexes as the changelog's, for the archive. The summaries read
+-- the newest change of each scope from both tables, newest first.
+--
+-- syncdb runs this file when it creates the table. To add the indexes to
+-- an existing install, run:
+--
+--     python manage.py sqlcustom correx | python manage.py dbshell
+
+CREATE INDEX correx_archive_live ON django_content_changelog_archive (is_public, pub_date);
+CREATE INDEX correx_archive_object ON django_content_changelog_archive (content_type_id, object_id, is_public, pub_date);
+CREATE INDEX correx_archive_model ON django_content_changelog_archive (content_type_id, is_public, pub_date);
+CREATE INDEX correx_archive_app ON django_content_changelog_archive (content_app, is_public, pub_date);
+CREATE INDEX correx_archive_site ON django_content_changelog_archive (site_id, is_public, pub_date);
+CREATE INDEX correx_archive_user ON django_content_changelog_archive (user_id, is_public, pub_date);
@@ -0,0 +1,27 @@
+-- Composite indexes for the public queries run by the template tags and
+-- ChangeManager.live(). Each one leads with the columns the query filters
+-- on and ends with pub_date, so the newest rows can be read straight off
+-- the index instead of sorting everything that matches.
+--
+-- syncdb runs this file when it creates the table. To add the indexes to
+-- an existing install, run:
+--
+--     python manage.py sqlcustom correx | python manage.py dbshell
+
+-- Change.objects.live() and {% get_latest_changes %}
+CREATE INDEX correx_change_live ON django_content_changelog (is_public, pub_date);
+
+-- {% get_changes_for_object %} and {% get_changes_for_objects %}
+CREATE INDEX correx_change_object ON django_content_changelog (content_type_id, object_id, is_public, pub_date);
+
+-- {% get_changes_for_model %}
+CREATE INDEX correx_change_model ON django_content_changelog (content_type_id, is_public, pub_date);
+
+-- {% get_changes_for_app %}
+CREATE INDEX correx_change_app ON django_content_changelog (content_app, is_public, pub_date);
+
+-- {% get_changes_for_site %}
+CREATE INDEX correx_change_site ON django_content_changelog (site_id, is_public, pub_date);
+
+-- {% get_changes_for_user %}
+CREATE INDEX correx_change_user ON django_content_changelog (user_id, is_public, pub_date);
@@ -0,0 +1,355 @@
+"""
+Incremental maintenance of the ``ChangeSummary`` table.
+
+For each object, model, app, site and user that has public changes, the
+table holds one row per change type with the number of those changes and
+the date of the newest, so badges like "3 corrections" can be read without
+counting the changelog.
+
+Scopes are named by strings built from the tuples in ``correx.caching``::
+
+	object:12:34
+	model:12
+	app:newspaper
+	site:1
+	user:5
+
+The handler in ``correx.signals`` passes the before and after states of
+each write to ``update_summaries``, which moves only the rows it touches.
+Bulk updates from ``correx.bulk``, batches from ``correx.capture`` and the
+bulk importer go through ``update_bulk_summaries`` the same way. Writes
+that skip the signals, like ``QuerySet.update()``, are squared up by
+``ChangeSummary.objects.rebuild()``.
+"""
+import datetime
+
+from django.db import connection, transaction, IntegrityError
+from django.db.backends.util import typecast_timestamp
+from django.db.models import Count, Max, F
+
+from correx.caching import get_scopes
+
+# The columns each kind of scope is grouped by, as keyword arguments for
+# a filter on Change.
+SCOPE_FIELDS = {
+	'object': ('content_type', 'object_id'),
+	'model': ('content_type',),
+	'app': ('content_app',),
+	'site': ('site',),
+	'user': ('user',),
+}
+
+
+def make_scope(*bits):
+	"""
+	Joins the bits of a scope tuple into the string stored in the table.
+	"""
+	return ':'.join([unicode(b) for b in bits])
+
+
+def get_keys(state):
+	"""
+	Returns a dictionary that maps each (scope, change type) row a change in
+	the provided state is counted in to the change's publication date. A
+	private change, or a state of None, is counted nowhere.
+	"""
+	if not state or not state['is_public']:
+		return {}
+	keys = {}
+	for scope in get_scopes(state):
+		if scope[0] in SCOPE_FIELDS:
+			keys[(make_scope(*scope), state['change_type_id'])] = state['pub_date']
+	return keys
+
+
+def latest(*dates):
+	"""
+	Returns the latest of the provided dates, ignoring any that are None.
+	"""
+	dates = [d for d in dates if d is not None]
+	if not dates:
+		return None
+	return max(dates)
+
+
+def to_datetime(value):
+	"""
+	Returns a datetime for the newest date of a grouped query, which some
+	backends hand back as a string.
+	"""
+	if isinstance(value, basestring):
+		return typecast_timestamp(value)
+	return value
+
+
+def get_filter(scope):
+	"""
+	Returns the filter on Change that selects the changes in a scope string.
+	"""
+	bits = scope.split(':')
+	kind, values = bits[0], bits[1:]
+	if kind == 'object':
+		values = [int(values[0]), int(values[1])]
+	elif kind != 'app':
+		values = [int(values[0])]
+	return dict(zip([str(f) for f in SCOPE_FIELDS[kind]], values))
+
+
+def count(scopes=None, chunk_size=None, kinds=None):
+	"""
+	Returns a dictionary that maps every (scope, change type) row the live
+	changes in the changelog and its archive are counted in to a (count,
+	newest publication date) pair, from one grouped query for each kind of
+	scope over ``chunk_size`` ids at a time or over each whole table.
+
+	If a list of scope tuples, like those in ``correx.caching``, is
+	provided only their rows are counted, and if a list of ``kinds`` is,
+	like ['site', 'user'], only the rows of those kinds.
+	"""
+	from correx.archive import get_querysets
+	totals = {}
+	for kind, fields in SCOPE_FIELDS.items():
+		if kinds is not None and kind not in kinds:
+			continue
+		if scopes is not None:
+			wanted = set([tuple(s[1:]) for s in scopes if s[0] == kind])
+			if not wanted:
+				continue
+		for qs in get_querysets(chunk_size):
+			qs = qs.filter(is_public=True)
+			for field in fields:
+				qs = qs.filter(**{'%s__isnull' % field: False})
+			if kind == 'app':
+				qs = qs.exclude(content_app='')
+			if scopes is not None:
+				for i, field in enumerate(fields):
+					qs = qs.filter(**{'%s__in' % field: list(set([w[i] for w in wanted]))})
+			grouped = qs.values_list(*fields + ('change_type',)).annotate(total=Count('id'), last=Max('pub_date')).order_by()
+			for values in grouped:
+				# Filtering the object ids and content types separately can
+				# let in pairs that weren't asked for
+				if scopes is not None and tuple(values[:-3]) not in wanted:
+					continue
+				key = (make_scope(kind, *values[:-3]), values[-3])
+				total, last = totals.get(key, (0, None))
+				totals[key] = (total + values[-2], latest(last, to_datetime(values[-1])))
+	return totals
+
+
+def refresh(scope, change_type_id):
+	"""
+	Sets a row from a fresh count of the changelog and its archive,
+	removing it if there is nothing left to count.
+	"""
+	from correx.models import Change, ArchivedChange, ChangeSummary
+	total, last = 0, None
+	for model in (Change, ArchivedChange):
+		totals = model.objects.filter(is_public=True, change_type=change_type_id, **get_filter(scope)).aggregate(
+			total=Count('id'), last=Max('pub_date'))
+		total += totals['total']
+		last = latest(last, to_datetime(totals['last']))
+	rows = ChangeSummary.objects.filter(scope=scope, change_type=change_type_id)
+	if not total:
+		rows.delete()
+	elif not rows.update(change_count=total, last_pub_date=last):
+		add(scope, change_type_id, total, last)
+
+
+def add(scope, change_type_id, delta, pub_date):
+	"""
+	Moves a row's count by ``delta`` and its newest date up to ``pub_date``,
+	creating the row if need be.
+	"""
+	from correx.models import ChangeSummary
+	rows = ChangeSummary.objects.filter(scope=scope, change_type=change_type_id)
+	if delta and not rows.update(change_count=F('change_count') + delta):
+		# Another request may create the row first, in which case it is
+		# updated after all
+		sid = transaction.savepoint()
+		try:
+			ChangeSummary.objects.create(scope=scope, change_type_id=change_type_id,
+				change_count=delta, last_pub_date=pub_date)
+			transaction.savepoint_commit(sid)
+			return
+		except IntegrityError:
+			transaction.savepoint_rollback(sid)
+			rows.update(change_count=F('change_count') + delta)
+	rows.filter(last_pub_date__lt=pub_date).update(last_pub_date=pub_date)
+
+
+def get_newest(scope, change_type_id):
+	"""
+	Returns the publication date of the newest live change of a type in a
+	scope, from the changelog and its archive, or None if there are none.
+	Each read walks an index from its newest end and stops at the first
+	match.
+	"""
+	from correx.models import Change, ArchivedChange
+	newest = None
+	for model in (Change, ArchivedChange):
+		dates = list(model.objects.filter(is_public=True, change_type=change_type_id, **get_filter(scope)).order_by(
+			'-pub_date').values_list('pub_date', flat=True)[:1])
+		if dates:
+			newest = latest(newest, dates[0])
+	return newest
+
+
+def remove(scope, change_type_id, delta, pub_date):
+	"""
+	Moves a row's count down by ``delta``, removing the row once it counts
+	nothing, after changes published up to ``pub_date`` have left it.
+
+	The row's newest date is only read again from the changelog when it
+	could belong to one of the changes that left, which is when it is no
+	later than ``pub_date``.
+	"""
+	from correx.models import ChangeSummary
+	rows = ChangeSummary.objects.filter(scope=scope, change_type=change_type_id)
+	if delta:
+		rows.update(change_count=F('change_count') - delta)
+		rows.filter(change_count__lte=0).delete()
+	if list(rows.filter(last_pub_date__lte=pub_date).values_list('pk', flat=True)[:1]):
+		newest = get_newest(scope, change_type_id)
+		if newest is not None:
+			rows.update(last_pub_date=newest)
+
+
+def update_summaries(before, after):
+	"""
+	Moves the rows touched by a write, given the states of the change
+	before and after it. Either state may be None.
+
+	Each row's count moves by one at most. Where a change leaves a row, or
+	moves back in time within it, the row's newest date may be the one
+	going away, so it is read again, newest first, from the changelog.
+	"""
+	if before == after:
+		return 0
+	old_keys = get_keys(before)
+	new_keys = get_keys(after)
+	for key in set(old_keys) | set(new_keys):
+		scope, change_type_id = key
+		if key not in old_keys:
+			add(scope, change_type_id, 1, new_keys[key])
+		elif key not in new_keys:
+			remove(scope, change_type_id, 1, old_keys[key])
+		elif new_keys[key] < old_keys[key]:
+			remove(scope, change_type_id, 0, old_keys[key])
+		else:
+			add(scope, change_type_id, 0, new_keys[key])
+	return len(set(old_keys) | set(new_keys))
+
+
+def add_many(keys, delta, pub_date, chunk_size=500):
+	"""
+	Does what ``add`` does to many (scope, change type) rows that move by
+	the same delta to the same date, with a few queries for each chunk of
+	rows rather than for each row.
+	"""
+	from correx.models import ChangeSummary
+	scopes = {}
+	for scope, change_type_id in keys:
+		scopes.setdefault(change_type_id, []).append(scope)
+	qn = connection.ops.quote_name
+	table = qn(ChangeSummary._meta.db_table)
+	columns = ', '.join([qn(c) for c in ('scope', 'change_type_id', 'change_count', 'last_pub_date')])
+	last_pub_date = ChangeSummary._meta.get_field('last_pub_date').get_db_prep_save(pub_date)
+	for change_type_id, type_scopes in scopes.items():
+		for i in range(0, len(type_scopes), chunk_size):
+			chunk = type_scopes[i:i + chunk_size]
+			rows = ChangeSummary.objects.filter(scope__in=chunk, change_type=change_type_id)
+			if delta:
+				rows.update(change_count=F('change_count') + delta)
+				existing = set(rows.values_list('scope', flat=True))
+				missing = [scope for scope in chunk if scope not in existing]
+				if missing:
+					sid = transaction.savepoint()
+					try:
+						connection.cursor().executemany('INSERT INTO %s (%s) VALUES (%%s, %%s, %%s, %%s)' % (table, columns),
+							[(scope, change_type_id, delta, last_pub_date) for scope in missing])
+						transaction.savepoint_commit(sid)
+					except IntegrityError:
+						# Another request created some of them first
+						transaction.savepoint_rollback(sid)
+						for scope in missing:
+							add(scope, change_type_id, delta, pub_date)
+			rows.filter(last_pub_date__lt=pub_date).update(last_pub_date=pub_date)
+
+
+def update_bulk_summaries(groups):
+	"""
+	Moves the rows touched by a list of (before, after, count) triples, as
+	sent with ``changes_updated`` by ``correx.bulk`` and ``correx.capture``,
+	where each state's date is the newest of its group. Returns the number
+	of rows moved.
+
+	Each row's count moves once by its net delta, and the rows that only
+	gain changes are moved a chunk at a time. A row's newest date is only
+	read again from the changelog where changes left it.
+	"""
+	moves = {}
+	for before, after, count in groups:
+		old_keys = get_keys(before)
+		new_keys = get_keys(after)
+		for key in set(old_keys) ^ set(new_keys):
+			delta, added, removed = moves.get(key, (0, None, None))
+			if key in new_keys:
+				delta += count
+				added = latest(added, new_keys[key])
+			else:
+				delta -= count
+				removed = latest(removed, old_keys[key])
+			moves[key] = (delta, added, removed)
+	additions = {}
+	for (scope, change_type_id), (delta, added, removed) in moves.items():
+		if removed is None:
+			additions.setdefault((delta, added), []).append((scope, change_type_id))
+		elif delta < 0:
+			remove(scope, change_type_id, -delta, removed)
+		else:
+			add(scope, change_type_id, delta, added)
+			remove(scope, change_type_id, 0, removed)
+	for (delta, added), keys in additions.items():
+		add_many(keys, delta, added)
+	return len(moves)
+
+
+class Summary(object):
+	"""
+	The counts for a scope, read by change type as attributes or with
+	``get``, with a count of 0 for any type it has no changes of.
+
+	``total``
+		The number of public changes of every type.
+	``last_pub_date``
+		The publication date of the newest of them, or None.
+
+	Example::
+
+		{{ summary.Correction }} corrections, the last on {{ summary.last_pub_date|date }}
+
+	"""
+	def __init__(self, rows=()):
+		self.counts = {}
+		self.total = 0
+		self.last_pub_date = None
+		for change_type_id, change_count, last_pub_date in rows:
+			self.add(change_type_id, change_count, last_pub_date)
+
+	def add(self, change_type_id, change_count, last_pub_date):
+		self.counts[change_type_id] = change_count
+		self.total += change_count
+		if self.last_pub_date is None or last_pub_date > self.last_pub_date:
+			self.last_pub_date = last_pub_date
+
+	def get(self, change_type_id, default=0):
+		return self.counts.get(change_type_id, default)
+
+	def items(self):
+		return self.counts.items()
+
+	def __getattr__(self, name):
+		# Only reached for names that aren't real attributes
+		if name.startswith('_'):
+			raise AttributeError(name)
+		return self.counts.get(name, 0)
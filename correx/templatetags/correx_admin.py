@@ -0,0 +1,75 @@
+"""
+Template tags for the admin's changelist of changes.
+"""
+import copy
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.views.main import ALL_VAR, ORDER_VAR, ORDER_TYPE_VAR, IS_POPUP_VAR, TO_FIELD_VAR
+
+from correx.models import ChangeRollup
+
+register = template.Library()
+
+# The changelist filters the rollups can answer, mapped to their fields
+ROLLUP_PARAMS = {
+	'change_type__name__exact': 'change_type',
+	'site__id__exact': 'site',
+	'content_app__exact': 'content_app',
+	'is_public__exact': 'is_public',
+}
+
+# The changelist parameters that don't filter it
+IGNORED_PARAMS = (ALL_VAR, ORDER_VAR, ORDER_TYPE_VAR, IS_POPUP_VAR, TO_FIELD_VAR)
+
+
+class RollupDates(object):
+	"""
+	Stands in for the changelist's queryset in Django's ``date_hierarchy``
+	tag, answering its lookups of dates from the daily rollups.
+	"""
+	def __init__(self, queryset, field_name):
+		self.queryset = queryset
+		self.field_name = field_name
+
+	def filter(self, **kwargs):
+		prefix = '%s__' % self.field_name
+		lookups = dict([('day__%s' % k[len(prefix):], v) for k, v in kwargs.items()])
+		return RollupDates(self.queryset.filter(**lookups), self.field_name)
+
+	def dates(self, field_name, kind):
+		return self.queryset.dates('day', kind)
+
+
+def get_rollup_filters(cl):
+	"""
+	Returns the filters on the rollups that select the same changes as a
+	changelist, leaving out its dates, or None if it is filtered or searched
+	in a way the rollups can't follow.
+	"""
+	if cl.query:
+		return None
+	filters = {}
+	for key, value in cl.params.items():
+		if key in IGNORED_PARAMS or key.startswith('%s__' % cl.date_hierarchy):
+			continue
+		if key not in ROLLUP_PARAMS:
+			return None
+		if key == 'is_public__exact':
+			value = value == '1'
+		filters[ROLLUP_PARAMS[key]] = value
+	return filters
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def rollup_date_hierarchy(cl):
+	"""
+	Django's date drill-down, with the dates read from the daily rollups of
+	the changelog, leaving out the archived ones, instead of the changelog
+	itself wherever they can be.
+	"""
+	filters = get_rollup_filters(cl)
+	if cl.date_hierarchy and filters is not None:
+		cl = copy.copy(cl)
+		cl.query_set = RollupDates(ChangeRollup.objects.filter(archived=False, **filters), cl.date_hierarchy)
+	return date_hierarchy(cl)
@@ -1,33 +1,107 @@
 # Templating
 from django import template
+from django.template import loader
 register = template.Library()
 
 # Models
-from correx.models import Change
-from django.contrib.auth.models import User
-from django.contrib.sites.models import Site
-from django.db.models import get_app, get_model
+from correx.models import Change, ChangeSummary
+from correx import caching, records
+from correx.caching import cached_list
+from correx.instrumentation import Measurement
+from correx.lookups import get_user_id
+from django.db.models import get_model
 from django.contrib.contenttypes.models import ContentType
 
 # Text manipulation
 from django.utils.translation import ugettext_lazy as _
 
 
-class ChangesByObjectNode(template.Node):
+def resolve_argument(variable, context):
+	"""
+	Resolves a tag argument as a template variable, falling back to the text
+	of the argument itself when there is no such variable. That keeps bare
+	literals like ``Otis`` or ``newspaper.Article`` working alongside
+	variables and quoted strings.
+	"""
+	try:
+		return variable.resolve(context)
+	except template.VariableDoesNotExist:
+		return variable.var
+
+
+def get_content_type_filter(model):
+	"""
+	Returns the filter on Change for a model's content type as a join, so
+	the content type needn't be looked up first.
+	"""
+	return {
+		'content_type__app_label': model._meta.app_label,
+		'content_type__model': model._meta.object_name.lower(),
+	}
+
+
+def get_content_type_id(model):
+	"""
+	The id of a model's content type, only needed to key the cached lists.
+	Django keeps the content types it has looked up for the life of the process.
+	"""
+	if not caching.is_enabled():
+		return None
+	return ContentType.objects.get_for_model(model).pk
+
+
+class ChangeListNode(template.Node):
+	"""
+	The base of the tags that put a list of changes into the context.
+
+	Subclasses set ``tag_name`` and ``list_name`` and return the list's
+	scope, as in ``correx.caching``, and a function that fetches it from
+	``get_query``.
+	"""
+	tag_name = None
+	list_name = None
+
+	def get_query(self, context):
+		raise NotImplementedError
+
+	def get_list(self, context):
+		"""
+		Returns the scope, the name the list is cached by and the function
+		that fetches it, which yields records in place of changes when the
+		CORREX_TAG_RECORDS setting is on.
+		"""
+		scope, fetch = self.get_query(context)
+		if records.is_enabled():
+			return scope, '%s:records' % self.list_name, lambda: fetch().records()
+		return scope, self.list_name, fetch
+
+	def render(self, context):
+		measurement = Measurement('tag', self.tag_name)
+		try:
+			scope, name, fetch = self.get_list(context)
+			context[self.varname] = changes = list(cached_list(scope, name, self.num, fetch))
+			measurement.finish(scope, len(changes))
+		finally:
+			measurement.close()
+		return ''
+
+
+class ChangesByObjectNode(ChangeListNode):
+	tag_name = 'get_changes_for_object'
+	list_name = 'object'
+
 	def __init__(self, obj, num, varname):
 		self.obj = template.Variable(obj)
 		self.num = int(num)
 		self.varname = varname
 
-	def render(self, context):
+	def get_query(self, context):
 		resolved_obj = self.obj.resolve(context)
-		try:
-			ct = ContentType.objects.get_for_model(resolved_obj)
-		except:
+		if not hasattr(resolved_obj, '_meta'):
 			raise template.TemplateSyntaxError (_("model could not be found for object"))
-		context[self.varname] = \
-			Change.objects.filter(is_public=True, content_type=ct, object_id=resolved_obj.pk).order_by('-pub_date')[:self.num]
-		return ''
+		fetch = lambda: Change.objects.live().filter(object_id=resolved_obj.pk,
+			**get_content_type_filter(resolved_obj)).order_by('-pub_date')[:self.num]
+		return ('object', get_content_type_id(resolved_obj), resolved_obj.pk), fetch
 
 
 def do_changes_for_object(parser, token):
@@ -57,22 +131,174 @@ def do_changes_for_object(parser, token):
 	return ChangesByObjectNode(bits[1], bits[2], bits[4])
 
 
-class ChangesByModelNode(template.Node):
-	def __init__(self, model, num, varname):
-		self.model = model
+class ChangesByObjectsNode(template.Node):
+	def __init__(self, objects, num, varname):
+		self.objects = template.Variable(objects)
 		self.num = int(num)
 		self.varname = varname
 
 	def render(self, context):
-		model = get_model(*self.model.split('.'))
-		if model is None:
-			raise template.TemplateSyntaxError(_('get_changes_for_model tag was given an invalid model: %s') % self.model)
-		ct = ContentType.objects.get_for_model(model)
-		context[self.varname] = \
-			Change.objects.filter(is_public=True, content_type=ct).order_by('-pub_date')[:self.num]
+		measurement = Measurement('tag', 'get_changes_for_objects')
+		try:
+			objects = list(self.objects.resolve(context))
+			changes = Change.objects.for_objects(objects, self.num)
+			for obj in objects:
+				ct = ContentType.objects.get_for_model(obj)
+				setattr(obj, self.varname, changes[(ct.pk, obj.pk)])
+			measurement.finish(None, sum([len(c) for c in changes.values()]))
+		finally:
+			measurement.close()
+		return ''
+
+
+def do_changes_for_objects(parser, token):
+	""" 
+	Gets the changes for every object in a list or queryset at once and
+	attaches each object's list to it as an attribute.
+
+	Costs two queries at most however many objects there are, which makes it
+	the tag to reach for inside loops where get_changes_for_object would run
+	a query for each pass.
+
+	Syntax::
+
+		{% get_changes_for_objects [object_list] [count] as [attribute] %}
+
+	Example usage::
+
+		{% load correx_tags %}
+		{% get_changes_for_objects article_list 5 as change_list %}
+		{% for article in article_list %}
+			<h2>{{ article.headline }}</h2>
+			{% for change in article.change_list %}
+				<li>{{ change.pub_date }} - {{ change.get_change_type_display }} - {{ change.description }}</li>
+			{% endfor %}
+		{% endfor %}
+
+	Loop over the same list or queryset you passed in, so the attributes
+	are there when you look for them.
+
+	"""
+	bits = token.contents.split()
+	if len(bits) != 5:
+		raise template.TemplateSyntaxError (_("get_changes_for_objects tag takes exactly five arguments"))
+	if bits[3] != 'as':
+		raise template.TemplateSyntaxError(_("fourth argument to %s tag must be 'as'") % bits[0])
+	return ChangesByObjectsNode(bits[1], bits[2], bits[4])
+
+
+class ChangeSummaryNode(template.Node):
+	def __init__(self, obj, varname):
+		self.obj = template.Variable(obj)
+		self.varname = varname
+
+	def render(self, context):
+		measurement = Measurement('tag', 'get_change_summary')
+		try:
+			context[self.varname] = summary = ChangeSummary.objects.for_object(self.obj.resolve(context))
+			measurement.finish(None, summary.total)
+		finally:
+			measurement.close()
+		return ''
+
+
+def do_change_summary(parser, token):
+	""" 
+	Gets the number of public changes of each type for an object, read from
+	a table of running totals rather than counted.
+
+	Syntax::
+
+		{% get_change_summary for [object] as [varname] %}
+
+	Example usage::
+
+		{% load correx_tags %}
+		{% get_change_summary for object as summary %}
+		{% if summary.Correction %}{{ summary.Correction }} correction{{ summary.Correction|pluralize }}{% endif %}
+
+	Types without any changes count as 0. ``summary.total`` holds the count
+	of every type and ``summary.last_pub_date`` the date of the newest.
+
+	"""
+	bits = token.contents.split()
+	if len(bits) != 5:
+		raise template.TemplateSyntaxError (_("get_change_summary tag takes exactly five arguments"))
+	if bits[1] != 'for':
+		raise template.TemplateSyntaxError(_("first argument to %s tag must be 'for'") % bits[0])
+	if bits[3] != 'as':
+		raise template.TemplateSyntaxError(_("third argument to %s tag must be 'as'") % bits[0])
+	return ChangeSummaryNode(bits[2], bits[4])
+
+
+class ChangeSummariesNode(template.Node):
+	def __init__(self, objects, varname):
+		self.objects = template.Variable(objects)
+		self.varname = varname
+
+	def render(self, context):
+		measurement = Measurement('tag', 'get_change_summaries')
+		try:
+			objects = list(self.objects.resolve(context))
+			summaries = ChangeSummary.objects.for_objects(objects)
+			for obj in objects:
+				ct = ContentType.objects.get_for_model(obj)
+				setattr(obj, self.varname, summaries[(ct.pk, obj.pk)])
+			measurement.finish(None, sum([s.total for s in summaries.values()]))
+		finally:
+			measurement.close()
 		return ''
 
 
+def do_change_summaries(parser, token):
+	""" 
+	Gets the summary of get_change_summary for every object in a list or
+	queryset with a single query and attaches each to its object as an
+	attribute.
+
+	Syntax::
+
+		{% get_change_summaries for [object_list] as [attribute] %}
+
+	Example usage::
+
+		{% load correx_tags %}
+		{% get_change_summaries for story_list as summary %}
+		{% for story in story_list %}
+			<h2>{{ story.headline }}</h2>
+			{% if story.summary.Correction %}<span class="badge">{{ story.summary.Correction }} corrections</span>{% endif %}
+		{% endfor %}
+
+	"""
+	bits = token.contents.split()
+	if len(bits) != 5:
+		raise template.TemplateSyntaxError (_("get_change_summaries tag takes exactly five arguments"))
+	if bits[1] != 'for':
+		raise template.TemplateSyntaxError(_("first argument to %s tag must be 'for'") % bits[0])
+	if bits[3] != 'as':
+		raise template.TemplateSyntaxError(_("third argument to %s tag must be 'as'") % bits[0])
+	return ChangeSummariesNode(bits[2], bits[4])
+
+
+class ChangesByModelNode(ChangeListNode):
+	tag_name = 'get_changes_for_model'
+	list_name = 'model'
+
+	def __init__(self, model, num, varname):
+		self.model = template.Variable(model)
+		self.num = int(num)
+		self.varname = varname
+
+	def get_query(self, context):
+		model = resolve_argument(self.model, context)
+		if isinstance(model, basestring):
+			model = get_model(*model.split('.'))
+		if not hasattr(model, '_meta'):
+			raise template.TemplateSyntaxError(_('get_changes_for_model tag was given an invalid model: %s') % self.model.var)
+		fetch = lambda: Change.objects.live().filter(**get_content_type_filter(model)).order_by('-pub_date')[:self.num]
+		return ('model', get_content_type_id(model)), fetch
+
+
 def do_changes_for_model(parser, token):
 	""" 
 	Gets a list of the most recent changes for particular model.
@@ -89,6 +315,8 @@ def do_changes_for_model(parser, token):
 			<li>{{ change.pub_date}} - {{ change.get_change_type_display }} - {{ change.description }}</li>
 		{% endfor %}
 
+	The model may also be a variable holding such a string or a model class.
+
 	"""
 	bits = token.contents.split()
 	if len(bits) != 5:
@@ -98,20 +326,19 @@ def do_changes_for_model(parser, token):
 	return ChangesByModelNode(bits[1], bits[2], bits[4])
 
 
-class ChangesByAppNode(template.Node):
+class ChangesByAppNode(ChangeListNode):
+	tag_name = 'get_changes_for_app'
+	list_name = 'app'
+
 	def __init__(self, app_label, num, varname):
-		self.app_label = app_label
+		self.app_label = template.Variable(app_label)
 		self.num = int(num)
 		self.varname = varname
 
-	def render(self, context):
-		try:
-			ct_set = ContentType.objects.filter(app_label__icontains=self.app_label)
-		except:
-			raise template.TemplateSyntaxError (_("app_label %s could not be found") % self.app_label)
-		context[self.varname] = \
-			Change.objects.filter(is_public=True, content_app=self.app_label).order_by('-pub_date')[:self.num]
-		return ''
+	def get_query(self, context):
+		app_label = resolve_argument(self.app_label, context)
+		fetch = lambda: Change.objects.live().filter(content_app=app_label).order_by('-pub_date')[:self.num]
+		return ('app', app_label), fetch
 
 
 def do_changes_for_app(parser, token):
@@ -131,6 +358,7 @@ def do_changes_for_app(parser, token):
 		{% endfor %}
 
 	Good for sidebars or pulling in a list on a standalone or showcase app.
+	The app label may also be a variable.
 
 	"""
 	bits = token.contents.split()
@@ -141,20 +369,23 @@ def do_changes_for_app(parser, token):
 	return ChangesByAppNode(bits[1], bits[2], bits[4])
 
 
-class ChangesBySiteNode(template.Node):
-	def __init__(self, id, num, varname):
-		self.id = id
+class ChangesBySiteNode(ChangeListNode):
+	tag_name = 'get_changes_for_site'
+	list_name = 'site'
+
+	def __init__(self, site, num, varname):
+		self.site = template.Variable(site)
 		self.num = int(num)
 		self.varname = varname
 
-	def render(self, context):
+	def get_query(self, context):
+		site = resolve_argument(self.site, context)
 		try:
-			site = Site.objects.get(pk=self.id)
-		except User.DoesNotExist:
-			raise template.TemplateSyntaxError (_("Site id %s could not be found") % self.username)
-		context[self.varname] = \
-			Change.objects.filter(is_public=True, site=site).order_by('-pub_date')[:self.num]
-		return ''
+			site_id = int(getattr(site, 'pk', site))
+		except (TypeError, ValueError):
+			raise template.TemplateSyntaxError (_("Site id %s could not be found") % self.site.var)
+		fetch = lambda: Change.objects.live().filter(site=site_id).order_by('-pub_date')[:self.num]
+		return ('site', site_id), fetch
 
 
 def do_changes_for_site(parser, token):
@@ -173,6 +404,8 @@ def do_changes_for_site(parser, token):
 			<li>{{ change.pub_date}} - {{ change.get_change_type_display }} - {{ change.description }}</li>
 		{% endfor %}
 
+	The site may also be a variable holding an id or a Site.
+
 	"""
 	bits = token.contents.split()
 	if len(bits) != 5:
@@ -182,20 +415,29 @@ def do_changes_for_site(parser, token):
 	return ChangesBySiteNode(bits[1], bits[2], bits[4])
 
 
-class ChangesByUserNode(template.Node):
+class ChangesByUserNode(ChangeListNode):
+	tag_name = 'get_changes_for_user'
+	list_name = 'user'
+
 	def __init__(self, username, num, varname):
-		self.username = username
+		self.username = template.Variable(username)
 		self.num = int(num)
 		self.varname = varname
 
-	def render(self, context):
-		try:
-			user = User.objects.get(username__iexact=self.username)
-		except User.DoesNotExist:
-			raise template.TemplateSyntaxError (_("User named %s could not be found") % self.username)
-		context[self.varname] = \
-			Change.objects.filter(is_public=True, user=user).order_by('-pub_date')[:self.num]
-		return ''
+	def get_query(self, context):
+		user = resolve_argument(self.username, context)
+		if hasattr(user, 'pk'):
+			fetch = lambda: Change.objects.live().filter(user=user.pk).order_by('-pub_date')[:self.num]
+			return ('user', user.pk), fetch
+		fetch = lambda: Change.objects.live().filter(user__username__iexact=user).order_by('-pub_date')[:self.num]
+		scope = None
+		# A name that matches no user gets no scope, and so isn't cached, as
+		# every unknown name would share one that no save ever retires
+		if caching.is_enabled():
+			user_id = get_user_id(user)
+			if user_id is not None:
+				scope = ('user', user_id)
+		return scope, fetch
 
 
 def do_changes_for_user(parser, token):
@@ -215,6 +457,8 @@ def do_changes_for_user(parser, token):
 		{% endfor %}
 
 	Good for sidebars or pulling in a list on a standalone or showcase app.
+	The user may also be a variable holding a username or a User. A
+	username nobody has gets an empty list.
 
 	"""
 	bits = token.contents.split()
@@ -225,14 +469,17 @@ def do_changes_for_user(parser, token):
 	return ChangesByUserNode(bits[1], bits[2], bits[4])
 
 
-class LatestChangesNode(template.Node):
+class LatestChangesNode(ChangeListNode):
+	tag_name = 'get_latest_changes'
+	list_name = 'latest'
+
 	def __init__(self, num, varname):
 		self.num = int(num)
 		self.varname = varname
 
-	def render(self, context):
-		context[self.varname] = Change.objects.live().order_by('-pub_date')[:self.num]
-		return ''
+	def get_query(self, context):
+		fetch = lambda: Change.objects.live().order_by('-pub_date')[:self.num]
+		return ('all',), fetch
 
 
 def do_latest_changes(parser, token):
@@ -263,10 +510,145 @@ def do_latest_changes(parser, token):
 	return LatestChangesNode(bits[1], bits[3])
 
 
+class LatestChangesByNode(template.Node):
+	def __init__(self, field, num, varname):
+		self.field = field
+		self.num = int(num)
+		self.varname = varname
+
+	def render(self, context):
+		measurement = Measurement('tag', 'get_latest_changes_by')
+		try:
+			def fetch():
+				groups = Change.objects.latest_by(self.field, self.num)
+				keys = groups.keys()
+				keys.sort()
+				return [{'grouper': getattr(groups[k][0], self.field), 'list': groups[k]} for k in keys]
+			context[self.varname] = groups = list(cached_list(('all',), 'latest-by-%s' % self.field, self.num, fetch))
+			measurement.finish(('all',), sum([len(g['list']) for g in groups]))
+		finally:
+			measurement.close()
+		return ''
+
+
+def do_latest_changes_by(parser, token):
+	""" 
+	Gets the most recent changes of each type, or for each site or app, all
+	in one query.
+
+	Syntax::
+
+		{% get_latest_changes_by [type|site|app] [count] as [varname] %}
+
+	Example usage::
+
+		{% load correx_tags %}
+		{% get_latest_changes_by type 5 as type_list %}
+		{% for type in type_list %}
+			<h2>{{ type.grouper.name }}</h2>
+			{% for change in type.list %}
+				<li>{{ change.pub_date}} - {{ change.description }}</li>
+			{% endfor %}
+		{% endfor %}
+
+	Like the regroup tag, each item has a ``grouper``, which is the
+	ChangeType, the Site or the app label, and a ``list`` of its changes.
+	Groups without any live changes are left out.
+
+	"""
+	fields = {'type': 'change_type', 'site': 'site', 'app': 'content_app'}
+	bits = token.contents.split()
+	if len(bits) != 5:
+		raise template.TemplateSyntaxError (_("get_latest_changes_by tag takes exactly five arguments"))
+	if bits[1] not in fields:
+		raise template.TemplateSyntaxError(_("first argument to %s tag must be 'type', 'site' or 'app'") % bits[0])
+	if bits[3] != 'as':
+		raise template.TemplateSyntaxError(_("third argument to %s tag must be 'as'") % bits[0])
+	return LatestChangesByNode(fields[bits[1]], bits[2], bits[4])
+
+
+class RenderedChangesNode(template.Node):
+	"""
+	Renders the list a ``ChangeListNode`` would pull through a template and
+	caches the HTML under the list's scope, so a busy page skips both the
+	query and the render until a change in the scope is saved or deleted.
+
+	The fragment is rendered with nothing but ``change_list`` in its
+	context, as anything else from the page would end up in the cache.
+	"""
+	def __init__(self, list_node, template_name=None):
+		self.list_node = list_node
+		self.template_name = template_name
+		self.tag_name = list_node.tag_name.replace('get_', 'render_', 1)
+
+	def get_templates(self, context):
+		templates = [
+			'correx/%s_change_list.html' % self.list_node.list_name,
+			'correx/change_list.html',
+		]
+		if self.template_name is not None:
+			templates.insert(0, self.template_name.resolve(context))
+		return templates
+
+	def render(self, context):
+		measurement = Measurement('tag', self.tag_name)
+		try:
+			scope, name, fetch = self.list_node.get_list(context)
+			templates = self.get_templates(context)
+			def render():
+				changes = fetch()
+				if not records.is_enabled():
+					# The default template names each change's type
+					changes = changes.select_related('change_type')
+				return loader.render_to_string(templates, {'change_list': list(changes)})
+			html = caching.cached(scope, 'html:%s:%s:%s' % (name, self.list_node.num, templates[0]), render)
+			measurement.finish(scope)
+		finally:
+			measurement.close()
+		return html
+
+
+def get_render_tag(node_class, num_arguments):
+	"""
+	Returns the compile function for a tag that renders the list pulled by
+	``node_class``, which takes ``num_arguments`` arguments before the count,
+	through a template.
+	"""
+	def do_render_changes(parser, token):
+		bits = token.split_contents()
+		template_name = None
+		if len(bits) > 2 and bits[-2] == 'using':
+			template_name = parser.compile_filter(bits[-1])
+			bits = bits[:-2]
+		if len(bits) != num_arguments + 2:
+			raise template.TemplateSyntaxError(_("%(tag)s tag takes %(count)s arguments before 'using'") % {
+				'tag': bits[0], 'count': num_arguments + 1})
+		return RenderedChangesNode(node_class(*(bits[1:] + ['change_list'])), template_name)
+	do_render_changes.__doc__ = """
+	Renders the list the ``%s`` tag would pull through a template, and
+	caches the HTML when the CORREX_CACHE_TIMEOUT setting is on.
+
+	The template is the one named after ``using``, if any, then
+	``correx/%s_change_list.html``, then ``correx/change_list.html``.
+	It is given the changes as ``change_list``.
+	""" % (node_class.tag_name, node_class.list_name)
+	return do_render_changes
+
+
 # Register the tags
 register.tag('get_changes_for_object', do_changes_for_object)
+register.tag('get_changes_for_objects', do_changes_for_objects)
+register.tag('get_change_summary', do_change_summary)
+register.tag('get_change_summaries', do_change_summaries)
 register.tag('get_changes_for_model', do_changes_for_model)
 register.tag('get_changes_for_app', do_changes_for_app)
 register.tag('get_changes_for_site', do_changes_for_site)
 register.tag('get_changes_for_user', do_changes_for_user)
-register.tag('get_latest_changes', do_latest_changes)
\ No newline at end of file
+register.tag('get_latest_changes', do_latest_changes)
+register.tag('get_latest_changes_by', do_latest_changes_by)
+register.tag('render_changes_for_object', get_render_tag(ChangesByObjectNode, 1))
+register.tag('render_changes_for_model', get_render_tag(ChangesByModelNode, 1))
+register.tag('render_changes_for_app', get_render_tag(ChangesByAppNode, 1))
+register.tag('render_changes_for_site', get_render_tag(ChangesBySiteNode, 1))
+register.tag('render_changes_for_user', get_render_tag(ChangesByUserNode, 1))
+register.tag('render_latest_changes', get_render_tag(LatestChangesNode, 0))
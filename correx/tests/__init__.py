@@ -24,6 +24,22 @@ CT = ContentType.objects.get_for_model
 # Helper base class for changes tests that need data.
 class ChangeTestCase(TestCase):
     fixtures = ["correx_tests"]
+
+    def assertNumQueries(self, num, func, *args, **kwargs):
+        """
+        Calls func and fails unless it ran exactly num queries. Returns its result.
+        """
+        from django.db import connection
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            result = func(*args, **kwargs)
+            ran = len(connection.queries)
+        finally:
+            settings.DEBUG = old_debug
+        self.assertEqual(ran, num, "%s queries run, %s expected: %s" % (ran, num, connection.queries))
+        return result
     
     def createSomeChanges(self):
         # A change without links to objects
@@ -91,7 +107,23 @@ class ChangeTestCase(TestCase):
         return change_without_link, change_with_site, change_with_user, change_with_app, change_with_model, change_with_object
 
 from correx.tests.unittests.model_tests import *
+from correx.tests.unittests.counter_tests import *
+from correx.tests.unittests.summary_tests import *
+from correx.tests.unittests.rollup_tests import *
+from correx.tests.unittests.bulk_tests import *
+from correx.tests.unittests.routing_tests import *
+from correx.tests.unittests.records_tests import *
+from correx.tests.unittests.search_tests import *
+from correx.tests.unittests.capture_tests import *
+from correx.tests.unittests.archive_tests import *
+from correx.tests.unittests.audit_tests import *
+from correx.tests.unittests.importer_tests import *
+from correx.tests.unittests.caching_tests import *
+from correx.tests.unittests.instrumentation_tests import *
+from correx.tests.unittests.admin_tests import *
+from correx.tests.unittests.export_tests import *
 from correx.tests.unittests.templatetag_tests import *
 from correx.tests.unittests.view_tests import *
+from correx.tests.unittests.feed_tests import *
 # Resetting INSTALLED_APPS...though I'm not sure it does everything it should
 settings.INSTALLED_APPS = old_installed_apps
\ No newline at end of file
@@ -0,0 +1,67 @@
+from django.contrib import admin
+
+from correx.tests import ChangeTestCase, CT
+from correx.models import Change
+from correx.admin import ChangeAdmin
+from correx.lookups import get_app_models
+from correx.tests.models import Article, Author
+
+
+class CorrexAdminTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def setUp(self):
+		self.createSomeChanges()
+		self.model_admin = ChangeAdmin(Change, admin.site)
+
+	def testChangelistQueries(self):
+		"""
+		The changelist's records and related objects are loaded in bulk.
+		"""
+		Change.objects.create(description='Another story', change_type_id='Update',
+			content_type=CT(Article), object_id=2, is_public=True)
+		Change.objects.create(description='An author', change_type_id='Update',
+			content_type=CT(Author), object_id=1, is_public=True)
+		# One query for the changes and one for each of the two content types,
+		# once the per-process map of content types is built
+		get_app_models()
+		changes = self.assertNumQueries(3, list, self.model_admin.queryset(None))
+		def touch():
+			for change in changes:
+				self.model_admin.get_content_object_display(change)
+				change.change_type, change.user, change.site, change.content_type
+		self.assertNumQueries(0, touch)
+		records = dict([(c.description, c.get_content_object()) for c in changes])
+		self.assertEqual(records['Another story'], Article.objects.get(pk=2))
+		self.assertEqual(records['An author'], Author.objects.get(pk=1))
+		self.assertEqual(records['An update to an author bio'], None)
+
+	def testOrphans(self):
+		orphan = Change.objects.create(description='A story since deleted', change_type_id='Correction',
+			content_type=CT(Article), object_id=99, is_public=True)
+		change = self.model_admin.queryset(None).get(pk=orphan.pk)
+		self.assertEqual(self.assertNumQueries(0, self.model_admin.get_content_object_display, change), '(orphaned)')
+
+	def testSearchWithoutWords(self):
+		"""
+		A search of nothing but punctuation lists no changes rather than failing.
+		"""
+		from django.http import HttpRequest, QueryDict
+		for query in ('-', ' '):
+			request = HttpRequest()
+			request.GET = QueryDict('q=%s' % query)
+			self.assertEqual(list(self.model_admin.queryset(request)), [])
+
+	def testContentTypeMissingFromMap(self):
+		"""
+		Objects are still attached when their content type was created after
+		the per-process map was built.
+		"""
+		from correx import lookups
+		from correx.managers import attach_content_objects
+		del get_app_models()['labels'][CT(Article).pk]
+		change = Change.objects.create(description='Another story', change_type_id='Update',
+			content_type=CT(Article), object_id=2, is_public=True)
+		attach_content_objects([change])
+		self.assertEqual(change._content_object_cache, Article.objects.get(pk=2))
+		self.assertEqual(lookups._app_models, None)
@@ -0,0 +1,119 @@
+import datetime
+
+from django.core.management import call_command
+from django.core.paginator import Paginator
+
+from correx.tests import ChangeTestCase
+from correx.models import Change, ArchivedChange, ChangeType, ChangeSummary, ChangeRollup
+from correx.archive import archive
+
+
+class CorrexArchiveTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def setUp(self):
+		self.changes = self.createSomeChanges()
+		self.recent = Change.objects.create(description='A recent correction', change_type_id='Correction',
+			site_id=1881, is_public=True)
+		self.cutoff = datetime.datetime(2009, 2, 16)
+
+	def copy(self, pk):
+		from django.db import connection
+		connection.cursor().execute('INSERT INTO django_content_changelog_archive SELECT * FROM django_content_changelog WHERE id = %s', [pk])
+
+	def snapshot(self):
+		return (
+			sorted(ChangeType.objects.values_list('pk', 'change_count')),
+			sorted(ChangeSummary.objects.values_list('scope', 'change_type', 'change_count', 'last_pub_date')),
+			ChangeRollup.objects.series('day'),
+		)
+
+	def rollups(self):
+		return sorted(ChangeRollup.objects.values_list('day', 'change_type', 'site', 'content_app', 'is_public', 'archived', 'change_count'))
+
+	def testArchive(self):
+		"""
+		Old changes move to the archive in batches and the totals are unmoved,
+		both by the move and by recounting afterwards.
+		"""
+		old = list(Change.objects.filter(pub_date__lt=self.cutoff).order_by('pk').values_list('pk', flat=True))
+		before = self.snapshot()
+		self.assertEqual(archive(self.cutoff, batch_size=2), len(old))
+		self.assertEqual(list(ArchivedChange.objects.order_by('pk').values_list('pk', flat=True)), old)
+		self.assertEqual(Change.objects.filter(pk__in=old).count(), 0)
+		self.assertEqual(self.snapshot(), before)
+		# The rollups of the moved changes are marked as archived
+		rollups = self.rollups()
+		self.assertEqual(ChangeRollup.objects.filter(archived=False, day__lt=self.cutoff).count(), 0)
+		self.assertEqual(ChangeRollup.objects.filter(archived=True, day__gte=self.cutoff).count(), 0)
+		ChangeType.objects.recount()
+		ChangeSummary.objects.rebuild()
+		ChangeRollup.objects.rebuild()
+		self.assertEqual(self.snapshot(), before)
+		self.assertEqual(self.rollups(), rollups)
+		self.assertEqual(archive(self.cutoff), 0)
+
+	def testResume(self):
+		"""
+		A change that was copied but never removed from the changelog is
+		removed the next time, without a second copy.
+		"""
+		change = self.changes[0]
+		self.copy(change.pk)
+		old = Change.objects.filter(pub_date__lt=self.cutoff).count()
+		self.assertEqual(archive(self.cutoff, batch_size=2), old)
+		self.assertEqual(ArchivedChange.objects.filter(pk=change.pk).count(), 1)
+		self.assertEqual(Change.objects.filter(pk=change.pk).count(), 0)
+
+	def testIdsNotReused(self):
+		"""
+		The newest change stays, however old, so its id keeps new ids above
+		the archived ones, and a change whose id is taken in the archive is
+		left alone.
+		"""
+		Change.objects.filter(pk=self.recent.pk).update(pub_date=datetime.datetime(2009, 1, 1))
+		clash = self.changes[-1]
+		self.copy(clash.pk)
+		ArchivedChange.objects.filter(pk=clash.pk).update(pub_date=datetime.datetime(2008, 1, 1), description='Older')
+		archive(datetime.datetime(2010, 1, 1))
+		self.assertEqual(list(Change.objects.order_by('pk').values_list('pk', flat=True)), [clash.pk, self.recent.pk])
+		self.assertEqual(ArchivedChange.objects.get(pk=clash.pk).description, 'Older')
+
+	def testHistory(self):
+		everything = list(Change.objects.order_by('-pub_date', '-id'))
+		archive(self.cutoff)
+		history = Change.objects.history()
+		self.assertEqual(history.count(), len(everything))
+		self.assertEqual([c.pk for c in history], [c.pk for c in everything])
+		self.assertEqual([c.pk for c in history[1:4]], [c.pk for c in everything[1:4]])
+		self.assertEqual(history[0].pk, self.recent.pk)
+		self.assertEqual(history.filter(change_type='Correction').count(), 3)
+		page = Paginator(history.filter(is_public=True), 2).page(2)
+		self.assertEqual([c.pk for c in page.object_list], [c.pk for c in everything[2:4]])
+
+	def testAdminLeavesOutArchivedDays(self):
+		"""
+		The admin's drill-down and filters offer only what the changelog holds.
+		"""
+		from django.contrib import admin
+		from django.contrib.admin.views.main import ChangeList
+		from django.http import HttpRequest
+		from correx.admin import ChangeAdmin, RollupRelatedFilterSpec
+		from correx.templatetags.correx_admin import rollup_date_hierarchy
+		archive(self.cutoff)
+		model_admin = ChangeAdmin(Change, admin.site)
+		request = HttpRequest()
+		request.GET.update({'pub_date__year': '2009', 'pub_date__month': '2'})
+		cl = ChangeList(request, Change, model_admin.list_display, model_admin.list_display_links,
+			model_admin.list_filter, model_admin.date_hierarchy, model_admin.search_fields,
+			model_admin.list_select_related, model_admin.list_per_page, model_admin.list_editable, model_admin)
+		days = [choice['title'] for choice in rollup_date_hierarchy(cl)['choices']]
+		self.assertEqual(days, ['February 16'])
+		spec = RollupRelatedFilterSpec(Change._meta.get_field('change_type'), request, {}, Change, model_admin)
+		self.assertEqual([pk for pk, name in spec.lookup_choices], ['Correction'])
+
+	def testCommand(self):
+		call_command('archive_changes', before='2009-02-16', verbosity=0)
+		self.assertEqual(Change.objects.count(), 2)
+		self.assertEqual(ArchivedChange.objects.count(), 5)
+		self.assertEqual(Change.objects.search('correction').count(), 2)
@@ -0,0 +1,91 @@
+import sys
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.utils import simplejson
+
+from correx.tests import ChangeTestCase
+from correx.models import Change, ChangeType, ChangeSummary, ChangeRollup
+from correx.audit import audit
+from correx.search import TABLE
+
+
+class CorrexAuditTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def setUp(self):
+		self.changes = self.createSomeChanges()
+
+	def snapshot(self):
+		return (
+			sorted(ChangeType.objects.values_list('pk', 'change_count')),
+			sorted(ChangeSummary.objects.values_list('scope', 'change_type', 'change_count', 'last_pub_date')),
+			sorted(ChangeRollup.objects.values_list('day', 'change_type', 'site', 'content_app', 'is_public', 'change_count')),
+		)
+
+	def spoil(self):
+		"""
+		Writes around the signals, as raw SQL would.
+		"""
+		Change.objects.filter(pk=self.changes[0].pk).update(change_type='Update')
+		ChangeType.objects.filter(pk='Addition').update(change_count=7)
+		ChangeSummary.objects.filter(scope='site:1881', change_type='Addition').update(change_count=5)
+		cursor = connection.cursor()
+		cursor.execute('DELETE FROM %s WHERE rowid = %%s' % TABLE, [self.changes[1].pk])
+		cursor.execute('INSERT INTO %s (rowid, description) VALUES (%%s, %%s)' % TABLE, [999, 'Gone'])
+
+	def testClean(self):
+		report = audit(chunk_size=2)
+		self.assertEqual([report[k] for k in ('change_types', 'summaries', 'rollups')], [[], [], []])
+		self.assertEqual(report['search'], {'missing': [], 'stale': []})
+
+	def testDryRun(self):
+		self.spoil()
+		before = self.snapshot()
+		report = audit(chunk_size=2)
+		self.assertEqual(self.snapshot(), before)
+		self.assertEqual(sorted([(r['change_type'], r['stored'], r['actual']) for r in report['change_types']]),
+			[('Addition', 7, 2), ('Correction', 2, 1), ('Update', 2, 3)])
+		self.assertEqual(len(report['rollups']), 2)
+		last = ChangeSummary.objects.get(scope='site:1881', change_type='Addition').last_pub_date
+		self.assertEqual(report['summaries'], [{'scope': 'site:1881', 'change_type': 'Addition', 'stored': 5, 'actual': 2,
+			'stored_last_pub_date': last, 'actual_last_pub_date': last}])
+		self.assertEqual(report['search'], {'missing': [self.changes[1].pk], 'stale': [999]})
+		self.assertEqual(report['fixed'], False)
+
+	def testFix(self):
+		self.spoil()
+		audit(fix=True, chunk_size=2)
+		fixed = self.snapshot()
+		ChangeType.objects.recount()
+		ChangeSummary.objects.rebuild()
+		ChangeRollup.objects.rebuild()
+		self.assertEqual(self.snapshot(), fixed)
+		report = audit()
+		self.assertEqual([report[k] for k in ('change_types', 'summaries', 'rollups')], [[], [], []])
+		self.assertEqual(report['search'], {'missing': [], 'stale': []})
+
+	def testRecountInOneStatement(self):
+		"""
+		The types are recounted inside the UPDATE, leaving no gap for another
+		request's adjustment to fall into.
+		"""
+		self.spoil()
+		self.assertEqual(self.assertNumQueries(1, ChangeType.objects.recount, ['Addition', 'Correction']), 2)
+		self.assertEqual(ChangeType.objects.get(pk='Addition').change_count, 2)
+		self.assertEqual(ChangeType.objects.get(pk='Update').change_count, 2)
+		self.assertEqual(ChangeType.objects.recount(), 1)
+		self.assertEqual(ChangeType.objects.recount(), 0)
+
+	def testCommand(self):
+		self.spoil()
+		old_stdout = sys.stdout
+		sys.stdout = StringIO()
+		try:
+			call_command('audit_changes', dry_run=True)
+			report = simplejson.loads(sys.stdout.getvalue())
+		finally:
+			sys.stdout = old_stdout
+		self.assertEqual(len(report['change_types']), 3)
+		self.assertEqual(ChangeType.objects.get(pk='Addition').change_count, 7)
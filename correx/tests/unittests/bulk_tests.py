@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.http import HttpRequest
+from django.contrib import admin
+from django.contrib.auth.models import User
+
+from correx.tests import ChangeTestCase
+from correx.models import Change, ChangeType, ChangeSummary
+from correx.admin import ChangeAdmin
+from correx.bulk import changes_updated
+from correx.caching import get_generation
+
+
+class CorrexBulkTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def setUp(self):
+		self.changes = self.createSomeChanges()
+		for i in range(10):
+			Change.objects.create(description='Draft %s' % i, change_type_id='Update', site_id=1881,
+				content_app='tests', is_public=False)
+		self.sent = []
+		changes_updated.connect(self.record)
+
+	def tearDown(self):
+		changes_updated.disconnect(self.record)
+
+	def record(self, sender, groups, **kwargs):
+		self.sent.append(groups)
+
+	def assertTotalsExact(self):
+		for change_type in ChangeType.objects.all():
+			self.assertEqual(change_type.change_count, Change.objects.live().filter(change_type=change_type).count())
+		kept = sorted(ChangeSummary.objects.values_list('scope', 'change_type', 'change_count', 'last_pub_date'))
+		ChangeSummary.objects.rebuild()
+		self.assertEqual(kept, sorted(ChangeSummary.objects.values_list('scope', 'change_type', 'change_count', 'last_pub_date')))
+
+	def testPublish(self):
+		drafts = Change.objects.filter(description__startswith='Draft')
+		self.assertEqual(drafts.publish(), 10)
+		self.assertEqual(Change.objects.live().count(), 16)
+		# Ten identical drafts make one group, sent once
+		self.assertEqual(len(self.sent), 1)
+		self.assertEqual([count for before, after, count in self.sent[0]], [10])
+		self.assertEqual(ChangeType.objects.get(pk='Update').change_count, 12)
+		self.assertEqual(ChangeSummary.objects.for_app('tests').Update, 12)
+		self.assertTotalsExact()
+		# Publishing them again moves nothing
+		drafts.publish()
+		self.assertEqual(len(self.sent), 1)
+
+	def testUnpublishAndRetype(self):
+		Change.objects.filter(description__startswith='Draft').publish()
+		site = Change.objects.filter(site=1881)
+		self.assertEqual(site.retype('Correction'), 15)
+		self.assertTotalsExact()
+		self.assertEqual(ChangeType.objects.get(pk='Update').change_count, 0)
+		self.assertEqual(site.filter(change_type='Update').count(), 0)
+		site.unpublish()
+		self.assertEqual(ChangeType.objects.get(pk='Correction').change_count, 1)
+		self.assertEqual(ChangeSummary.objects.for_app('tests').total, 0)
+		self.assertTotalsExact()
+
+	def testQueriesDontGrow(self):
+		"""
+		The cost of a bulk update is the same whatever the number of changes.
+		"""
+		def cost(qs):
+			from django.db import connection
+			old_debug = settings.DEBUG
+			settings.DEBUG = True
+			connection.queries = []
+			try:
+				qs.publish()
+				return len(connection.queries)
+			finally:
+				settings.DEBUG = old_debug
+		few = cost(Change.objects.filter(description__in=['Draft 0', 'Draft 1']))
+		many = cost(Change.objects.filter(description__startswith='Draft'))
+		self.assertEqual(few, many)
+
+	def testSummariesMovedInPlace(self):
+		"""
+		Publishing moves the summaries by the batch's deltas rather than
+		recounting them from the changelog and its archive.
+		"""
+		from django.db import connection
+		old_debug = settings.DEBUG
+		settings.DEBUG = True
+		connection.queries = []
+		try:
+			Change.objects.filter(description__startswith='Draft').publish()
+			sql = [q['sql'] for q in connection.queries]
+		finally:
+			settings.DEBUG = old_debug
+		self.failIf([q for q in sql if 'changelog_archive' in q or 'DELETE FROM "django_content_changesummary"' in q], sql)
+		self.assertTotalsExact()
+
+	def testCacheBumpedOnce(self):
+		old_timeout = getattr(settings, 'CORREX_CACHE_TIMEOUT', None)
+		settings.CORREX_CACHE_TIMEOUT = 300
+		try:
+			before = get_generation(('site', 1881))
+			Change.objects.filter(description__startswith='Draft').publish()
+			self.assertEqual(get_generation(('site', 1881)), before + 1)
+		finally:
+			settings.CORREX_CACHE_TIMEOUT = old_timeout
+
+	def testAdminActions(self):
+		model_admin = ChangeAdmin(Change, admin.site)
+		request = HttpRequest()
+		request.user = User.objects.get(username='Otis')
+		actions = model_admin.get_actions(request)
+		self.failUnless('publish_changes' in actions)
+		self.failUnless('retype_correction' in actions)
+		drafts = Change.objects.filter(description__startswith='Draft')
+		model_admin.publish_changes(request, drafts)
+		self.assertEqual(drafts.filter(is_public=True).count(), 10)
+		func, name, description = actions['retype_correction']
+		func(model_admin, request, drafts)
+		self.assertEqual(drafts.filter(change_type='Correction').count(), 10)
+		self.assertTotalsExact()
@@ -0,0 +1,132 @@
+from django.conf import settings
+from django.template import Template, Context
+
+from correx.tests import ChangeTestCase
+from correx.models import Change
+from correx.caching import get_generation
+
+
+class CorrexCachingTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def setUp(self):
+		self.old_timeout = getattr(settings, 'CORREX_CACHE_TIMEOUT', None)
+		self.old_prefix = getattr(settings, 'CORREX_CACHE_PREFIX', 'correx')
+		settings.CORREX_CACHE_TIMEOUT = 300
+		# A fresh prefix for each test keeps them from sharing cached lists
+		settings.CORREX_CACHE_PREFIX = 'correx-test-%s' % id(self)
+		self.changes = self.createSomeChanges()
+
+	def tearDown(self):
+		settings.CORREX_CACHE_TIMEOUT = self.old_timeout
+		settings.CORREX_CACHE_PREFIX = self.old_prefix
+
+	def render(self, t):
+		ctx = Context()
+		Template("{% load correx_tags %}" + t).render(ctx)
+		return [c.description for c in ctx["change_list"]]
+
+	def testCachedUntilScopeChanges(self):
+		"""
+		A list is served from the cache until a change in its scope is saved.
+		"""
+		t = "{% get_changes_for_site 1881 1 as change_list %}"
+		self.assertEqual(self.render(t), ['A correction to a story'])
+		# Edits that skip the signals aren't noticed
+		Change.objects.filter(pk=self.changes[-1].pk).update(description='Quietly edited')
+		self.assertEqual(self.render(t), ['A correction to a story'])
+		# Nor are public changes outside the site, or private ones inside it
+		Change.objects.create(description='Elsewhere', change_type_id='Update', is_public=True)
+		Change.objects.create(description='Draft', change_type_id='Update', site_id=1881, is_public=False)
+		self.assertEqual(self.render(t), ['A correction to a story'])
+		# A public change in the site retires the list
+		Change.objects.create(description='Site news', change_type_id='Update', pub_date='2009-01-01', site_id=1881, is_public=True)
+		self.assertEqual(self.render(t), ['Quietly edited'])
+
+	def testMovesBumpBothScopes(self):
+		"""
+		Moving a change from one scope to another retires the lists of both.
+		"""
+		change = self.changes[-1]
+		old_app = get_generation(('app', 'tests'))
+		old_object = get_generation(('object', change.content_type_id, 1))
+		untouched = get_generation(('user', 999))
+		change.content_app = 'otherapp'
+		change.object_id = 2
+		change.save()
+		self.failIfEqual(get_generation(('app', 'tests')), old_app)
+		self.failIfEqual(get_generation(('object', change.content_type_id, 1)), old_object)
+		self.failIfEqual(get_generation(('object', change.content_type_id, 2)), None)
+		self.assertEqual(get_generation(('user', 999)), untouched)
+
+	def testUnpublish(self):
+		t = "{% get_latest_changes 1 as change_list %}"
+		self.assertEqual(self.render(t), ['A correction to a story'])
+		change = self.changes[-1]
+		change.is_public = False
+		change.save()
+		self.assertEqual(self.render(t), ['An app-wide update'])
+
+	def testUsernameScope(self):
+		"""
+		A list pulled by username is retired with the user's other lists.
+		"""
+		t = "{% get_changes_for_user otis 1 as change_list %}"
+		self.assertEqual(self.render(t), ['A correction to a story'])
+		change = self.changes[-1]
+		change.is_public = False
+		change.save()
+		self.assertEqual(self.render(t), ['An app-wide update'])
+
+	def testUnknownUsernames(self):
+		"""
+		Names that match no user aren't cached, so they can't share a list,
+		and a user who signs up later finds their own changes.
+		"""
+		from django.contrib.auth.models import User
+		from correx import lookups
+		self.assertEqual(self.render("{% get_changes_for_user nobody 1 as change_list %}"), [])
+		self.failIf('nobody' in lookups._user_ids)
+		user = User.objects.create(username='Nobody')
+		lookups._user_ids.clear()
+		Change.objects.filter(pk=self.changes[0].pk).update(user=user)
+		self.assertEqual(self.render("{% get_changes_for_user nobody 1 as change_list %}"), ['Correction without connection'])
+
+	def testRenderedFragment(self):
+		"""
+		A rendered list is served from the cache, without a query, until a
+		change in its scope is saved.
+		"""
+		t = Template("{% load correx_tags %}{% render_changes_for_site 1881 1 %}")
+		out = t.render(Context())
+		self.failUnless('<li>' in out and 'A correction to a story' in out, out)
+		self.assertEqual(self.assertNumQueries(0, t.render, Context()), out)
+		Change.objects.create(description='Site news', change_type_id='Update', pub_date='2099-01-01', site_id=1881, is_public=True)
+		self.failUnless('Site news' in t.render(Context()))
+
+	def testRenderedFragmentQueries(self):
+		"""
+		The default template's change types come with the changes.
+		"""
+		t = Template("{% load correx_tags %}{% render_latest_changes 5 %}")
+		out = self.assertNumQueries(1, t.render, Context())
+		self.failUnless('Correction' in out and 'Update' in out, out)
+
+	def testRenderedFragmentTemplates(self):
+		"""
+		Fragments rendered through different templates are cached apart.
+		"""
+		import os, shutil, tempfile
+		directory = tempfile.mkdtemp()
+		old_dirs = settings.TEMPLATE_DIRS
+		settings.TEMPLATE_DIRS = (directory,)
+		try:
+			open(os.path.join(directory, 'titles.html'), 'w').write(
+				'{% for change in change_list %}[{{ change.description }}]{% endfor %}')
+			default = Template("{% load correx_tags %}{% render_latest_changes 2 %}").render(Context())
+			custom = Template('{% load correx_tags %}{% render_latest_changes 2 using "titles.html" %}').render(Context())
+			self.failUnless('<ul' in default)
+			self.assertEqual(custom, '[A correction to a story][An app-wide update]')
+		finally:
+			settings.TEMPLATE_DIRS = old_dirs
+			shutil.rmtree(directory)
@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import HttpRequest, HttpResponse
+
+from correx import capture
+from correx.tests import ChangeTestCase, CT
+from correx.tests.models import Article, Author
+from correx.models import Change, ChangeType, ChangeSummary, ChangeRollup
+
+
+class CorrexCaptureTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def setUp(self):
+		capture.register(Article, fields=['headline'], is_public=True)
+		self.article = Article.objects.get(pk=1)
+
+	def tearDown(self):
+		capture.discard()
+		capture.unregister(Article)
+
+	def testCapture(self):
+		self.article.headline = 'A new headline'
+		self.article.save()
+		change = Change.objects.get(content_type=CT(Article), object_id=1)
+		self.assertEqual((change.change_type_id, change.content_app, change.site_id, change.is_public),
+			('Update', 'tests', settings.SITE_ID, True))
+		self.assertEqual(change.description, 'Changed headline of A new headline.')
+		# Saves that leave the tracked fields alone aren't logged
+		self.article.url = 'http://example.com/moved/'
+		self.article.save()
+		self.assertEqual(Change.objects.count(), 1)
+		self.assertRaises(capture.AlreadyRegistered, capture.register, Article)
+
+	def testBatch(self):
+		"""
+		A batch writes one change per object with one INSERT, and keeps the
+		totals as if each had been saved.
+		"""
+		author = Author.objects.get(pk=1)
+		capture.begin()
+		articles = [Article.objects.create(author=author, headline='Story %s' % i, url='http://example.com/')
+			for i in range(20)]
+		for article in articles:
+			article.headline += ' (updated)'
+			article.save()
+		self.assertEqual(Change.objects.count(), 0)
+		self.assertEqual(capture.flush(), 20)
+		self.assertEqual(Change.objects.filter(content_type=CT(Article)).count(), 20)
+		self.assertEqual(ChangeType.objects.get(pk='Update').change_count, 20)
+		self.assertEqual(ChangeSummary.objects.for_app('tests').Update, 20)
+		self.assertEqual(ChangeSummary.objects.for_object(articles[0]).Update, 1)
+		self.assertEqual(sum([c for d, c in ChangeRollup.objects.series()]), 20)
+		self.assertEqual(Change.objects.search('Story').count(), 20)
+		self.assertEqual(capture.flush(), 0)
+
+	def testBatchCost(self):
+		"""
+		The cost of writing a batch is the same whatever its size.
+		"""
+		from django.db import connection
+		def cost(count):
+			capture.begin()
+			# The newest articles, which all have changes and so summaries already
+			for article in Article.objects.order_by('-pk')[:count]:
+				article.headline += '!'
+				article.save()
+			old_debug = settings.DEBUG
+			settings.DEBUG = True
+			connection.queries = []
+			try:
+				self.assertEqual(capture.flush(), count)
+				return len(connection.queries)
+			finally:
+				settings.DEBUG = old_debug
+		author = Author.objects.get(pk=1)
+		for i in range(10):
+			Article.objects.create(author=author, headline='Story %s' % i, url='http://example.com/')
+		self.assertEqual(cost(2), cost(10))
+
+	def testMiddleware(self):
+		middleware = capture.CaptureMiddleware()
+		request = HttpRequest()
+		request.user = User.objects.get(username='Otis')
+		middleware.process_request(request)
+		self.article.headline = 'Edited in a request'
+		self.article.save()
+		self.assertEqual(Change.objects.count(), 0)
+		middleware.process_response(request, HttpResponse())
+		self.assertEqual(Change.objects.get().user, request.user)
+		# A failed request logs nothing
+		middleware.process_request(request)
+		self.article.headline = 'Edited again'
+		self.article.save()
+		middleware.process_exception(request, Exception())
+		self.assertEqual(Change.objects.count(), 1)
+
+	def testNestedBatches(self):
+		"""
+		A batched function called during a batched request adds to the
+		request's batch rather than throwing away what came before it.
+		"""
+		middleware = capture.CaptureMiddleware()
+		request = HttpRequest()
+		request.user = User.objects.get(username='Otis')
+		author = Author.objects.get(pk=1)
+		def create(headline):
+			return Article.objects.create(author=author, headline=headline, url='http://example.com/')
+		middleware.process_request(request)
+		self.article.headline = 'Edited first'
+		self.article.save()
+		capture.batched(create)('Created inside')
+		self.assertEqual(Change.objects.count(), 0)
+		create('Created after')
+		self.assertEqual(Change.objects.count(), 0)
+		middleware.process_response(request, HttpResponse())
+		self.assertEqual(Change.objects.filter(user=request.user).count(), 3)
+		self.assertEqual(Change.objects.search('Created').count(), 2)
@@ -0,0 +1,119 @@
+from django.conf import settings
+
+from correx.tests import ChangeTestCase
+from correx.models import Change, ChangeType, QueuedCount
+from correx.counters import get_deltas, refresh_queued
+
+
+def state(change_type_id, is_public):
+	return {'change_type_id': change_type_id, 'is_public': is_public}
+
+
+class CorrexCounterTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def assertCountsExact(self):
+		"""
+		Checks every stored total against a fresh count of the changelog.
+		"""
+		for ct in ChangeType.objects.all():
+			self.assertEquals(ct.change_count, Change.objects.filter(change_type=ct, is_public=True).count())
+
+	def getCount(self, name):
+		return ChangeType.objects.get(pk=name).change_count
+
+	def testDeltas(self):
+		"""
+		Tests the arithmetic behind each kind of write.
+		"""
+		self.assertEquals(get_deltas(None, state('Update', True)), {'Update': 1})
+		self.assertEquals(get_deltas(None, state('Update', False)), {})
+		self.assertEquals(get_deltas(state('Update', True), None), {'Update': -1})
+		self.assertEquals(get_deltas(state('Update', True), state('Update', True)), {})
+		self.assertEquals(get_deltas(state('Update', True), state('Correction', True)), {'Update': -1, 'Correction': 1})
+		self.assertEquals(get_deltas(state('Update', False), state('Correction', True)), {'Correction': 1})
+
+	def testCreate(self):
+		"""
+		Only public changes add to a total when created.
+		"""
+		self.createSomeChanges()
+		self.assertEquals(self.getCount('Correction'), 2)
+		self.assertEquals(self.getCount('Addition'), 2)
+		self.assertEquals(self.getCount('Update'), 2)
+		Change.objects.create(description='Draft', change_type_id='Update', is_public=False)
+		self.assertEquals(self.getCount('Update'), 2)
+		self.assertCountsExact()
+
+	def testPublishAndUnpublish(self):
+		c = Change.objects.create(description='Draft', change_type_id='Deletion', is_public=False)
+		self.assertEquals(self.getCount('Deletion'), 0)
+		c.is_public = True
+		c.save()
+		self.assertEquals(self.getCount('Deletion'), 1)
+		# Saving again without changes leaves the total alone
+		c.save()
+		self.assertEquals(self.getCount('Deletion'), 1)
+		c.is_public = False
+		c.save()
+		self.assertEquals(self.getCount('Deletion'), 0)
+		self.assertCountsExact()
+
+	def testRetype(self):
+		c = Change.objects.create(description='Typo', change_type_id='Update', is_public=True)
+		c.change_type_id = 'Correction'
+		c.save()
+		self.assertEquals(self.getCount('Update'), 0)
+		self.assertEquals(self.getCount('Correction'), 1)
+		# Retyping and unpublishing in the same save
+		c.change_type_id = 'Addition'
+		c.is_public = False
+		c.save()
+		self.assertEquals(self.getCount('Correction'), 0)
+		self.assertEquals(self.getCount('Addition'), 0)
+		self.assertCountsExact()
+
+	def testDelete(self):
+		public = Change.objects.create(description='Live', change_type_id='Update', is_public=True)
+		private = Change.objects.create(description='Draft', change_type_id='Update', is_public=False)
+		private.delete()
+		self.assertEquals(self.getCount('Update'), 1)
+		public.delete()
+		self.assertEquals(self.getCount('Update'), 0)
+		self.assertCountsExact()
+
+	def testStaleInstance(self):
+		"""
+		The totals follow what is stored, not what a stale copy in memory believes.
+		"""
+		c = Change.objects.create(description='Draft', change_type_id='Update', is_public=False)
+		stale = Change.objects.get(pk=c.pk)
+		c.is_public = True
+		c.save()
+		stale.delete()
+		self.assertEquals(self.getCount('Update'), 0)
+		self.assertCountsExact()
+
+	def testDeferred(self):
+		"""
+		With CORREX_DEFERRED_COUNTS on, saves queue their types and a burst
+		of them is settled with one recount per type.
+		"""
+		old_deferred = getattr(settings, 'CORREX_DEFERRED_COUNTS', False)
+		settings.CORREX_DEFERRED_COUNTS = True
+		try:
+			for i in range(5):
+				Change.objects.create(description='Burst %s' % i, change_type_id='Update', is_public=True)
+			c = Change.objects.create(description='Retyped', change_type_id='Update', is_public=True)
+			c.change_type_id = 'Correction'
+			c.save()
+		finally:
+			settings.CORREX_DEFERRED_COUNTS = old_deferred
+		self.assertEquals(self.getCount('Update'), 0)
+		self.assertEquals(QueuedCount.objects.count(), 8)
+		self.assertEquals(refresh_queued(), (8, 2))
+		self.assertEquals(self.getCount('Update'), 5)
+		self.assertEquals(self.getCount('Correction'), 1)
+		self.assertEquals(QueuedCount.objects.count(), 0)
+		self.assertEquals(refresh_queued(), (0, 0))
+		self.assertCountsExact()
@@ -0,0 +1,62 @@
+import csv
+import gzip
+from StringIO import StringIO
+
+from django.contrib import admin
+from django.http import HttpRequest
+from django.utils import simplejson
+
+from correx.tests import ChangeTestCase
+from correx.models import Change
+from correx.admin import ChangeAdmin
+from correx.export import iter_changes, iter_ndjson, iter_csv, iter_gzip
+
+
+class CorrexExportTests(ChangeTestCase):
+
+	def setUp(self):
+		self.createSomeChanges()
+
+	def testChunks(self):
+		"""
+		Tests that reading in small chunks visits every change once, in order.
+		"""
+		changes = list(iter_changes(chunk_size=4))
+		self.assertEqual([c['id'] for c in changes], list(Change.objects.order_by('id').values_list('id', flat=True)))
+		last = changes[-1]
+		self.assertEqual((last['user'], last['site'], last['model'], last['object_id']), ('Otis', 'projects.latimes.com', 'tests.article', 1))
+		self.assertEqual(changes[0]['user'], None)
+
+	def testFormats(self):
+		lines = list(iter_ndjson(iter_changes()))
+		self.assertEqual(simplejson.loads(lines[0])['description'], 'Correction without connection')
+		rows = list(csv.DictReader(StringIO(''.join(iter_csv(iter_changes())))))
+		self.assertEqual(len(rows), 6)
+		self.assertEqual(rows[-1]['site'], 'projects.latimes.com')
+		self.assertEqual(rows[0]['user'], '')
+		data = ''.join(iter_gzip(iter_ndjson(iter_changes())))
+		self.assertEqual(gzip.GzipFile(fileobj=StringIO(data)).read(), ''.join(lines))
+
+	def testAdminAction(self):
+		request = HttpRequest()
+		request.META['HTTP_ACCEPT_ENCODING'] = 'gzip, deflate'
+		model_admin = ChangeAdmin(Change, admin.site)
+		response = model_admin.export_csv(request, Change.objects.filter(is_public=True, site=1881))
+		self.assertEqual(response['Content-Encoding'], 'gzip')
+		content = gzip.GzipFile(fileobj=StringIO(response.content)).read()
+		self.assertEqual(len(content.strip().split('\n')), 6)
+
+	def testAdminActionThroughChangelist(self):
+		"""
+		The download survives the admin's never_cache wrapping.
+		"""
+		from django.contrib.auth.models import User
+		from django.test.client import Client
+		User.objects.create_superuser('editor', 'editor@example.com', 'secret')
+		client = Client()
+		self.failUnless(client.login(username='editor', password='secret'))
+		pks = [str(pk) for pk in Change.objects.filter(site=1881).values_list('pk', flat=True)]
+		for action in ('export_csv', 'export_ndjson'):
+			response = client.post('/admin/correx/change/', {'action': action, 'index': 0, '_selected_action': pks})
+			self.assertEqual(response.status_code, 200)
+			self.assertEqual(len(response.content.strip().split('\n')), len(pks) + (action == 'export_csv'))
@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.http import HttpRequest, Http404
+from django.test.client import Client
+
+from correx.tests import ChangeTestCase
+from correx.models import Change
+from correx.views import change_feed
+
+
+class CorrexFeedTests(ChangeTestCase):
+
+	def setUp(self):
+		self.client = Client()
+		self.changes = self.createSomeChanges()
+
+	def testFeeds(self):
+		"""
+		Test that each scope's feed lists its changes.
+		"""
+		feeds = [
+			('latest', 'A correction to a story'),
+			('site/1881', 'Site-level addition'),
+			('app/tests', 'An app-wide update'),
+			('model/tests.author', 'An update to an author bio'),
+			('object/tests.article/1', 'A correction to a story'),
+			('user/otis', 'Russ makes a site-wide addition'),
+		]
+		for url, description in feeds:
+			response = self.client.get('/correx/feeds/rss/%s/' % url)
+			self.failUnlessEqual(response.status_code, 200)
+			self.failUnless(description in response.content, url)
+		response = self.client.get('/correx/feeds/atom/latest/')
+		self.failUnless(response['Content-Type'].startswith('application/atom+xml'))
+
+	def testMissing(self):
+		for url in ('nothing', 'site/999', 'site/abc', 'app/nothing', 'model/tests.nothing', 'object/tests.article/99', 'user/nobody', 'latest/extra'):
+			self.assertRaises(Http404, change_feed, HttpRequest(), url)
+
+	def testConditionalGet(self):
+		"""
+		Test that a feed is only sent again once something newer is published.
+		"""
+		url = '/correx/feeds/rss/site/1881/'
+		response = self.client.get(url)
+		etag, last_modified = response['ETag'], response['Last-Modified']
+		self.failUnlessEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+		self.failUnlessEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+		Change.objects.create(description='Newer', change_type_id='Update', pub_date='2009-03-01', site_id=1881, is_public=True)
+		self.failUnlessEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+	def testEtagFollowsEveryWrite(self):
+		"""
+		Test that with caching off the ETag still moves for writes that
+		leave the newest date alone, and with a shared cache for edits too.
+		"""
+		url = '/correx/feeds/rss/site/1881/'
+		etag = self.client.get(url)['ETag']
+		draft = Change.objects.create(description='Old draft', change_type_id='Update', pub_date='2009-01-01', site_id=1881, is_public=False)
+		self.failUnlessEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+		draft.is_public = True
+		draft.save()
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.failUnlessEqual(response.status_code, 200)
+		etag = response['ETag']
+		change = self.changes[1]
+		change.description = 'Edited'
+		change.save()
+		# With a per-process cache an edit that moves none of the figures keeps the ETag
+		self.failUnlessEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+		old_backend = settings.CACHE_BACKEND
+		settings.CACHE_BACKEND = 'memcached://127.0.0.1:11211/'
+		try:
+			etag = self.client.get(url)['ETag']
+			change.description = 'Edited again'
+			change.save()
+			self.failUnlessEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+		finally:
+			settings.CACHE_BACKEND = old_backend
+
+	def testEtagSameInEveryProcess(self):
+		"""
+		Test that with a per-process cache the ETag doesn't depend on what
+		this process has kept.
+		"""
+		from django.core.cache import cache
+		from correx.caching import make_key
+		url = '/correx/feeds/rss/site/1881/'
+		etag = self.client.get(url)['ETag']
+		# As another worker would have it, without this one's generation
+		cache.delete(make_key('generation', 'site', 1881))
+		self.failUnlessEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+	def testCachedBody(self):
+		"""
+		Test that with caching on the rendered feed is reused until the scope changes.
+		"""
+		old_timeout = getattr(settings, 'CORREX_CACHE_TIMEOUT', None)
+		settings.CORREX_CACHE_TIMEOUT = 300
+		try:
+			url = '/correx/feeds/rss/object/tests.article/1/'
+			self.client.get(url)
+			Change.objects.filter(pk=self.changes[-1].pk).update(description='Quietly edited')
+			self.failIf('Quietly edited' in self.client.get(url).content)
+			change = Change.objects.get(pk=self.changes[-1].pk)
+			change.description = 'Loudly edited'
+			change.save()
+			self.failUnless('Loudly edited' in self.client.get(url).content)
+		finally:
+			settings.CORREX_CACHE_TIMEOUT = old_timeout
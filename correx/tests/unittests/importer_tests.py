@@ -0,0 +1,96 @@
+import datetime
+from StringIO import StringIO
+
+from correx.tests import ChangeTestCase
+from correx.models import Change, ChangeType
+from correx.importer import ChangeImporter, read_jsonl, read_csv
+
+
+class CorrexImporterTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def testJsonLines(self):
+		"""
+		Loads JSON lines across several batches and resolves every reference.
+		"""
+		data = StringIO('\n'.join([
+			'{"description": "Fixed a name", "change_type": "correction", "is_public": true, "user": "OTIS", "site": "projects.latimes.com", "content_type": "tests.article", "object_id": 1, "pub_date": "2009-03-01 10:30"}',
+			'{"description": "A draft", "change_type": "Update"}',
+			'',
+			'{"description": "Unknown type", "change_type": "Retraction"}',
+			'{"description": "Unknown user", "change_type": "Update", "user": "nobody"}',
+			'{"description": "Site by id", "change_type": "addition", "site": 1881, "is_public": "yes"}',
+		]))
+		importer = ChangeImporter(batch_size=2).run(read_jsonl(data))
+		self.assertEquals(importer.read, 5)
+		self.assertEquals(importer.inserted, 3)
+		self.assertEquals(importer.batches, 3)
+		self.assertEquals([lineno for lineno, message in importer.errors], [4, 5])
+
+		change = Change.objects.get(description='Fixed a name')
+		self.assertEquals(change.user.username, 'Otis')
+		self.assertEquals(change.site_id, 1881)
+		self.assertEquals(change.content_app, 'tests')
+		self.assertEquals(change.get_content_object().pk, 1)
+		self.failIf(Change.objects.get(description='A draft').is_public)
+
+		# The totals are recounted once the load is done
+		self.assertEquals(ChangeType.objects.get(pk='Correction').change_count, 1)
+		self.assertEquals(ChangeType.objects.get(pk='Addition').change_count, 1)
+		self.assertEquals(ChangeType.objects.get(pk='Update').change_count, 0)
+
+	def testCsv(self):
+		data = StringIO('description,change_type,is_public,pub_date\nA csv correction,Correction,1,2009-03-02\n"Spans\ntwo lines",Update,0,\nBad date,Correction,1,yesterday\n')
+		importer = ChangeImporter().run(read_csv(data))
+		self.assertEquals(importer.inserted, 2)
+		self.assertEquals(importer.errors[0][0], 5)
+		self.assertEquals(Change.objects.get(description='A csv correction').pub_date.day, 2)
+		self.assertEquals(ChangeType.objects.get(pk='Correction').change_count, 1)
+
+	def testOnlyTouchedRowsMove(self):
+		"""
+		Moves the summaries and rollups of the imported changes rather than
+		rebuilding every one.
+		"""
+		from correx.models import ChangeSummary, ChangeRollup
+		from correx.tests.models import Article
+		article = Article.objects.get(pk=1)
+		Change.objects.create(description='Saved', change_type_id='Update', is_public=True, content_object=article)
+		# Leave an unrelated row off to show it isn't recounted
+		ChangeSummary.objects.filter(scope__startswith='object:').update(change_count=7)
+		data = StringIO('{"description": "Imported", "change_type": "Correction", "is_public": true, "site": 1881, "pub_date": "2009-03-01 10:30"}\n')
+		ChangeImporter().run(read_jsonl(data))
+		self.assertEquals(ChangeSummary.objects.filter(scope__startswith='object:').values_list('change_count', flat=True)[0], 7)
+		summary = ChangeSummary.objects.get(scope='site:1881', change_type='Correction')
+		self.assertEquals(summary.change_count, 1)
+		self.assertEquals(summary.last_pub_date.hour, 10)
+		self.assertEquals(ChangeRollup.objects.series('day', change_type='Correction'), [(datetime.date(2009, 3, 1), 1)])
+		self.assertEquals(ChangeType.objects.get(pk='Correction').change_count, 1)
+
+	def testBadJsonLines(self):
+		"""
+		Lines that aren't JSON objects, or carry values of the wrong kind,
+		are reported without stopping the load.
+		"""
+		data = StringIO('\n'.join([
+			'{"description": "Before", "change_type": "Update"}',
+			'{"description": "Cut off", ',
+			'["not", "an", "object"]',
+			'{"description": "Listed id", "change_type": "Update", "object_id": [1]}',
+			'{"description": ["not", "text"], "change_type": "Update"}',
+			'{"description": "Stray byte \xff", "change_type": "Update"}',
+			'{"description": "After", "change_type": "Update"}',
+		]))
+		importer = ChangeImporter(batch_size=2).run(read_jsonl(data))
+		self.assertEquals([lineno for lineno, message in importer.errors], [2, 3, 4, 5, 6])
+		self.assertEquals(importer.inserted, 2)
+		self.assertEquals(Change.objects.filter(description__in=['Before', 'After']).count(), 2)
+
+	def testBadCsv(self):
+		"""
+		Rows that aren't valid UTF-8 are reported without stopping the load.
+		"""
+		data = StringIO('description,change_type\nStray byte \xff,Update\nAfter,Update\n')
+		importer = ChangeImporter().run(read_csv(data))
+		self.assertEquals([lineno for lineno, message in importer.errors], [2])
+		self.assertEquals(importer.inserted, 1)
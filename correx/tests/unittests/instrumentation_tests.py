@@ -0,0 +1,114 @@
+import logging
+
+from django.conf import settings
+from django.template import Template, Context
+
+from correx.tests import ChangeTestCase
+from correx.models import Change
+from correx.instrumentation import measured
+
+
+class ListHandler(logging.Handler):
+	def __init__(self):
+		logging.Handler.__init__(self)
+		self.records = []
+
+	def emit(self, record):
+		self.records.append(record)
+
+
+class CorrexInstrumentationTests(ChangeTestCase):
+
+	def setUp(self):
+		self.changes = self.createSomeChanges()
+		self.old_enabled = getattr(settings, 'CORREX_INSTRUMENTATION', False)
+		self.old_threshold = getattr(settings, 'CORREX_SLOW_THRESHOLD', 100)
+		settings.CORREX_INSTRUMENTATION = True
+		self.measurements = []
+		measured.connect(self.record)
+
+	def tearDown(self):
+		measured.disconnect(self.record)
+		settings.CORREX_INSTRUMENTATION = self.old_enabled
+		settings.CORREX_SLOW_THRESHOLD = self.old_threshold
+
+	def record(self, sender, measurement, **kwargs):
+		self.measurements.append(measurement)
+
+	def render(self, t):
+		Template("{% load correx_tags %}" + t).render(Context())
+
+	def testTagRender(self):
+		"""
+		A render reports the tag, its scope, queries and rows.
+		"""
+		self.render("{% get_changes_for_site 1881 2 as change_list %}")
+		self.assertEqual(len(self.measurements), 1)
+		m = self.measurements[0]
+		self.assertEqual((m.kind, m.name, m.scope, m.rows), ('tag', 'get_changes_for_site', ('site', 1881), 2))
+		self.assertEqual(m.queries, 1)
+		self.failUnless(m.duration >= 0)
+
+	def testSignalHandlers(self):
+		"""
+		Each handler on a change reports what it did.
+		"""
+		change = self.changes[-1]
+		change.change_type_id = 'Update'
+		change.save()
+		names = [(m.name, m.scope, m.rows) for m in self.measurements]
+		self.assertEqual(names, [
+			('remember_change_state', ('change', change.pk), 1),
+			('count_changes', ('change', change.pk), 2),
+			('invalidate_cache', ('change', change.pk), 6),
+			('summarize_changes', ('change', change.pk), 10),
+			('rollup_changes', ('change', change.pk), 2),
+			('index_change', ('change', change.pk), 1),
+		])
+		self.assertEqual([m.queries for m in self.measurements][:3], [1, 2, 0])
+
+	def testSlowLog(self):
+		"""
+		Anything over the threshold is logged.
+		"""
+		handler = ListHandler()
+		logger = logging.getLogger('correx')
+		logger.addHandler(handler)
+		try:
+			settings.CORREX_SLOW_THRESHOLD = 0
+			self.render("{% get_latest_changes 1 as change_list %}")
+		finally:
+			logger.removeHandler(handler)
+		self.assertEqual(len(handler.records), 1)
+		self.failUnless('get_latest_changes' in handler.records[0].getMessage())
+
+	def testDisabled(self):
+		settings.CORREX_INSTRUMENTATION = False
+		self.render("{% get_latest_changes 1 as change_list %}")
+		self.assertEqual(self.measurements, [])
+
+	def testCursorRestored(self):
+		"""
+		Queries are only counted while a measurement is running.
+		"""
+		from django.db import connection
+		from correx.instrumentation import Measurement
+		outer = Measurement('signal', 'outer')
+		inner = Measurement('signal', 'inner')
+		Change.objects.count()
+		inner.finish()
+		self.failUnless('cursor' in connection.__dict__)
+		outer.finish()
+		self.failIf('cursor' in connection.__dict__)
+		self.assertEqual((inner.queries, outer.queries), (1, 1))
+		self.render("{% get_latest_changes 1 as change_list %}")
+		self.failIf('cursor' in connection.__dict__)
+
+	def testCursorRestoredAfterError(self):
+		"""
+		Queries stop being counted when the measured work raises.
+		"""
+		from django.db import connection
+		self.assertRaises(Exception, self.render, "{% get_changes_for_site 'notanid' 1 as change_list %}")
+		self.failIf('cursor' in connection.__dict__)
+		self.assertEqual(self.measurements, [])
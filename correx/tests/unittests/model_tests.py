@@ -17,4 +17,58 @@ class CorrexModelTests(ChangeTestCase):
 		"""
 		for c in ChangeType.objects.all():
 			c.count_changes()
-			self.assertEquals(c.change_count, c.change_set.filter(is_public=True).count())
\ No newline at end of file
+			self.assertEquals(c.change_count, c.change_set.filter(is_public=True).count())
+
+	def testForObjects(self):
+		"""
+		Tests the per-object limits of for_objects() with and without window functions.
+		"""
+		from django.conf import settings
+		from correx.tests import CT
+		from correx.tests.models import Article, Author
+		self.createSomeChanges()
+		article_ct = CT(Article)
+		for day in (10, 11, 12):
+			Change.objects.create(description='Article two, day %s' % day, change_type_id='Update',
+				pub_date='2009-02-%s' % day, content_type=article_ct, object_id=2, is_public=True)
+		Change.objects.create(description='Unpublished', change_type_id='Update',
+			pub_date='2009-02-20', content_type=article_ct, object_id=2, is_public=False)
+		objects = list(Article.objects.all()) + list(Author.objects.all())
+		old_setting = getattr(settings, 'CORREX_WINDOW_FUNCTIONS', None)
+		try:
+			for setting in (True, False):
+				settings.CORREX_WINDOW_FUNCTIONS = setting
+				changes = Change.objects.for_objects(objects, 2)
+				self.assertEquals([c.description for c in changes[(article_ct.pk, 1)]], ['A correction to a story'])
+				self.assertEquals([c.description for c in changes[(article_ct.pk, 2)]], ['Article two, day 12', 'Article two, day 11'])
+				self.assertEquals(changes[(CT(Author).pk, 1)], [])
+				self.assertEquals(len(Change.objects.for_objects(objects)[(article_ct.pk, 2)]), 3)
+		finally:
+			settings.CORREX_WINDOW_FUNCTIONS = old_setting
+
+
+class CorrexLatestByTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def testLatestBy(self):
+		"""
+		Tests the per-group limits of latest_by() with and without window functions.
+		"""
+		from django.conf import settings
+		self.createSomeChanges()
+		Change.objects.create(description='Unpublished', change_type_id='Update',
+			pub_date='2009-03-01', content_app='tests', is_public=False)
+		old_setting = getattr(settings, 'CORREX_WINDOW_FUNCTIONS', None)
+		try:
+			for setting in (True, False):
+				settings.CORREX_WINDOW_FUNCTIONS = setting
+				by_type = Change.objects.latest_by('change_type', 2)
+				self.assertEquals(sorted(by_type.keys()), ['Addition', 'Correction', 'Update'])
+				self.assertEquals([c.description for c in by_type['Update']], ['An app-wide update', 'An update to an author bio'])
+				self.assertEquals([c.description for c in by_type['Correction']], ['A correction to a story', 'Correction without connection'])
+				by_app = Change.objects.latest_by('content_app', 5)
+				self.assertEquals(by_app.keys(), ['tests'])
+				self.assertEquals(len(by_app['tests']), 3)
+				self.assertEquals(len(Change.objects.latest_by('site', 10)[1881]), 5)
+		finally:
+			settings.CORREX_WINDOW_FUNCTIONS = old_setting
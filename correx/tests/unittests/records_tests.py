@@ -0,0 +1,62 @@
+import pickle
+
+from django.conf import settings
+from django.template import Template, Context
+
+from correx.tests import ChangeTestCase
+from correx.models import Change, ChangeType
+from correx.records import ChangeRecord
+from correx.lookups import get_change_types
+
+
+class CorrexRecordTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def setUp(self):
+		self.changes = self.createSomeChanges()
+		self.old_records = getattr(settings, 'CORREX_TAG_RECORDS', False)
+
+	def tearDown(self):
+		settings.CORREX_TAG_RECORDS = self.old_records
+
+	def testRecords(self):
+		"""
+		A record matches its change, and showing it needs no more queries.
+		"""
+		get_change_types()
+		def fetch():
+			return [(r.pk, r.short_description, r.change_type.name, r.change_type.get_icon_url(), r.username, r.site_name)
+				for r in Change.objects.live().order_by('pk').records()]
+		rows = self.assertNumQueries(1, fetch)
+		expected = [(c.pk, c.short_description, c.change_type.name, c.change_type.get_icon_url(),
+			c.user and c.user.username, c.site and c.site.name) for c in Change.objects.live().order_by('pk')]
+		self.assertEqual(rows, expected)
+
+	def testShortDescription(self):
+		change = Change.objects.create(description='x' * 500, change_type_id='Update', is_public=True)
+		record = Change.objects.filter(pk=change.pk).records()[0]
+		self.assertEqual(record.short_description, change.get_short_description())
+		self.assertEqual(unicode(record), change.get_short_description())
+
+	def testReadOnly(self):
+		record = Change.objects.records()[0]
+		self.assertRaises(AttributeError, setattr, record, 'site_id', 1)
+		self.assertRaises(AttributeError, setattr, record, 'description', 'Edited')
+		self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+
+	def testChangeTypesReset(self):
+		self.assertEqual(get_change_types()['Update'].slug, 'update')
+		change_type = ChangeType.objects.get(pk='Update')
+		change_type.slug = 'updated'
+		change_type.save()
+		self.assertEqual(get_change_types()['Update'].slug, 'updated')
+
+	def testTags(self):
+		settings.CORREX_TAG_RECORDS = True
+		ctx = Context()
+		Template("{% load correx_tags %}{% get_changes_for_site 1881 2 as change_list %}").render(ctx)
+		self.failUnless(isinstance(ctx['change_list'][0], ChangeRecord))
+		self.assertEqual([r.pk for r in ctx['change_list']],
+			list(Change.objects.live().filter(site=1881).values_list('pk', flat=True)[:2]))
+		out = Template("{% load correx_tags %}{% render_latest_changes 1 %}").render(Context())
+		self.failUnless('Correction - A correction to a story...' in out, out)
@@ -0,0 +1,84 @@
+import datetime
+
+from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.filterspecs import FilterSpec
+from django.http import HttpRequest
+
+from correx.tests import ChangeTestCase
+from correx.models import Change, ChangeRollup
+from correx.admin import ChangeAdmin, RollupRelatedFilterSpec, RollupChoicesFilterSpec
+from correx.templatetags.correx_admin import rollup_date_hierarchy, get_rollup_filters
+
+
+class CorrexRollupTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def setUp(self):
+		self.changes = self.createSomeChanges()
+		Change.objects.create(description='A draft', change_type_id='Correction', pub_date='2009-03-02 12:00',
+			site_id=1881, content_app='tests', is_public=False)
+
+	def assertRollupsExact(self):
+		kept = sorted(ChangeRollup.objects.values_list('day', 'change_type', 'site', 'content_app', 'is_public', 'change_count'))
+		ChangeRollup.objects.rebuild()
+		self.assertEqual(kept, sorted(ChangeRollup.objects.values_list('day', 'change_type', 'site', 'content_app', 'is_public', 'change_count')))
+
+	def testIncremental(self):
+		"""
+		Saves, deletes and bulk updates leave the rollups as a rebuild would.
+		"""
+		self.failUnless(ChangeRollup.objects.count())
+		self.assertRollupsExact()
+		change = self.changes[0]
+		change.pub_date = datetime.datetime(2009, 3, 1, 9, 30)
+		change.save()
+		self.assertRollupsExact()
+		self.changes[1].delete()
+		self.assertRollupsExact()
+		Change.objects.filter(site=1881).retype('Update')
+		Change.objects.filter(site=1881).publish()
+		self.assertRollupsExact()
+		self.assertEqual(ChangeRollup.objects.filter(is_public=False).count(), 0)
+
+	def testSeries(self):
+		self.assertEqual(ChangeRollup.objects.series('month', is_public=True),
+			[(datetime.date(2009, 2, 1), 6)])
+		days = {}
+		for change in Change.objects.live():
+			days[change.pub_date.date()] = days.get(change.pub_date.date(), 0) + 1
+		self.assertEqual(ChangeRollup.objects.series('day', is_public=True), sorted(days.items()))
+		self.assertEqual(ChangeRollup.objects.series('year', change_type='Correction'),
+			[(datetime.date(2009, 1, 1), 3)])
+		self.assertRaises(ValueError, ChangeRollup.objects.series, 'week')
+
+	def get_changelist(self, **params):
+		model_admin = ChangeAdmin(Change, admin.site)
+		request = HttpRequest()
+		request.GET.update(params)
+		return ChangeList(request, Change, model_admin.list_display, model_admin.list_display_links,
+			model_admin.list_filter, model_admin.date_hierarchy, model_admin.search_fields,
+			model_admin.list_select_related, model_admin.list_per_page, model_admin.list_editable, model_admin)
+
+	def testDateHierarchy(self):
+		"""
+		The drill-down reads the rollups, and matches the one read from the changelog.
+		"""
+		for params in [{}, {'pub_date__year': '2009'}, {'pub_date__year': '2009', 'pub_date__month': '2'},
+				{'is_public__exact': '0'}, {'site__id__exact': '1881', 'o': '1'}]:
+			cl = self.get_changelist(**params)
+			self.failIfEqual(get_rollup_filters(cl), None)
+			self.assertEqual(self.assertNumQueries(1, rollup_date_hierarchy, cl), date_hierarchy(cl))
+		# Searches and other filters fall back on the changelog
+		self.assertEqual(get_rollup_filters(self.get_changelist(q='story')), None)
+		self.assertEqual(get_rollup_filters(self.get_changelist(user__id__exact='1')), None)
+
+	def testFilterChoices(self):
+		cl = self.get_changelist()
+		for name, spec_class in [('site', RollupRelatedFilterSpec), ('content_app', RollupChoicesFilterSpec)]:
+			f = Change._meta.get_field(name)
+			spec = FilterSpec.create(f, HttpRequest(), {}, Change, None)
+			self.failUnless(isinstance(spec, spec_class))
+		apps = [c['display'] for c in spec.choices(cl)]
+		self.assertEqual(apps[1:], ['tests'])
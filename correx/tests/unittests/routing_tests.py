@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.db import connection, DatabaseError
+from django.http import HttpRequest, HttpResponse
+
+from correx import routing
+from correx.tests import ChangeTestCase
+from correx.models import Change, ChangeType, ChangeSummary
+
+
+class CorrexRoutingTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def setUp(self):
+		self.changes = self.createSomeChanges()
+		self.old_databases = getattr(settings, 'CORREX_READ_DATABASES', [])
+		settings.CORREX_READ_DATABASES = [{'DATABASE_NAME': ':memory:'}]
+		routing._replicas = None
+		routing.reset()
+		self.replica = routing.get_replicas()[0]
+
+	def tearDown(self):
+		settings.CORREX_READ_DATABASES = self.old_databases
+		routing.close_replicas()
+		routing._replicas = None
+		routing.reset()
+
+	def testReads(self):
+		"""
+		Public reads go to the replica, and stay there as the queryset is refined.
+		"""
+		self.failUnless(Change.objects.live().filter(site=1881).values_list('id').query.connection is self.replica)
+		# The replica here is an empty database, so reading the summaries from it fails
+		self.assertRaises(DatabaseError, ChangeSummary.objects.for_app, 'tests')
+		self.failUnless(Change.objects.all().query.connection is connection)
+
+	def testLookupsOnPrimary(self):
+		"""
+		The maps kept for the life of the process are built from the primary.
+		"""
+		from correx import lookups
+		lookups.reset_app_models()
+		lookups.reset_user_ids()
+		lookups.reset_change_types()
+		# The replica is an empty database, so these would fail if read from it
+		self.failUnless(lookups.get_app_models()['labels'])
+		self.failUnless(lookups.get_user_id('otis'))
+		self.failUnless('Correction' in lookups.get_change_types())
+
+	def testNoReplicas(self):
+		settings.CORREX_READ_DATABASES = []
+		routing._replicas = None
+		self.failUnless(Change.objects.live().query.connection is connection)
+
+	def testWritesStayOnPrimary(self):
+		"""
+		Updates and deletes made through a replica's queryset run on the
+		primary, as does the upkeep of the totals.
+		"""
+		live = Change.objects.live()
+		live.filter(pk=self.changes[0].pk).update(description='Edited')
+		self.assertEqual(Change.objects.get(pk=self.changes[0].pk).description, 'Edited')
+		routing.reset()
+		Change.objects.live().filter(site=1881).retype('Update')
+		self.assertEqual(ChangeType.objects.get(pk='Update').change_count, 5)
+		routing.reset()
+		Change.objects.live().filter(pk=self.changes[0].pk).delete()
+		self.assertEqual(Change.objects.filter(pk=self.changes[0].pk).count(), 0)
+
+	def testReadYourWrites(self):
+		"""
+		A request that writes a change reads from the primary afterwards, and
+		so does the browser's next request with the middleware installed.
+		"""
+		middleware = routing.ReadYourWritesMiddleware()
+		routing.reset()
+		Change.objects.create(description='Fresh', change_type_id='Update', is_public=True)
+		self.failUnless(Change.objects.live().query.connection is connection)
+		response = middleware.process_response(HttpRequest(), HttpResponse())
+		self.failUnless(routing.STICKY_COOKIE in response.cookies)
+
+		routing.reset()
+		self.failUnless(Change.objects.live().query.connection is self.replica)
+		request = HttpRequest()
+		request.COOKIES[routing.STICKY_COOKIE] = '1'
+		middleware.process_request(request)
+		self.failUnless(Change.objects.live().query.connection is connection)
+		response = middleware.process_response(request, HttpResponse())
+		self.failIf(routing.STICKY_COOKIE in response.cookies)
@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.contrib import admin
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpRequest
+
+from correx.tests import ChangeTestCase
+from correx.models import Change
+from correx.admin import ChangeAdmin
+from correx import search
+
+
+class CorrexSearchTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def setUp(self):
+		self.changes = self.createSomeChanges()
+		self.old_backend = getattr(settings, 'CORREX_SEARCH_BACKEND', None)
+
+	def tearDown(self):
+		settings.CORREX_SEARCH_BACKEND = self.old_backend
+
+	def descriptions(self, queryset):
+		return sorted([c.description for c in queryset])
+
+	def testSearch(self):
+		self.assertEqual(self.descriptions(Change.objects.search('author')), ['An update to an author bio'])
+		# Every word must match, each as the start of a word
+		self.assertEqual(self.descriptions(Change.objects.search('site-wide add')), ['Russ makes a site-wide addition'])
+		self.assertEqual(self.descriptions(Change.objects.search('correction story')), ['A correction to a story'])
+		self.assertEqual(self.descriptions(Change.objects.search('correction bio')), [])
+		# Punctuation isn't read as syntax, and a query without words finds nothing
+		self.assertEqual(self.descriptions(Change.objects.search('"author" (bio*')), ['An update to an author bio'])
+		self.assertEqual(list(Change.objects.search('"*"')), [])
+		# It narrows any queryset
+		self.assertEqual(Change.objects.live().filter(site=1881).search('update').count(), 2)
+
+	def testUsesIndex(self):
+		"""
+		A search reads the index rather than the descriptions.
+		"""
+		if search.get_backend().__class__ is search.LikeBackend:
+			return
+		sql = Change.objects.search('author').query.as_sql()[0]
+		self.failUnless(search.TABLE in sql, sql)
+		self.failIf('LIKE' in sql, sql)
+
+	def testKeptInStep(self):
+		change = self.changes[0]
+		change.description = 'An obituary'
+		change.save()
+		self.assertEqual(list(Change.objects.search('obituary')), [change])
+		self.assertEqual(list(Change.objects.search('connection')), [])
+		change.delete()
+		self.assertEqual(list(Change.objects.search('obituary')), [])
+
+	def testRebuild(self):
+		Change.objects.filter(pk=self.changes[0].pk).update(description='Quietly edited')
+		self.assertEqual(list(Change.objects.search('quietly')), [])
+		call_command('rebuild_search_index', verbosity=0, batch_size=2)
+		self.assertEqual([c.pk for c in Change.objects.search('quietly')], [self.changes[0].pk])
+		self.assertEqual(Change.objects.search('change').count(), 0)
+		self.assertEqual(Change.objects.search('correct').count(), 1)
+
+	def testLikeBackend(self):
+		settings.CORREX_SEARCH_BACKEND = 'like'
+		self.assertEqual(self.descriptions(Change.objects.search('site-wide add')), ['Russ makes a site-wide addition'])
+
+	def testAdmin(self):
+		model_admin = ChangeAdmin(Change, admin.site)
+		request = HttpRequest()
+		request.GET['q'] = 'author bio'
+		self.assertEqual(self.descriptions(model_admin.queryset(request)), ['An update to an author bio'])
+
+	def testPartWords(self):
+		"""
+		The index matches the starts of words only, and the admin falls
+		back to matching anywhere when it finds nothing.
+		"""
+		self.assertEqual(list(Change.objects.search('rection')), [])
+		self.assertEqual(Change.objects.search('correc').count(), 2)
+		model_admin = ChangeAdmin(Change, admin.site)
+		request = HttpRequest()
+		request.GET['q'] = 'rection'
+		qs = model_admin.queryset(request).filter(description__icontains='rection')
+		self.assertEqual(self.descriptions(qs), ['A correction to a story', 'Correction without connection'])
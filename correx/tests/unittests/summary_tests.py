@@ -0,0 +1,98 @@
+import datetime
+
+from django.template import Template, Context
+
+from correx.tests import ChangeTestCase, CT
+from correx.models import Change, ChangeSummary
+from correx.tests.models import Article, Author
+
+
+class CorrexSummaryTests(ChangeTestCase):
+	fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+	def setUp(self):
+		self.changes = self.createSomeChanges()
+		self.article = Article.objects.get(pk=1)
+
+	def assertSummariesExact(self):
+		"""
+		Checks the running totals against a rebuild from the changelog.
+		"""
+		rows = lambda: sorted(ChangeSummary.objects.values_list('scope', 'change_type', 'change_count', 'last_pub_date'))
+		kept = rows()
+		ChangeSummary.objects.rebuild()
+		self.assertEqual(kept, rows())
+
+	def testScopes(self):
+		self.assertSummariesExact()
+		summary = ChangeSummary.objects.for_object(self.article)
+		self.assertEqual((summary.Correction, summary.Update, summary.total), (1, 0, 1))
+		self.assertEqual(summary.last_pub_date, datetime.datetime(2009, 2, 16))
+		self.assertEqual(ChangeSummary.objects.for_model(Author).Update, 1)
+		self.assertEqual(ChangeSummary.objects.for_app('tests').total, 3)
+		self.assertEqual(ChangeSummary.objects.for_site(self.changes[1].site).total, 5)
+		self.assertEqual(ChangeSummary.objects.for_user(self.changes[2].user).Addition, 1)
+
+	def testWrites(self):
+		"""
+		Publishing, moving, backdating and deleting each keep the totals exact.
+		"""
+		draft = Change.objects.create(description='Draft', change_type_id='Update', pub_date='2009-03-01',
+			content_app='tests', content_type=CT(Article), object_id=1, is_public=False)
+		self.assertEqual(ChangeSummary.objects.for_object(self.article).total, 1)
+		draft.is_public = True
+		draft.save()
+		summary = ChangeSummary.objects.for_object(self.article)
+		self.assertEqual((summary.Update, summary.last_pub_date), (1, datetime.datetime(2009, 3, 1)))
+		self.assertSummariesExact()
+		# Backdating the newest change falls back to the next newest
+		draft.pub_date = datetime.datetime(2009, 1, 1)
+		draft.save()
+		self.assertEqual(ChangeSummary.objects.for_object(self.article).last_pub_date, datetime.datetime(2009, 2, 16))
+		self.assertSummariesExact()
+		# Moving it to another object and retyping it
+		draft.object_id = 2
+		draft.change_type_id = 'Correction'
+		draft.save()
+		self.assertEqual(ChangeSummary.objects.for_object(self.article).Update, 0)
+		self.assertEqual(ChangeSummary.objects.for_object(Article.objects.get(pk=2)).Correction, 1)
+		self.assertSummariesExact()
+		draft.delete()
+		self.changes[-1].delete()
+		self.assertEqual(ChangeSummary.objects.for_object(self.article).total, 0)
+		self.assertSummariesExact()
+
+	def testRemovalsDontRecount(self):
+		"""
+		Taking a change out of its scopes moves the counts without counting
+		the scopes again, and only looks up a newest date where it left.
+		"""
+		from django.conf import settings
+		from django.db import connection
+		old_debug = settings.DEBUG
+		settings.DEBUG = True
+		connection.queries = []
+		try:
+			for change in (self.changes[1], self.changes[-1]):
+				change.is_public = False
+				change.save()
+			sql = [q['sql'] for q in connection.queries]
+		finally:
+			settings.DEBUG = old_debug
+		self.failIf([q for q in sql if 'COUNT(' in q and 'changesummary' not in q], sql)
+		self.assertEqual(ChangeSummary.objects.for_site(self.changes[1].site).Correction, 0)
+		self.assertEqual(ChangeSummary.objects.for_site(self.changes[1].site).last_pub_date, datetime.datetime(2009, 2, 15))
+		self.assertSummariesExact()
+
+	def testForObjects(self):
+		articles = list(Article.objects.all())
+		summaries = self.assertNumQueries(1, ChangeSummary.objects.for_objects, articles)
+		self.assertEqual(summaries[(CT(Article).pk, 1)].Correction, 1)
+		self.assertEqual(summaries[(CT(Article).pk, 2)].total, 0)
+
+	def testTags(self):
+		t = Template("{% load correx_tags %}{% get_change_summary for article as summary %}{{ summary.Correction }}/{{ summary.Update }}")
+		self.assertEqual(t.render(Context({'article': self.article})), '1/0')
+		t = Template("{% load correx_tags %}{% get_change_summaries for articles as summary %}"
+			"{% for a in articles %}{{ a.pk }}:{{ a.summary.total }} {% endfor %}")
+		self.assertEqual(t.render(Context({'articles': Article.objects.all()})), '1:1 2:0 ')
@@ -1,7 +1,7 @@
 from django.template import Template, Context
 
 from correx.models import Change
-from correx.tests import ChangeTestCase
+from correx.tests import ChangeTestCase, CT
 from correx.tests.models import Article, Author
 
 class CorrexTemplateTagTests(ChangeTestCase):
@@ -72,4 +72,73 @@ class CorrexTemplateTagTests(ChangeTestCase):
         match = Change.objects.get(pk=6)
         ctx, out = self.render(t, c=match, a=Article.objects.get(pk=1))
         self.assertEqual(out, "")
-        self.assertEqual(list(ctx["change_list"]), [match])
\ No newline at end of file
+        self.assertEqual(list(ctx["change_list"]), [match])
+
+    def testGetChangeListByObjects(self):
+        """
+        Tests the tag for attaching changes to every object in a list.
+        """
+        Change.objects.create(description='An older correction', change_type_id='Correction',
+            pub_date='2009-02-10', content_type=CT(Article), object_id=1, is_public=True)
+        t = "{% load correx_tags %}{% get_changes_for_objects articles 1 as change_list %}"
+        articles = list(Article.objects.all())
+        ctx, out = self.render(t, articles=articles)
+        self.assertEqual(out, "")
+        self.assertEqual([c.description for c in articles[0].change_list], ['A correction to a story'])
+        self.assertEqual(articles[1].change_list, [])
+
+    def testSingleQuery(self):
+        """
+        Each tag costs one query, given literals or variables.
+        """
+        from django.contrib.auth.models import User
+        from django.contrib.sites.models import Site
+        article = Article.objects.get(pk=1)
+        match = Change.objects.get(pk=6)
+        tags = [
+            ("{% get_changes_for_user Otis 1 as change_list %}", {}),
+            ("{% get_changes_for_user u 1 as change_list %}", {'u': 'otis'}),
+            ("{% get_changes_for_user u 1 as change_list %}", {'u': User.objects.get(username='Otis')}),
+            ("{% get_changes_for_site 1881 1 as change_list %}", {}),
+            ("{% get_changes_for_site s 1 as change_list %}", {'s': Site.objects.get(pk=1881)}),
+            ("{% get_changes_for_app tests 1 as change_list %}", {}),
+            ('{% get_changes_for_app "tests" 1 as change_list %}', {}),
+            ("{% get_changes_for_app label 1 as change_list %}", {'label': 'tests'}),
+            ("{% get_changes_for_model tests.Article 1 as change_list %}", {}),
+            ("{% get_changes_for_model m 1 as change_list %}", {'m': 'tests.article'}),
+            ("{% get_changes_for_model m 1 as change_list %}", {'m': Article}),
+            ("{% get_changes_for_object a 1 as change_list %}", {'a': article}),
+        ]
+        for t, c in tags:
+            template = Template("{% load correx_tags %}" + t)
+            ctx = Context(c)
+            self.assertNumQueries(1, template.render, ctx)
+            self.assertEqual(ctx["change_list"], [match], t)
+
+    def testUnknownUser(self):
+        ctx, out = self.render("{% load correx_tags %}{% get_changes_for_user nobody 1 as change_list %}")
+        self.assertEqual(ctx["change_list"], [])
+
+
+class CorrexLatestChangesByTagTests(ChangeTestCase):
+    fixtures = ["correx_tests", "correx_sample_changetypes"]
+
+    def setUp(self):
+        self.createSomeChanges()
+
+    def testGetLatestChangesBy(self):
+        """
+        Tests the tag for pulling the latest changes of every type at once,
+        in one query with window functions and one more per type without.
+        """
+        from django.conf import settings
+        t = Template("{% load correx_tags %}{% get_latest_changes_by type 1 as type_list %}"
+            "{% for type in type_list %}{{ type.grouper.name }}:{% for c in type.list %}{{ c.pk }}{% endfor %} {% endfor %}")
+        old_setting = getattr(settings, 'CORREX_WINDOW_FUNCTIONS', None)
+        try:
+            for setting, queries in ((True, 1), (False, 4)):
+                settings.CORREX_WINDOW_FUNCTIONS = setting
+                out = self.assertNumQueries(queries, t.render, Context())
+                self.assertEqual(out, "Addition:3 Correction:6 Update:4 ")
+        finally:
+            settings.CORREX_WINDOW_FUNCTIONS = old_setting
@@ -45,3 +45,64 @@ class CorrexViewTests(ChangeTestCase):
 			
 				# If it equals null it means the model couldn't be found
 				self.failIfEqual(get_model(app, model), None)
+
+	def testConditionalGet(self):
+		"""
+		Test that repeat requests for the model lists are answered with a 304.
+		"""
+		url = '/correx/admin/filter/contenttype/'
+		response = self.client.get(url, {'app_label': 'tests'})
+		self.failUnlessEqual(response.status_code, 200)
+		etag = response['ETag']
+		last_modified = response['Last-Modified']
+
+		response = self.client.get(url, {'app_label': 'tests'}, HTTP_IF_NONE_MATCH=etag)
+		self.failUnlessEqual(response.status_code, 304)
+		response = self.client.get(url, {'app_label': 'tests'}, HTTP_IF_MODIFIED_SINCE=last_modified)
+		self.failUnlessEqual(response.status_code, 304)
+
+		# Adding a model invalidates the map
+		ContentType.objects.create(name='column', app_label='tests', model='column')
+		response = self.client.get(url, {'app_label': 'tests'}, HTTP_IF_NONE_MATCH=etag)
+		self.failUnlessEqual(response.status_code, 200)
+		self.failUnless('column' in [i['Text'] for i in simplejson.loads(response.content)])
+
+	def testAllApps(self):
+		"""
+		Test the request for every app's list of models at once.
+		"""
+		response = self.client.get('/correx/admin/filter/contenttype/all/')
+		self.failUnlessEqual(response.status_code, 200)
+		json = simplejson.loads(response.content)
+		self.failUnlessEqual(sorted([i['Text'] for i in json['tests']]), ['---------', 'article', 'author'])
+		for app, model_list in json.items():
+			single = self.client.get('/correx/admin/filter/contenttype/', {'app_label': app})
+			self.failUnlessEqual(simplejson.loads(single.content), model_list)
+
+	def testChangeApi(self):
+		"""
+		Test paging through the public changelog with cursors.
+		"""
+		self.createSomeChanges()
+		Change.objects.create(description='Draft', change_type_id='Update', is_public=False)
+		url = '/correx/api/changes/'
+		expected = list(Change.objects.live().order_by('-pub_date', '-id').values_list('id', flat=True))
+		seen, params = [], {'limit': 4}
+		while True:
+			json = simplejson.loads(self.client.get(url, params).content)
+			self.failUnless(len(json['results']) <= 4)
+			seen += [i['id'] for i in json['results']]
+			if not json['next']:
+				break
+			params['cursor'] = json['next']
+		self.failUnlessEqual(seen, expected)
+
+		json = simplejson.loads(self.client.get(url, {'model': 'tests.article', 'object': 1, 'user': 'otis'}).content)
+		self.failUnlessEqual([(i['description'], i['model'], i['site']) for i in json['results']],
+			[('A correction to a story', 'tests.article', 1881)])
+		self.failUnlessEqual(json['next'], None)
+		self.failUnlessEqual(len(simplejson.loads(self.client.get(url, {'site': 1881}).content)['results']), 5)
+		self.failUnlessEqual(len(simplejson.loads(self.client.get(url, {'app': 'tests'}).content)['results']), 3)
+
+		for params in ({'cursor': 'junk'}, {'cursor': '9999999999-1-1-0-0-0-0-1'}, {'user': 'nobody'}, {'object': 1}, {'limit': 0}, {'model': 'tests.nothing'}):
+			self.failUnlessEqual(self.client.get(url, params).status_code, 400)
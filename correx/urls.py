@@ -5,5 +5,9 @@ from django.conf.urls.defaults import *
 urlpatterns = patterns('correx.views',
 
 	url(r'^admin/filter/contenttype/$', 'filter_contenttypes_by_app', name="filter-contenttypes-by-app"),
+	url(r'^admin/filter/contenttype/all/$', 'contenttypes_by_app', name="contenttypes-by-app"),
+	url(r'^api/changes/$', 'change_api', name="change-api"),
+	url(r'^feeds/rss/(?P<url>.*)/$', 'change_feed', {'feed_type': 'rss'}, name="change-feed-rss"),
+	url(r'^feeds/atom/(?P<url>.*)/$', 'change_feed', {'feed_type': 'atom'}, name="change-feed-atom"),
 
 )
\ No newline at end of file
@@ -1,44 +1,225 @@
+import datetime
+
 from django.template import RequestContext
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.utils.cache import patch_cache_control
+from django.utils.hashcompat import md5_constructor
+from django.utils.feedgenerator import Atom1Feed
+from django.views.decorators.http import condition
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Count, Max, Q, get_model
+from django.utils import simplejson
 
 # Models
+from correx.models import Change
 from django.contrib.contenttypes.models import ContentType
 
-# Serialization
-from django.utils import simplejson
+# Lookups
+from correx import caching
+from correx.feeds import FEEDS
+from correx.lookups import get_app_models, get_label, get_user_id, EMPTY_PAYLOAD
+
+
+def get_app_models_etag(request, *args, **kwargs):
+	return get_app_models()['etag']
+
+
+def get_app_models_last_modified(request, *args, **kwargs):
+	return get_app_models()['last_modified']
 
 
+def json_response(payload):
+	"""
+	Wraps a JSON payload in a response that browsers will check back on
+	before reusing, which the conditional views answer with a 304.
+	"""
+	response = HttpResponse(payload, mimetype='application/javascript')
+	patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+	return response
+
+
+@condition(etag_func=get_app_models_etag, last_modified_func=get_app_models_last_modified)
 def filter_contenttypes_by_app(request):
-	""" 
-	Accepts an app_label as a query_string and returns its associated model set 
+	"""
+	Accepts an app_label as a query_string and returns its associated model set
 	as JSON in a format designed to fill an in an HTML dropdown menu.
-	
+
 	HTTP GET is required.
 	"""
 	# If there is not a GET request throw a 404
 	if not request.GET:
 		raise Http404
-	
-	# Seed the response JSON with the bare minimum, enough to fill an empty select box
-	response_list = [{'Text': '---------', 'Value': ''}]
-	
+
 	# Grab the post variable
 	qs = request.GET.get('app_label')
-	if not qs:
-		HttpResponse(simplejson.dumps(response_list), mimetype='application/javascript')
-	
+
+	# Apps without any models get the bare minimum, enough to fill an empty select box
+	return json_response(get_app_models()['apps'].get(qs, EMPTY_PAYLOAD))
+
+
+@condition(etag_func=get_app_models_etag, last_modified_func=get_app_models_last_modified)
+def contenttypes_by_app(request):
+	"""
+	Returns the model set of every app at once as a JSON object keyed by
+	app_label, with each list in the format of filter_contenttypes_by_app.
+
+	Lets the admin form fill its dropdowns from a single request.
+	"""
+	return json_response(get_app_models()['all'])
+
+
+def change_feed(request, url, feed_type='rss'):
+	"""
+	Serves the feeds in ``correx.feeds``.
+
+	The Last-Modified header comes from the newest change in the feed's
+	scope, and the ETag from its count and newest id too. With a cache
+	shared between processes the ETag also takes in the scope's
+	generation, which moves on with every write to it, including edits
+	the figures from the database miss. Each process keeps its own
+	generations in a per-process cache, where they would give every
+	worker a different ETag for the same feed. A conditional
+	request for a feed that hasn't moved is answered with a 304 before
+	anything is rendered. With CORREX_CACHE_TIMEOUT set, those figures and
+	the rendered feed are both cached until a change in the scope is saved
+	or deleted.
+	"""
+	try:
+		slug, param = url.split('/', 1)
+	except ValueError:
+		slug, param = url, ''
 	try:
-		# Fetch all of the ContentType records from that app
-		content_types = ContentType.objects.filter(app_label=qs)
-	# PERHAPS THIS EXCEPT SHOULD BE MORE QUALIFIED 
-	# AND I SHOULD CONSIDER PASSING BACK AND ERROR
-	# RESPONSE IN THE JSON, WHICH CAN BE GIVEN A 
-	# CUSTOM REPRESENTATION IN THE ADMIN PANEL.
-	except:
+		feed = FEEDS[slug](slug, request)
+	except KeyError:
 		raise Http404
-	
-	# Load the results into the dictionary
-	for ct in content_types:
-		response_list += [{'Text': ct.model, 'Value': str(ct.pk)}]
+	if feed_type == 'atom':
+		feed.feed_type = Atom1Feed
+	bits = param and param.split('/') or []
+	try:
+		obj = feed.get_object(bits)
+	except ObjectDoesNotExist:
+		raise Http404
+
+	scope = feed.get_scope(obj)
+	version = caching.cached(scope, 'feed-version',
+		lambda: feed.get_query_set(obj).aggregate(updated=Max('pub_date'), newest=Max('id'), total=Count('id')))
+	last_modified = version['updated']
+	etag = [feed_type, url, last_modified, version['newest'], version['total']]
+	if caching.is_shared():
+		etag.append(caching.get_generation(scope))
+	etag = md5_constructor(':'.join([unicode(i) for i in etag])).hexdigest()
+
+	def render():
+		feedgen = feed.get_feed(param)
+		return feedgen.mime_type, feedgen.writeString('utf-8')
+
+	def view(request):
+		mime_type, content = caching.cached(scope, 'feed:%s:%s' % (feed_type, md5_constructor(url).hexdigest()), render)
+		return HttpResponse(content, mimetype=mime_type)
+
+	return condition(etag_func=lambda request: etag, last_modified_func=lambda request: last_modified)(view)(request)
+
+
+API_FIELDS = ('id', 'pub_date', 'change_type', 'description', 'site', 'user', 'content_app', 'content_type', 'object_id')
+API_DEFAULT_LIMIT = 20
+API_MAX_LIMIT = 100
+
+
+def encode_cursor(pub_date, pk):
+	"""
+	Packs the position of the last change on a page into a string.
+	"""
+	return '-'.join([str(i) for i in pub_date.timetuple()[:6] + (pub_date.microsecond, pk)])
+
+
+def decode_cursor(cursor):
+	"""
+	Unpacks a cursor from encode_cursor into a (pub_date, pk) pair.
+
+	Raises ValueError if it isn't one, or OverflowError if its numbers are
+	too large for a date.
+	"""
+	bits = [int(i) for i in cursor.split('-')]
+	if len(bits) != 8:
+		raise ValueError
+	return datetime.datetime(*bits[:7]), bits[7]
+
+
+def change_api(request):
+	"""
+	Returns the public changelog as JSON, newest first, a page at a time.
+
+	Accepts these optional GET parameters, which may be combined.
+
+		``site``
+			A site id.
+		``app``
+			An app label.
+		``model``
+			An app_label.model_name string.
+		``object``
+			An object id. Requires ``model``.
+		``user``
+			A username.
+		``limit``
+			The number of changes to return, up to 100. Defaults to 20.
+		``cursor``
+			The ``next`` value from the previous page.
+
+	Pages are found by seeking past the (pub_date, id) of the last change on
+	the previous one rather than with an OFFSET, so every page costs about
+	the same however deep it is. Only the columns in the response are read.
+	"""
+	qs = Change.objects.live()
+	try:
+		if request.GET.get('site'):
+			qs = qs.filter(site=int(request.GET['site']))
+		if request.GET.get('app'):
+			qs = qs.filter(content_app=request.GET['app'])
+		if request.GET.get('model'):
+			model = get_model(*request.GET['model'].split('.'))
+			if model is None:
+				raise ValueError('unknown model')
+			qs = qs.filter(content_type=ContentType.objects.get_for_model(model))
+		if request.GET.get('object'):
+			if not request.GET.get('model'):
+				raise ValueError('object requires model')
+			qs = qs.filter(object_id=int(request.GET['object']))
+		if request.GET.get('user'):
+			user_id = get_user_id(request.GET['user'])
+			if user_id is None:
+				raise ValueError('unknown user')
+			qs = qs.filter(user=user_id)
+		limit = min(int(request.GET.get('limit', API_DEFAULT_LIMIT)), API_MAX_LIMIT)
+		if limit < 1:
+			raise ValueError('limit must be positive')
+		if request.GET.get('cursor'):
+			pub_date, pk = decode_cursor(request.GET['cursor'])
+			qs = qs.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=pk))
+	except (ValueError, TypeError, OverflowError), e:
+		return HttpResponseBadRequest(simplejson.dumps({'error': str(e)}), mimetype='application/json')
+
+	# One more than asked for shows whether there's a page after this one
+	rows = list(qs.order_by('-pub_date', '-id').values_list(*API_FIELDS)[:limit + 1])
+	next_cursor = None
+	if len(rows) > limit:
+		rows = rows[:limit]
+		next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
 
-	return HttpResponse(simplejson.dumps(response_list), mimetype='application/javascript')
+	results = []
+	for pk, pub_date, change_type, description, site, user, content_app, content_type, object_id in rows:
+		label = content_type and get_label(content_type)
+		if label:
+			content_type = '%s.%s' % label
+		results.append({
+			'id': pk,
+			'pub_date': pub_date.isoformat(),
+			'change_type': change_type,
+			'description': description,
+			'site': site,
+			'user': user,
+			'app': content_app,
+			'model': content_type,
+			'object': object_id,
+		})
+	return HttpResponse(simplejson.dumps({'results': results, 'next': next_cursor}), mimetype='application/json')
@@ -3,7 +3,11 @@ from distutils.core import setup
 data = []
 data.extend([
     'templates/admin/correx/*.html',
+    'templates/admin/correx/change/*.html',
+    'templates/correx/feeds/*.html',
+    'templates/correx/*.html',
     'fixtures/*.json',
+    'sql/*.sql',
     'tests/fixtures/*.json'
     ]
 )
@@ -17,6 +21,8 @@ setup(name="django-correx",
       packages=[
          "correx", 
          "correx.fixtures",
+         "correx.management",
+         "correx.management.commands",
          "correx.templatetags",
          "correx.tests",
          "correx.tests.fixtures",